@@ -1,5 +1,13 @@
 import ctypes
-from typing import Callable, List, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .capabilities import (
+    REQUIRED_FEATURES,
+    Capabilities,
+    Feature,
+    UnsupportedFeatureError,
+)
+from .metrics import CallMetrics
 
 # Global variables
 VID_POINTERS: int = 5
@@ -55,26 +63,192 @@ METHOD_SIGNATURES: dict = {
     "SetVideoProcAmp": ([ctypes.c_long], None),
     "SetEventCallback": ([ctypes.CFUNCTYPE(None)], None),
 }
+# DNX64 methods that forward plain values to the DLL, i.e. all but SetEventCallback
+API_METHODS: tuple = tuple(
+    sorted(
+        (set(METHOD_SIGNATURES) - {"SetEventCallback"})
+        | {"GetWiFiImage", "SetWiFiVideoRes"}
+    )
+)
+# Methods whose first argument is not a device index
+NON_DEVICE_METHODS: frozenset = frozenset(
+    {
+        "Init",
+        "EnableMicroTouch",
+        "GetVideoDeviceCount",
+        "GetVideoDeviceIndex",
+        "GetVideoProcAmp",
+        "GetVideoProcAmpValueRange",
+        "GetWiFiVideoCaps",
+        "SetVideoProcAmp",
+        "SetEventCallback",
+    }
+)
 
 
 class DNX64:
-    def __init__(self, dll_path: str) -> None:
+    def __init__(
+        self,
+        dll_path: str,
+        check_capabilities: bool = True,
+        dll: Optional[object] = None,
+    ) -> None:
         """
         Initialize the DNX64 class.
 
         Parameters:
             dll_path (str): Path to the DNX64.dll library file.
-        """
-        self.dnx64 = ctypes.CDLL(dll_path)
+            check_capabilities (bool): Raise UnsupportedFeatureError, without calling
+                the DLL, for methods the device's GetConfig says it does not support.
+            dll (object): Already loaded library to use instead of loading dll_path,
+                e.g. DNX64.simulator.SimulatedDLL().
+        """
+        self.dnx64 = dll if dll is not None else ctypes.CDLL(dll_path)
+        self.check_capabilities = check_capabilities
+        self._capabilities: Dict[int, Capabilities] = {}
+        self._state: Dict[int, Dict[str, Any]] = {}
+        self._video_device_index = 0
+        self.metrics: Optional[CallMetrics] = None
         self.setup()
 
     def setup(self) -> None:
         """
         Set up the signatures for DNX64.dll methods using dictionary constant.
+        When metrics are enabled, each bound method is wrapped to record its latency.
         """
         for method_name, (argtypes, restype) in METHOD_SIGNATURES.items():
-            getattr(self.dnx64, method_name).argtypes = argtypes
-            getattr(self.dnx64, method_name).restype = restype
+            method = getattr(self.dnx64, method_name)
+            method = getattr(method, "__wrapped__", method)
+            method.argtypes = argtypes
+            method.restype = restype
+            if self.metrics is not None:
+                method = self.metrics.wrap(
+                    method_name, method, method_name not in NON_DEVICE_METHODS
+                )
+            setattr(self.dnx64, method_name, method)
+
+    def enable_metrics(self, metrics: Optional[CallMetrics] = None) -> CallMetrics:
+        """
+        Start recording per-method, per-device call counts, errors and latency.
+
+        Parameters:
+            metrics (CallMetrics): Registry to record into, e.g. one shared by
+                several microscopes. A new one is created if omitted.
+
+        Returns:
+            CallMetrics: The registry receiving the calls.
+        """
+        self.metrics = metrics if metrics is not None else CallMetrics()
+        self.setup()
+        return self.metrics
+
+    def disable_metrics(self) -> None:
+        """
+        Stop recording call metrics and restore the unwrapped DLL methods.
+        """
+        self.metrics = None
+        self.setup()
+
+    def capabilities(self, device_index: int) -> Capabilities:
+        """
+        Get the decoded GetConfig features for specified device.
+        Computed once per device and cached until Init() or invalidate_capabilities().
+
+        Parameters:
+            device_index (int): Index of the device.
+
+        Returns:
+            Capabilities: Supported features of the device.
+        """
+        caps = self._capabilities.get(device_index)
+        if caps is None:
+            caps = Capabilities(self.dnx64.GetConfig(device_index))
+            self._capabilities[device_index] = caps
+        return caps
+
+    def invalidate_capabilities(self, device_index: Optional[int] = None) -> None:
+        """
+        Forget cached capabilities, e.g. after swapping the device on an index.
+
+        Parameters:
+            device_index (int): Index of the device, or None for all devices.
+        """
+        if device_index is None:
+            self._capabilities.clear()
+        else:
+            self._capabilities.pop(device_index, None)
+
+    def _require(self, method: str, device_index: int) -> None:
+        """Fail fast if the device lacks the feature `method` requires."""
+        if not self.check_capabilities:
+            return
+        feature = REQUIRED_FEATURES[method]
+        if feature not in self.capabilities(device_index):
+            raise UnsupportedFeatureError(method, device_index, feature)
+
+    def cached_state(self, device_index: int) -> Dict[str, Any]:
+        """
+        Get the last known settings of specified device without calling the DLL.
+        Values are remembered from every Get/Set call made through this object,
+        e.g. "exposure", "auto_exposure", "ae_target", "led_state", "amr",
+        "device_id", "fov" keyed by magnification, and "proc_amp" / "proc_amp_range"
+        keyed by property index. "exposure" is dropped when auto exposure is turned
+        or found on, as the hardware then changes it behind the cache.
+
+        Parameters:
+            device_index (int): Index of the device.
+
+        Returns:
+            Dict[str, Any]: Copy of the cached settings; missing keys are unknown.
+        """
+        state = self._state.get(device_index, {})
+        return {
+            key: dict(value) if isinstance(value, dict) else value
+            for key, value in state.items()
+        }
+
+    @property
+    def video_device_index(self) -> int:
+        """
+        Index last passed to SetVideoDeviceIndex. Video properties are read and
+        written on this device, so their cached values are kept under its index.
+        """
+        return self._video_device_index
+
+    def proc_amp_range(self, prop_value_index: int) -> Tuple[int, int, int, int]:
+        """
+        Get the cached min, max, stepping and default values of a video property,
+        calling GetVideoProcAmpValueRange only the first time for each device.
+
+        Parameters:
+            prop_value_index (int): Index of video property.
+
+        Returns:
+            Tuple[int, int, int, int]: min, max, step, and default
+        """
+        ranges = self._state.get(self._video_device_index, {}).get("proc_amp_range", {})
+        if prop_value_index not in ranges:
+            self.GetVideoProcAmpValueRange(prop_value_index)
+            ranges = self._state[self._video_device_index]["proc_amp_range"]
+        return ranges[prop_value_index]
+
+    def _remember(self, device_index: int, key: str, value: Any) -> None:
+        """Cache the latest known value of a device setting."""
+        state = self._state.get(device_index)
+        if state is None:
+            state = self._state[device_index] = {}
+        state[key] = value
+
+    def _forget(self, device_index: int, key: str) -> None:
+        """Drop a cached setting that may no longer be true."""
+        self._state.get(device_index, {}).pop(key, None)
+
+    def _remember_property(self, key: str, prop_value_index: int, value: Any) -> None:
+        """Cache a video property of the current video device."""
+        state = self._state.get(self._video_device_index)
+        if state is None:
+            state = self._state[self._video_device_index] = {}
+        state.setdefault(key, {})[prop_value_index] = value
 
     def Init(self) -> bool:
         """
@@ -83,6 +257,8 @@ class DNX64:
         Returns:
             bool: True if successful, False otherwise.
         """
+        self._capabilities.clear()
+        self._state.clear()
         try:
             return self.dnx64.Init()
         except OSError as e:
@@ -121,7 +297,9 @@ class DNX64:
         Returns:
             float: Field of view (FOV) in micrometers (um).
         """
-        return self.dnx64.FOVx(device_index, mag)
+        value = self.dnx64.FOVx(device_index, mag)
+        self._state.setdefault(device_index, {}).setdefault("fov", {})[mag] = value
+        return value
 
     def GetAMR(self, device_index: int) -> float:
         """
@@ -135,7 +313,10 @@ class DNX64:
         Returns:
             float: Automatic Magnification Reading (AMR).
         """
-        return self.dnx64.GetAMR(device_index)
+        self._require("GetAMR", device_index)
+        value = self.dnx64.GetAMR(device_index)
+        self._remember(device_index, "amr", value)
+        return value
 
     def GetAutoExposure(self, device_index: int) -> int:
         """
@@ -147,7 +328,11 @@ class DNX64:
         Returns:
             int: Auto exposure value. 0 = 0FF, 1 = ON
         """
-        return self.dnx64.GetAutoExposure(device_index)
+        value = self.dnx64.GetAutoExposure(device_index)
+        self._remember(device_index, "auto_exposure", value)
+        if value:
+            self._forget(device_index, "exposure")
+        return value
 
     def GetConfig(self, device_index: int) -> int:
         """
@@ -161,7 +346,9 @@ class DNX64:
             int: Device configuration in binary format.
         """
 
-        return self.dnx64.GetConfig(device_index)
+        config = self.dnx64.GetConfig(device_index)
+        self._capabilities[device_index] = Capabilities(config)
+        return config
 
     def GetDeviceId(self, device_index: int) -> str:
         """
@@ -173,7 +360,9 @@ class DNX64:
         Returns:
             str: Device ID.
         """
-        return self.dnx64.GetDeviceId(device_index)
+        value = self.dnx64.GetDeviceId(device_index)
+        self._remember(device_index, "device_id", value)
+        return value
 
     def GetDeviceIDA(self, device_index: int) -> str:
         """
@@ -197,7 +386,9 @@ class DNX64:
         Returns:
             int: AE target value.
         """
-        return self.dnx64.GetAETarget(device_index)
+        value = self.dnx64.GetAETarget(device_index)
+        self._remember(device_index, "ae_target", value)
+        return value
 
     def GetExposureValue(self, device_index: int) -> int:
         """
@@ -209,7 +400,9 @@ class DNX64:
         Returns:
             int: Exposure value.
         """
-        return self.dnx64.GetExposureValue(device_index)
+        value = self.dnx64.GetExposureValue(device_index)
+        self._remember(device_index, "exposure", value)
+        return value
 
     def GetLensFinePosLimits(self, device_index: int) -> Tuple[int, int]:
         """
@@ -223,6 +416,7 @@ class DNX64:
         Returns:
             Tuple[int, int]: Upper and lower lens fine position limits.
         """
+        self._require("GetLensFinePosLimits", device_index)
         upper_limit, lower_limit = ctypes.c_long(), ctypes.c_long()
         self.dnx64.GetLensFinePosLimits(device_index, upper_limit, lower_limit)
         return upper_limit.value, lower_limit.value
@@ -239,6 +433,7 @@ class DNX64:
         Returns:
             Tuple[int, int]: Upper and lower lens position limits.
         """
+        self._require("GetLensPosLimits", device_index)
         upper_limit, lower_limit = ctypes.c_long(), ctypes.c_long()
         self.dnx64.GetLensPosLimits(device_index, upper_limit, lower_limit)
         return upper_limit.value, lower_limit.value
@@ -286,7 +481,9 @@ class DNX64:
             int: Video processing amplitude of indexed value
 
         """
-        return self.dnx64.GetVideoProcAmp(prop_value_index)
+        value = self.dnx64.GetVideoProcAmp(prop_value_index)
+        self._remember_property("proc_amp", prop_value_index, value)
+        return value
 
     def GetVideoProcAmpValueRange(
         self, prop_value_index: int
@@ -305,6 +502,11 @@ class DNX64:
         params = [ctypes.c_long() for _ in range(VID_PARAMS)]
         self.dnx64.GetVideoProcAmpValueRange(prop_value_index, *params)
         min_val, max_val, stepping, default = [param.value for param in params]
+        self._remember_property(
+            "proc_amp_range",
+            prop_value_index.value,
+            (min_val, max_val, stepping, default),
+        )
         return prop_value_index.value, min_val, max_val, stepping, default
 
     def GetWiFiImage(self, filename: str) -> bool:
@@ -359,6 +561,7 @@ class DNX64:
             ae_target (int): AE target value. Acceptable Range: 16 to 20
         """
         self.dnx64.SetAETarget(device_index, ae_target)
+        self._remember(device_index, "ae_target", ae_target)
 
     def SetAutoExposure(self, device_index: int, ae_state: int) -> None:
         """
@@ -369,6 +572,10 @@ class DNX64:
             ae_state (int): Auto exposure value. Accepts 0 and 1.
         """
         self.dnx64.SetAutoExposure(device_index, ae_state)
+        self._remember(device_index, "auto_exposure", ae_state)
+        if ae_state:
+            # The hardware now changes the exposure; a cached value would go stale
+            self._forget(device_index, "exposure")
 
     def SetAimpointLevel(self, device_index: int, apl_level: int) -> None:
         """
@@ -380,7 +587,9 @@ class DNX64:
             device_index (int): Index of the device.
             apl_level (int): Aim point laser level. Accepts 0 to 6.
         """
+        self._require("SetAimpointLevel", device_index)
         self.dnx64.SetAimpointLevel(device_index, apl_level)
+        self._remember(device_index, "apl_level", apl_level)
 
     def SetAXILevel(self, device_index: int, axi_level: int) -> None:
         """
@@ -392,7 +601,9 @@ class DNX64:
             device_index (int): Index of the device.
             axi_level (int): AXI level. Accepts 0 to 6.
         """
+        self._require("SetAXILevel", device_index)
         self.dnx64.SetAXILevel(device_index, axi_level)
+        self._remember(device_index, "axi_level", axi_level)
 
     def SetEventCallback(self, external_callback: Callable) -> None:
         """
@@ -415,6 +626,7 @@ class DNX64:
             exposure_value (int): Exposure value.
         """
         self.dnx64.SetExposureValue(device_index, exposure_value)
+        self._remember(device_index, "exposure", exposure_value)
 
     def SetFLCSwitch(self, device_index: int, flc_quadrant: int) -> None:
         """
@@ -427,7 +639,9 @@ class DNX64:
             device_index (int): Index of the device.
             flc_quadrant (int): FLC quadrant.
         """
+        self._require("SetFLCSwitch", device_index)
         self.dnx64.SetFLCSwitch(device_index, flc_quadrant)
+        self._remember(device_index, "flc_switch", flc_quadrant)
 
     def SetFLCLevel(self, device_index: int, flc_level: int) -> None:
         """
@@ -437,7 +651,9 @@ class DNX64:
             device_index (int): Index of the device.
             flc_level (int): FLC level. Accepts 1 to 6
         """
+        self._require("SetFLCLevel", device_index)
         self.dnx64.SetFLCLevel(device_index, flc_level)
+        self._remember(device_index, "flc_level", flc_level)
 
     def SetLEDState(self, device_index: int, led_state: int) -> None:
         """
@@ -452,6 +668,7 @@ class DNX64:
             led_state (int): LED state.
         """
         self.dnx64.SetLEDState(device_index, led_state)
+        self._remember(device_index, "led_state", led_state)
 
     def SetLensInitPos(self, device_index: int) -> None:
         """
@@ -462,6 +679,7 @@ class DNX64:
         Parameters:
             device_index (int): Index of the device.
         """
+        self._require("SetLensInitPos", device_index)
         self.dnx64.SetLensInitPos(device_index)
 
     def SetLensFinePos(self, device_index: int, lens_fine_position: int) -> None:
@@ -474,7 +692,9 @@ class DNX64:
             device_index (int): Index of the device.
             lens_fine_position (int): Lens fine position.
         """
+        self._require("SetLensFinePos", device_index)
         self.dnx64.SetLensFinePos(device_index, lens_fine_position)
+        self._remember(device_index, "lens_fine_position", lens_fine_position)
 
     def SetLensPos(self, device_index: int, lens_position: int) -> None:
         """
@@ -486,7 +706,9 @@ class DNX64:
             device_index (int): Index of the device.
             lens_position (int): Lens position.
         """
+        self._require("SetLensPos", device_index)
         self.dnx64.SetLensPos(device_index, lens_position)
+        self._remember(device_index, "lens_position", lens_position)
 
     def SetVideoDeviceIndex(self, device_index: int) -> None:
         """
@@ -496,6 +718,7 @@ class DNX64:
             device_index (int): Index of the video device.
         """
         self.dnx64.SetVideoDeviceIndex(device_index)
+        self._video_device_index = device_index
 
     def SetVideoProcAmp(self, prop_value_index: int, value: int) -> None:
         """
@@ -508,6 +731,7 @@ class DNX64:
             value (int):  Updated video property with this given value.
         """
         self.dnx64.SetVideoProcAmp(prop_value_index, value)
+        self._remember_property("proc_amp", prop_value_index, value)
 
     def SetWiFiVideoRes(self, width: int, height: int) -> bool:
         """
@@ -531,4 +755,6 @@ class DNX64:
             Quadrant (int): Quadrant number (1-4).
             Value (int): EFLC value. (1-31 is the quadrant's brightness level, and 32 is to turn the quadrant off).
         """
+        self._require("SetEFLC", DeviceIndex)
         self.dnx64.SetEFLC(DeviceIndex, Quadrant, Value)
+        self._remember(DeviceIndex, f"eflc_{Quadrant}", Value)
@@ -0,0 +1,344 @@
+"""
+Software auto exposure metered on a region of interest.
+
+The hardware auto exposure (`SetAutoExposure`, `SetAETarget` 16 to 20) meters the
+whole frame and tends to hunt under ring lights. `SoftwareAE` turns it off and
+closes the loop itself: each frame, a 256-bin histogram of a downsampled
+grayscale copy of the ROI gives the mean luminance and the share of clipped
+pixels, and the exposure is scaled towards the target through a `CommandQueue`,
+so a burst of corrections never backs up in the DLL.
+
+Each correction is damped and limited to `max_step` per command, the damping is
+halved whenever the luminance overshoots the target, and frames are skipped until
+the queue has sent the new exposure and for `delay_frames` after, as those were
+still exposed with the old value. An adjustment ends when the luminance stayed
+within `tolerance` of the target for `settle_frames` frames, or after
+`max_frames`; its frames, time and overshoots are kept in `history`.
+
+    ae = SoftwareAE(microscope, 0, roi=(480, 360, 320, 240))
+    ae.enable()
+    while True:
+        ret, frame = camera.read()
+        ae.update(frame)
+    ae.close()
+"""
+
+import collections
+import threading
+import time
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .commands import CommandQueue
+from .profiles import EXPOSURE_RANGE
+
+# Gray levels at or above this count as clipped
+CLIP_LEVEL = 250
+
+
+class Adjustment:
+    """
+    One convergence of the controller, from the first correction to settling.
+
+    Attributes:
+        start_exposure (int): Exposure value when the adjustment started.
+        exposure (int): Exposure value it ended on.
+        frames (int): Frames from start to end.
+        seconds (float): Time from start to end.
+        commands (int): SetExposureValue calls submitted.
+        overshoots (int): Times the luminance crossed the target.
+        converged (bool): False if it ended on `max_frames` or an exposure limit.
+    """
+
+    __slots__ = (
+        "start_exposure",
+        "exposure",
+        "frames",
+        "seconds",
+        "commands",
+        "overshoots",
+        "converged",
+        "_start",
+    )
+
+    def __init__(self, start_exposure: int) -> None:
+        self.start_exposure = start_exposure
+        self.exposure = start_exposure
+        self.frames = 0
+        self.seconds = 0.0
+        self.commands = 0
+        self.overshoots = 0
+        self.converged = False
+        self._start = time.perf_counter()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "start_exposure": self.start_exposure,
+            "exposure": self.exposure,
+            "frames": self.frames,
+            "seconds": self.seconds,
+            "commands": self.commands,
+            "overshoots": self.overshoots,
+            "converged": self.converged,
+        }
+
+
+class SoftwareAE:
+    """
+    Closed-loop exposure control from live frame histograms.
+
+    Attributes:
+        target (float): Mean gray level aimed for, 0 to 255.
+        roi (Tuple[int, int, int, int]): x, y, width, height metered, in full-frame
+            pixels, or None for the whole frame.
+        exposure (int): Exposure value last submitted.
+        mean (float): Mean luminance of the last frame.
+        clipped (float): Share of ROI pixels at or above CLIP_LEVEL.
+        histogram (numpy.ndarray): 256-bin histogram of the last frame.
+        adjustment (Adjustment): Adjustment in progress, or None.
+        history (Deque[Adjustment]): Finished adjustments, most recent last.
+    """
+
+    def __init__(
+        self,
+        microscope,
+        device_index: int,
+        commands: Optional[CommandQueue] = None,
+        target: float = 118.0,
+        roi: Optional[Tuple[int, int, int, int]] = None,
+        width: int = 160,
+        tolerance: float = 0.05,
+        settle_frames: int = 3,
+        max_frames: int = 45,
+        max_step: float = 2.0,
+        gain: float = 0.8,
+        delay_frames: int = 2,
+        max_clipped: float = 0.02,
+        exposure_range: Tuple[int, int] = EXPOSURE_RANGE,
+        history: int = 64,
+    ) -> None:
+        """
+        Initialize the controller; call `enable()` to take over the exposure.
+
+        Parameters:
+            microscope (DNX64): Microscope of the device.
+            device_index (int): Index of the device.
+            commands (CommandQueue): Command path shared with other controls, or
+                None to create one for this controller.
+            target (float): Mean gray level aimed for.
+            roi (Tuple[int, int, int, int]): Region metered, or None.
+            width (int): Width of the downsampled copy metered.
+            tolerance (float): Relative luminance error accepted as converged; a
+                new adjustment starts above twice this, so noise does not retrigger.
+            settle_frames (int): Consecutive frames within tolerance to converge.
+            max_frames (int): Most frames one adjustment may take.
+            max_step (float): Largest exposure factor of one correction.
+            gain (float): Damping exponent of each correction, 1 corrects fully.
+            delay_frames (int): Frames skipped after a correction was sent to the
+                DLL, still exposed with the old value.
+            max_clipped (float): Share of clipped pixels that forces the exposure
+                down, whatever the mean.
+            exposure_range (Tuple[int, int]): Exposure values allowed; see the
+                parameter table of your model.
+            history (int): Finished adjustments kept.
+        """
+        self.microscope = microscope
+        self.device_index = device_index
+        self.commands = commands if commands is not None else CommandQueue(microscope)
+        self._own_commands = commands is None
+        self.target = target
+        self.roi = roi
+        self.width = width
+        self.tolerance = tolerance
+        self.settle_frames = settle_frames
+        self.max_frames = max_frames
+        self.max_step = max_step
+        self.gain = gain
+        self.delay_frames = delay_frames
+        self.max_clipped = max_clipped
+        self.exposure_range = exposure_range
+        self.enabled = False
+        self.exposure = 0
+        self.mean = 0.0
+        self.clipped = 0.0
+        self.histogram: Optional[np.ndarray] = None
+        self.adjustment: Optional[Adjustment] = None
+        self.history: Deque[Adjustment] = collections.deque(maxlen=history)
+        self._auto_exposure: Optional[int] = None
+        self._gain = gain
+        self._wait = 0
+        self._sent: Optional[threading.Event] = None
+        self._settled = 0
+        self._cooldown = 0
+        self._last_error = 0.0
+        self._levels = np.arange(256, dtype=np.float32)
+
+    def enable(self) -> None:
+        """Turn the hardware auto exposure off and start controlling the exposure."""
+        if self.enabled:
+            return
+        state = self.microscope.cached_state(self.device_index)
+        self._auto_exposure = state.get("auto_exposure")
+        if self._auto_exposure is None:
+            self._auto_exposure = self.microscope.GetAutoExposure(self.device_index)
+        exposure = state.get("exposure")
+        if exposure is None:
+            exposure = self.microscope.GetExposureValue(self.device_index)
+        self.exposure = int(exposure)
+        self._submit("SetAutoExposure", 0)
+        self.enabled = True
+        self._cooldown = 0
+
+    def disable(self, restore: bool = True) -> None:
+        """
+        Stop controlling the exposure.
+
+        Parameters:
+            restore (bool): Restore the hardware auto exposure state found by
+                `enable()`; otherwise the last exposure value is kept.
+        """
+        if not self.enabled:
+            return
+        self.enabled = False
+        if self.adjustment is not None:
+            self._finish(False)
+        if restore and self._auto_exposure:
+            self.commands.submit(
+                "SetAutoExposure", self.device_index, self._auto_exposure
+            )
+        self.commands.flush()
+
+    def close(self) -> None:
+        """Disable the controller and stop its command queue if it owns one."""
+        self.disable()
+        if self._own_commands:
+            self.commands.close()
+
+    def measure(self, frame: np.ndarray) -> float:
+        """
+        Meter a frame: histogram, mean luminance and clipped share of the ROI.
+
+        Parameters:
+            frame (numpy.ndarray): BGR or gray uint8 frame.
+
+        Returns:
+            float: Mean gray level, 0 to 255.
+        """
+        if self.roi is not None:
+            x, y, w, h = self.roi
+            frame = frame[y : y + h, x : x + w]
+        height, width = frame.shape[:2]
+        if width > self.width:
+            size = (self.width, max(1, round(height * self.width / width)))
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        histogram = cv2.calcHist([frame], [0], None, [256], [0, 256]).ravel()
+        total = float(histogram.sum()) or 1.0
+        self.histogram = histogram
+        self.mean = float(histogram.dot(self._levels)) / total
+        self.clipped = float(histogram[CLIP_LEVEL:].sum()) / total
+        return self.mean
+
+    def update(self, frame: np.ndarray) -> bool:
+        """
+        Meter the next frame and correct the exposure if needed.
+
+        Parameters:
+            frame (numpy.ndarray): Live frame.
+
+        Returns:
+            bool: True while an adjustment is in progress.
+        """
+        if not self.enabled:
+            return False
+        mean = self.measure(frame)
+        adjustment = self.adjustment
+        if adjustment is not None:
+            adjustment.frames += 1
+        if self._sent is not None:
+            if not self._sent.is_set():
+                # Still waiting for the queue; this frame has the old exposure
+                return adjustment is not None
+            self._sent = None
+            self._wait = self.delay_frames
+        if self._wait:
+            self._wait -= 1
+            return adjustment is not None
+        error = (self.target - mean) / self.target
+        clipping = self.clipped > self.max_clipped
+        if adjustment is None:
+            if self._cooldown:
+                self._cooldown -= 1
+                return False
+            if abs(error) <= 2 * self.tolerance and not clipping:
+                return False
+            adjustment = self.adjustment = Adjustment(self.exposure)
+            adjustment.frames = 1
+            self._gain = self.gain
+            self._settled = 0
+            self._last_error = 0.0
+        if abs(error) <= self.tolerance and not clipping:
+            self._settled += 1
+            if self._settled >= self.settle_frames:
+                self._finish(True)
+                return False
+            return True
+        self._settled = 0
+        if self._last_error * error < 0:
+            # Crossed the target: damp harder so the next step lands short of it
+            adjustment.overshoots += 1
+            self._gain *= 0.5
+        self._last_error = error
+        if adjustment.frames >= self.max_frames:
+            self._finish(False)
+            return False
+        ratio = self.target / max(mean, 1.0)
+        if clipping:
+            ratio = min(ratio, 0.75)
+        step = min(max(ratio**self._gain, 1.0 / self.max_step), self.max_step)
+        low, high = self.exposure_range
+        exposure = min(max(int(round(self.exposure * step)), low), high)
+        if exposure == self.exposure:
+            # At an exposure limit, or the step rounds to nothing
+            self._finish(False)
+            return False
+        self.exposure = exposure
+        self._submit("SetExposureValue", exposure)
+        adjustment.commands += 1
+        return True
+
+    def _submit(self, method: str, value: int) -> None:
+        """Queue a setter and hold off metering until the queue has sent it."""
+        self._sent = threading.Event()
+        self.commands.submit(method, self.device_index, value, on_sent=self._sent.set)
+
+    def _finish(self, converged: bool) -> None:
+        adjustment = self.adjustment
+        adjustment.exposure = self.exposure
+        adjustment.converged = converged
+        adjustment.seconds = time.perf_counter() - adjustment._start
+        self.history.append(adjustment)
+        self.adjustment = None
+        if not converged:
+            # Give up for a while rather than hunting on an unreachable target
+            self._cooldown = self.max_frames
+
+    def stats(self) -> Dict[str, Any]:
+        """Summarise the finished adjustments."""
+        done = list(self.history)
+        converged = [a for a in done if a.converged]
+        return {
+            "adjustments": len(done),
+            "converged": len(converged),
+            "mean_frames": (
+                sum(a.frames for a in converged) / len(converged) if converged else 0.0
+            ),
+            "max_frames": max((a.frames for a in converged), default=0),
+            "mean_seconds": (
+                sum(a.seconds for a in converged) / len(converged) if converged else 0.0
+            ),
+            "overshoots": sum(a.overshoots for a in done),
+        }
@@ -0,0 +1,479 @@
+"""
+Reproducible benchmarks for the control path and the frame pipeline.
+
+Everything runs against a zero-latency `SimulatedDLL` and `SyntheticFrameSource`
+frames, so results depend only on the Python side and the machine. Groups:
+
+    control   time per call of each DNX64 method, i.e. the wrapper overhead
+    cache     capability and state cache hits and misses, device enumeration
+    queue     setters per second through a CommandQueue, and its round trip
+    frames    capture -> process -> display -> record FPS and stage times at several
+              sizes; display is the frame conversion, not the window painting
+    encode    PNG and JPEG snapshot encode time
+    startup   cold start of `python -m DNX64 info`
+
+`run_suite()` returns a results document that `save_results()` writes as JSON;
+`compare()` checks it against a stored baseline with a relative threshold:
+
+    python -m DNX64 bench -o results.json --baseline baseline.json --threshold 0.2
+
+Repeat `--threshold GROUP=PCT` to give a group or benchmark its own budget, e.g.
+`--threshold frames=0.3 --threshold control.Init=0.5`.
+
+The frames and encode groups need NumPy and OpenCV and are skipped without them.
+"""
+
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+FORMAT_VERSION = 1
+GROUPS = ("control", "cache", "queue", "frames", "encode", "startup")
+# Sizes of the frame and encode groups: VGA, the usual preview and 5 MP stills
+RESOLUTIONS = ((640, 480), (1280, 960), (2592, 1944))
+WINDOW_SIZE = (1280, 960)
+
+# Arguments used to call each DNX64 method in the control group
+CONTROL_CALLS: Dict[str, Tuple] = {
+    "Init": (),
+    "EnableMicroTouch": (False,),
+    "FOVx": (0, 50.0),
+    "GetAMR": (0,),
+    "GetAETarget": (0,),
+    "GetAutoExposure": (0,),
+    "GetConfig": (0,),
+    "GetDeviceId": (0,),
+    "GetDeviceIDA": (0,),
+    "GetExposureValue": (0,),
+    "GetLensFinePosLimits": (0,),
+    "GetLensPosLimits": (0,),
+    "GetVideoDeviceCount": (),
+    "GetVideoDeviceIndex": (),
+    "GetVideoDeviceName": (0,),
+    "GetVideoProcAmp": (0,),
+    "GetVideoProcAmpValueRange": (0,),
+    "GetWiFiVideoCaps": (),
+    "SetAETarget": (0, 18),
+    "SetAutoExposure": (0, 1),
+    "SetAimpointLevel": (0, 1),
+    "SetAXILevel": (0, 1),
+    "SetEFLC": (0, 1, 16),
+    "SetExposureValue": (0, 1000),
+    "SetFLCLevel": (0, 3),
+    "SetFLCSwitch": (0, 15),
+    "SetLEDState": (0, 1),
+    "SetLensFinePos": (0, 100),
+    "SetLensInitPos": (0,),
+    "SetLensPos": (0, 100),
+    "SetVideoDeviceIndex": (0,),
+    "SetVideoProcAmp": (0, 0),
+    "SetWiFiVideoRes": (640, 480),
+}
+
+
+class BenchmarkResults:
+    """
+    Named measurements of one suite run.
+
+    Attributes:
+        meta (Dict[str, Any]): Python, platform and library versions.
+        results (Dict[str, Dict[str, Any]]): {"value", "unit", "higher_is_better"}
+            by benchmark name, e.g. "control.GetAMR".
+        skipped (Dict[str, str]): Reason by group name.
+    """
+
+    def __init__(self) -> None:
+        self.meta: Dict[str, Any] = {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.skipped: Dict[str, str] = {}
+
+    def add(
+        self, name: str, value: float, unit: str, higher_is_better: bool = False
+    ) -> None:
+        self.results[name] = {
+            "value": value,
+            "unit": unit,
+            "higher_is_better": higher_is_better,
+        }
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "version": FORMAT_VERSION,
+            "meta": self.meta,
+            "results": self.results,
+            "skipped": self.skipped,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "BenchmarkResults":
+        if data.get("version") != FORMAT_VERSION:
+            raise ValueError(f"unsupported benchmark format {data.get('version')!r}")
+        results = cls()
+        results.meta = data.get("meta", {})
+        results.results = data.get("results", {})
+        results.skipped = data.get("skipped", {})
+        return results
+
+    def format(self) -> str:
+        """Render the results as a text table."""
+        lines = [
+            f"{name:<40}{r['value']:>14.2f} {r['unit']}"
+            for name, r in self.results.items()
+        ]
+        for group, reason in self.skipped.items():
+            lines.append(f"{group:<40}{'skipped':>14} ({reason})")
+        return "\n".join(lines)
+
+
+def save_results(results: BenchmarkResults, path: str) -> None:
+    """Write results, e.g. a new baseline, as JSON."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results.as_dict(), f, indent=2)
+
+
+def load_results(path: str) -> BenchmarkResults:
+    """Read results written by `save_results()`."""
+    with open(path, encoding="utf-8") as f:
+        return BenchmarkResults.from_dict(json.load(f))
+
+
+class BenchmarkComparison:
+    """One benchmark measured in the baseline and in the current run."""
+
+    def __init__(
+        self, name: str, baseline: float, current: float, higher_is_better: bool
+    ) -> None:
+        self.name = name
+        self.baseline = baseline
+        self.current = current
+        self.higher_is_better = higher_is_better
+
+    @property
+    def change(self) -> float:
+        """Relative slowdown, e.g. 0.25 for 25% worse; negative when faster."""
+        if self.baseline == 0 or self.current == 0:
+            return 0.0
+        if self.higher_is_better:
+            return self.baseline / self.current - 1.0
+        return self.current / self.baseline - 1.0
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "baseline": self.baseline,
+            "current": self.current,
+            "change": self.change,
+        }
+
+
+def compare(
+    current: BenchmarkResults,
+    baseline: BenchmarkResults,
+    threshold: float = 0.2,
+    thresholds: Optional[Dict[str, float]] = None,
+) -> List[BenchmarkComparison]:
+    """
+    Find benchmarks that got worse than the baseline by more than a threshold.
+
+    Parameters:
+        current (BenchmarkResults): Results of this run.
+        baseline (BenchmarkResults): Stored results to compare against.
+        threshold (float): Allowed relative slowdown, e.g. 0.2 for 20%.
+        thresholds (Dict[str, float]): Overrides by benchmark name or group prefix,
+            e.g. {"frames": 0.3, "control.Init": 0.5}; the longest match wins.
+
+    Returns:
+        List[BenchmarkComparison]: Regressed benchmarks, worst first.
+    """
+    thresholds = thresholds or {}
+    regressions = []
+    for name, result in current.results.items():
+        reference = baseline.results.get(name)
+        if reference is None:
+            continue
+        comparison = BenchmarkComparison(
+            name, reference["value"], result["value"], result["higher_is_better"]
+        )
+        prefixes = [p for p in thresholds if name == p or name.startswith(p + ".")]
+        limit = thresholds[max(prefixes, key=len)] if prefixes else threshold
+        if comparison.change > limit:
+            regressions.append(comparison)
+    return sorted(regressions, key=lambda c: c.change, reverse=True)
+
+
+def _per_call_ns(func: Callable, number: int, repeat: int) -> float:
+    """Best-of-`repeat` time per call in nanoseconds."""
+    return min(timeit.Timer(func).repeat(repeat, number)) / number * 1e9
+
+
+def _median(values: Sequence[float]) -> float:
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def _simulated_microscope(device_count: int = 1):
+    from . import DNX64
+    from .simulator import SimulatedDLL
+
+    # All optional features on, so feature-gated setters run instead of raising
+    return DNX64("", dll=SimulatedDLL(config=0xF3, device_count=device_count))
+
+
+def bench_control(results: BenchmarkResults, number: int, repeat: int) -> None:
+    microscope = _simulated_microscope()
+    floor = microscope.dnx64.GetVideoDeviceCount
+    results.add("control.raw_call", _per_call_ns(floor, number, repeat), "ns")
+    for method, args in CONTROL_CALLS.items():
+        func = getattr(microscope, method)
+        ns = _per_call_ns(lambda: func(*args), number, repeat)
+        results.add(f"control.{method}", ns, "ns")
+    plain = _per_call_ns(lambda: microscope.GetAMR(0), number, repeat)
+    microscope.enable_metrics()
+    measured = _per_call_ns(lambda: microscope.GetAMR(0), number, repeat)
+    microscope.disable_metrics()
+    results.add("control.metrics_overhead", max(measured - plain, 0.0), "ns")
+
+
+def bench_cache(results: BenchmarkResults, number: int, repeat: int) -> None:
+    microscope = _simulated_microscope(device_count=4)
+    microscope.capabilities(0)
+    microscope.GetVideoProcAmpValueRange(0)
+
+    def miss():
+        microscope.invalidate_capabilities(0)
+        microscope.capabilities(0)
+
+    def enumerate_devices():
+        for index in range(microscope.GetVideoDeviceCount()):
+            microscope.GetVideoDeviceName(index)
+
+    results.add(
+        "cache.capabilities_hit",
+        _per_call_ns(lambda: microscope.capabilities(0), number, repeat),
+        "ns",
+    )
+    results.add("cache.capabilities_miss", _per_call_ns(miss, number, repeat), "ns")
+    results.add(
+        "cache.cached_state",
+        _per_call_ns(lambda: microscope.cached_state(0), number, repeat),
+        "ns",
+    )
+    results.add(
+        "cache.proc_amp_range",
+        _per_call_ns(lambda: microscope.proc_amp_range(0), number, repeat),
+        "ns",
+    )
+    results.add(
+        "cache.enumerate_4_devices",
+        _per_call_ns(enumerate_devices, max(number // 10, 1), repeat),
+        "ns",
+    )
+
+
+def bench_queue(results: BenchmarkResults, number: int, repeat: int) -> None:
+    """
+    Producers on several threads submit setters to a `CommandQueue` without rate
+    limit; measures submissions per second until flushed, coalescing included,
+    and the submit-to-sent round trip of one command.
+    """
+    from .commands import CommandQueue
+
+    producers = 4
+    microscope = _simulated_microscope(producers)
+
+    def run() -> float:
+        commands = CommandQueue(microscope, min_interval=0.0)
+
+        def produce(device: int):
+            for value in range(number):
+                commands.submit("SetExposureValue", device, value)
+
+        threads = [
+            threading.Thread(target=produce, args=(device,))
+            for device in range(producers)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        commands.flush()
+        elapsed = time.perf_counter() - start
+        commands.close()
+        return commands.submitted / elapsed
+
+    rates = [run() for _ in range(repeat)]
+    results.add("queue.commands", max(rates), "calls/s", higher_is_better=True)
+
+    with CommandQueue(microscope, min_interval=0.0) as commands:
+
+        def roundtrip():
+            commands.submit("SetExposureValue", 0, 100)
+            commands.flush()
+
+        results.add(
+            "queue.roundtrip",
+            _per_call_ns(roundtrip, max(number // 10, 1), repeat),
+            "ns",
+        )
+
+
+def bench_frames(results: BenchmarkResults, number: int, repeat: int) -> None:
+    """
+    Capture -> process -> display -> record at each of RESOLUTIONS. "display" is
+    the BGR to BGRA conversion of the preview frame that HighGUI makes; painting
+    the window is not measured.
+    """
+    import cv2
+
+    from .sources import SyntheticFrameSource
+    from .timing import PipelineTimer
+
+    frames = max(number // 20, 10)
+    for width, height in RESOLUTIONS:
+        size = f"{width}x{height}"
+        runs = []
+        for _ in range(repeat):
+            source = SyntheticFrameSource(width, height)
+            timer = PipelineTimer(window=frames)
+            with tempfile.TemporaryDirectory() as directory:
+                writer = cv2.VideoWriter(
+                    os.path.join(directory, "bench.avi"),
+                    cv2.VideoWriter.fourcc(*"MJPG"),
+                    30,
+                    (width, height),
+                )
+                for _ in range(frames):
+                    timing = timer.begin()
+                    _, frame = source.read()
+                    timing.mark("capture", source.timestamp)
+                    resized = cv2.resize(frame, WINDOW_SIZE)
+                    timing.mark("process")
+                    # What a HighGUI window does before painting; painting needs
+                    # a screen and is left out, so runs compare across machines
+                    cv2.cvtColor(resized, cv2.COLOR_BGR2BGRA)
+                    timing.mark("display")
+                    if writer.isOpened():
+                        writer.write(frame)
+                        timing.mark("record")
+                    timer.end(timing)
+                writer.release()
+            runs.append(timer.report())
+        best = max(runs, key=lambda r: r["pipeline"]["fps"])
+        results.add(
+            f"frames.{size}.fps", best["pipeline"]["fps"], "fps", higher_is_better=True
+        )
+        for stage, stats in best.items():
+            if stage != "pipeline":
+                results.add(f"frames.{size}.{stage}", stats["p50_ms"], "ms")
+
+
+def bench_encode(results: BenchmarkResults, number: int, repeat: int) -> None:
+    import cv2
+
+    from .sources import SyntheticFrameSource
+
+    encodes = max(number // 100, 3)
+    for width, height in RESOLUTIONS:
+        _, frame = SyntheticFrameSource(width, height).read()
+        for extension in (".png", ".jpg"):
+            ms = _per_call_ns(lambda: cv2.imencode(extension, frame), encodes, repeat)
+            results.add(f"encode.{width}x{height}.{extension[1:]}", ms / 1e6, "ms")
+
+
+def measure_cold_start(command: List[str], runs: int) -> List[float]:
+    """
+    Time fresh interpreter runs of a command.
+
+    Parameters:
+        command (List[str]): Arguments after the Python executable; run in the
+            folder holding the DNX64 package, which is also put on PYTHONPATH.
+        runs (int): Number of runs.
+
+    Returns:
+        List[float]: Sorted wall time of each run in milliseconds.
+    """
+    import subprocess
+
+    # Run from the folder holding this package, so the result does not depend on
+    # where the benchmark was started or on another installed copy
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [root] + [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p]
+    )
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + command,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            cwd=root,
+            env=env,
+        )
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return sorted(timings)
+
+
+def bench_startup(results: BenchmarkResults, number: int, repeat: int) -> None:
+    runs = max(repeat, 3)
+    info = measure_cold_start(["-m", "DNX64", "--simulate", "info"], runs)
+    interpreter = measure_cold_start(["-c", "pass"], runs)
+    results.add("startup.info", _median(info), "ms")
+    results.add("startup.interpreter", _median(interpreter), "ms")
+
+
+BENCHMARKS: Dict[str, Callable[[BenchmarkResults, int, int], None]] = {
+    "control": bench_control,
+    "cache": bench_cache,
+    "queue": bench_queue,
+    "frames": bench_frames,
+    "encode": bench_encode,
+    "startup": bench_startup,
+}
+
+
+def run_suite(
+    groups: Sequence[str] = GROUPS, number: int = 2000, repeat: int = 5
+) -> BenchmarkResults:
+    """
+    Run benchmark groups.
+
+    Parameters:
+        groups (Sequence[str]): Groups to run, see `GROUPS`.
+        number (int): Calls per timing loop in the micro benchmarks; frame and
+            encode counts are derived from it.
+        repeat (int): Timing loops per benchmark; the best one is kept.
+
+    Returns:
+        BenchmarkResults: Measurements, with groups whose dependencies are missing
+        listed in `skipped`.
+    """
+    results = BenchmarkResults()
+    for module in ("numpy", "cv2"):
+        try:
+            results.meta[module] = __import__(module).__version__
+        except ImportError:
+            pass
+    for group in groups:
+        if group not in BENCHMARKS:
+            raise ValueError(f"Unknown benchmark group {group!r}; choose from {GROUPS}")
+        try:
+            BENCHMARKS[group](results, number, repeat)
+        except ImportError as e:
+            results.skipped[group] = str(e)
+    return results
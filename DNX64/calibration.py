@@ -0,0 +1,254 @@
+"""
+Dark-frame and flat-field calibration.
+
+Master dark and flat frames are averages of many frames, stored per device ID,
+LED state and FLC configuration by a `CalibrationStore`, since vignetting and
+illumination change with each of them. A `FlatFieldCorrector` turns a pair of
+masters into a rounded dark frame and a per-pixel gain map, computed in float32
+once and kept as unsigned 8-bit fixed point, so correcting a frame is one
+saturating subtract and one scaled multiply (about 1.5 ms at 1280x960).
+
+    store = CalibrationStore("calibration")
+    key = calibration_key(microscope, 0)
+    store.save(key, "dark", capture_dark(microscope, camera, 0))  # lens covered
+    store.save(key, "flat", average_frames(camera))  # uniform white target
+    corrector = store.corrector(key)
+    corrected = corrector.apply(frame)
+"""
+
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+INDEX_FILE = "index.json"
+KINDS = ("dark", "flat")
+# Largest gain applied; pixels needing more are left under-corrected
+MAX_GAIN = 4.0
+
+
+def calibration_key(microscope, device_index: int) -> str:
+    """
+    Get the calibration key of a device's current lighting configuration.
+
+    The device ID is read once and then taken from the cached state; the LED and
+    FLC settings come from the cached state only, so set them through this
+    microscope before calibrating. Unknown settings appear as "na".
+
+    Parameters:
+        microscope (DNX64): Microscope of the device.
+        device_index (int): Index of the device.
+
+    Returns:
+        str: Key such as "ABC12345_led1_flc15-3".
+    """
+    state = microscope.cached_state(device_index)
+    device_id = state.get("device_id") or microscope.GetDeviceId(device_index)
+    device_id = re.sub(r"[^A-Za-z0-9-]+", "-", str(device_id)).strip("-") or "device"
+    led = state.get("led_state", "na")
+    flc = f"{state.get('flc_switch', 'na')}-{state.get('flc_level', 'na')}"
+    return f"{device_id}_led{led}_flc{flc}"
+
+
+def average_frames(camera, count: int = 16, drop: int = 2) -> np.ndarray:
+    """
+    Average consecutive frames to suppress noise.
+
+    Parameters:
+        camera: Frame source with `read()`.
+        count (int): Frames averaged.
+        drop (int): Frames dropped first, e.g. while the exposure settles.
+
+    Returns:
+        numpy.ndarray: float32 mean frame.
+    """
+    for _ in range(drop):
+        camera.read()
+    total: Optional[np.ndarray] = None
+    for _ in range(count):
+        ret, frame = camera.read()
+        if not ret:
+            raise IOError("Error reading a frame from the camera.")
+        if total is None:
+            total = np.zeros(frame.shape, np.float32)
+        cv2.accumulate(frame, total)
+    return total / count
+
+
+def capture_dark(microscope, camera, device_index: int, count: int = 16) -> np.ndarray:
+    """
+    Average frames with the LEDs off; cover the lens first.
+    The previous LED state is restored afterwards if it is known.
+
+    Parameters:
+        microscope (DNX64): Microscope of the device.
+        camera: Frame source with `read()`.
+        device_index (int): Index of the device.
+        count (int): Frames averaged.
+
+    Returns:
+        numpy.ndarray: float32 master dark frame.
+    """
+    led_state = microscope.cached_state(device_index).get("led_state")
+    microscope.SetLEDState(device_index, 0)
+    try:
+        return average_frames(camera, count, drop=4)
+    finally:
+        if led_state is not None:
+            microscope.SetLEDState(device_index, led_state)
+
+
+class FlatFieldCorrector:
+    """
+    Per-frame dark subtraction and flat-field gain in fixed point.
+
+    The gain map is `mean(flat - dark) / (flat - dark)` per channel, so a frame of
+    the flat target becomes uniform. It is stored as uint8 with `shift` fractional
+    bits, 7 when every gain is below 2, fewer for stronger vignetting.
+
+    Attributes:
+        dark (numpy.ndarray): uint8 dark frame subtracted from each frame.
+        gain (numpy.ndarray): float32 gain map.
+        gain_fixed (numpy.ndarray): uint8 gain map in fixed point.
+        shift (int): Fractional bits of `gain_fixed`.
+    """
+
+    def __init__(
+        self,
+        dark: Optional[np.ndarray] = None,
+        flat: Optional[np.ndarray] = None,
+        max_gain: float = MAX_GAIN,
+        smooth: float = 1.5,
+    ) -> None:
+        """
+        Precompute the correction.
+
+        Parameters:
+            dark (numpy.ndarray): Master dark frame, or None for no dark subtraction.
+            flat (numpy.ndarray): Master flat frame, or None for no gain.
+            max_gain (float): Largest gain applied.
+            smooth (float): Gaussian sigma applied to the flat signal, in pixels,
+                so flat-frame noise is not imprinted on every image.
+        """
+        if dark is None and flat is None:
+            raise ValueError("Need a dark frame, a flat frame or both.")
+        shape = (dark if dark is not None else flat).shape
+        if dark is None:
+            dark = np.zeros(shape, np.float32)
+        self.dark = np.clip(np.rint(dark), 0, 255).astype(np.uint8)
+        if flat is None:
+            self.gain = np.ones(shape, np.float32)
+        else:
+            signal = flat.astype(np.float32) - self.dark
+            if smooth:
+                signal = cv2.GaussianBlur(signal, (0, 0), smooth)
+            np.maximum(signal, 1.0, out=signal)
+            mean = signal.reshape(-1, *shape[2:]).mean(axis=0)
+            self.gain = np.minimum(mean / signal, max_gain).astype(np.float32)
+        # As many fractional bits as the largest gain leaves room for in 8 bits
+        largest = float(self.gain.max())
+        self.shift = min(7, max(0, int(np.floor(np.log2(255.0 / largest)))))
+        scale = float(1 << self.shift)
+        self.gain_fixed = np.clip(np.rint(self.gain * scale), 0, 255).astype(np.uint8)
+        self._scale = 1.0 / scale
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Correct a frame.
+
+        Parameters:
+            frame (numpy.ndarray): uint8 frame of the calibrated shape.
+
+        Returns:
+            numpy.ndarray: Corrected uint8 frame.
+        """
+        if frame.shape != self.dark.shape:
+            raise ValueError(
+                f"Frame shape {frame.shape} does not match the calibration "
+                f"{self.dark.shape}."
+            )
+        signal = cv2.subtract(frame, self.dark)
+        return cv2.multiply(signal, self.gain_fixed, scale=self._scale)
+
+
+class CalibrationStore:
+    """
+    Master frames on disk: one .npy file per key and kind, plus a JSON index.
+
+    Attributes:
+        directory (str): Folder holding the masters and `index.json`.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._index_path = os.path.join(directory, INDEX_FILE)
+        self._correctors: Dict[str, FlatFieldCorrector] = {}
+
+    def index(self) -> Dict[str, Dict[str, Any]]:
+        """Get the index: file name, frame shape and capture time by key and kind."""
+        if not os.path.exists(self._index_path):
+            return {}
+        with open(self._index_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def keys(self) -> List[str]:
+        """List the calibrated keys."""
+        return sorted(self.index())
+
+    def save(self, key: str, kind: str, master: np.ndarray, **info: Any) -> str:
+        """
+        Store a master frame.
+
+        Parameters:
+            key (str): Calibration key, see `calibration_key()`.
+            kind (str): "dark" or "flat".
+            master (numpy.ndarray): Averaged frame.
+            **info: Extra values recorded in the index, e.g. frames=16.
+
+        Returns:
+            str: Path of the written .npy file.
+        """
+        if kind not in KINDS:
+            raise ValueError(f"Unknown calibration kind {kind!r}; choose from {KINDS}")
+        os.makedirs(self.directory, exist_ok=True)
+        filename = f"{key}_{kind}.npy"
+        path = os.path.join(self.directory, filename)
+        np.save(path, master.astype(np.float32))
+        index = self.index()
+        index.setdefault(key, {})[kind] = dict(
+            info,
+            file=filename,
+            shape=list(master.shape),
+            created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        )
+        temporary = self._index_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=2)
+        os.replace(temporary, self._index_path)
+        self._correctors.pop(key, None)
+        return path
+
+    def load(self, key: str, kind: str) -> Optional[np.ndarray]:
+        """Read a master frame, or None if it was never captured."""
+        entry = self.index().get(key, {}).get(kind)
+        if entry is None:
+            return None
+        return np.load(os.path.join(self.directory, entry["file"]))
+
+    def corrector(self, key: str) -> Optional[FlatFieldCorrector]:
+        """
+        Get the corrector of a key, built once and then reused.
+
+        Returns:
+            Optional[FlatFieldCorrector]: None if neither master exists.
+        """
+        if key not in self._correctors:
+            dark, flat = self.load(key, "dark"), self.load(key, "flat")
+            if dark is None and flat is None:
+                return None
+            self._correctors[key] = FlatFieldCorrector(dark, flat)
+        return self._correctors[key]
@@ -0,0 +1,157 @@
+"""
+Device capabilities decoded from the `GetConfig` bitmask.
+See full parameter table at https://github.com/dino-lite/DNX64-Python-API/wiki/Appendix:-Parameter-Table#getconfig
+"""
+
+import enum
+from typing import Dict, List
+
+
+class Feature(enum.IntFlag):
+    """Feature bits reported by `GetConfig`."""
+
+    AXI = 0x1
+    FLC = 0x2
+    LED_2_SEGMENTS = 0x4
+    LED_3_SEGMENTS = 0x8
+    APL = 0x10
+    EFLC = 0x20
+    AMR = 0x40
+    EDOF = 0x80
+
+
+FEATURE_NAMES: Dict[Feature, str] = {
+    Feature.EDOF: "EDOF",
+    Feature.AMR: "AMR",
+    Feature.EFLC: "eFLC",
+    Feature.APL: "Aim Point Laser",
+    Feature.LED_2_SEGMENTS: "2 segments LED",
+    Feature.LED_3_SEGMENTS: "3 segments LED",
+    Feature.FLC: "FLC",
+    Feature.AXI: "AXI",
+}
+
+# DNX64 methods that only work on devices with the given feature
+REQUIRED_FEATURES: Dict[str, Feature] = {
+    "GetAMR": Feature.AMR,
+    "GetLensFinePosLimits": Feature.EDOF,
+    "GetLensPosLimits": Feature.EDOF,
+    "SetLensInitPos": Feature.EDOF,
+    "SetLensFinePos": Feature.EDOF,
+    "SetLensPos": Feature.EDOF,
+    "SetAimpointLevel": Feature.APL,
+    "SetAXILevel": Feature.AXI,
+    "SetFLCSwitch": Feature.FLC,
+    "SetFLCLevel": Feature.FLC,
+    "SetEFLC": Feature.EFLC,
+}
+
+
+class UnsupportedFeatureError(Exception):
+    """Raised instead of calling the DLL when a device lacks the required feature."""
+
+    def __init__(self, method: str, device_index: int, feature: Feature) -> None:
+        self.method = method
+        self.device_index = device_index
+        self.feature = feature
+        super().__init__(
+            f"{method} requires {FEATURE_NAMES[feature]}, "
+            f"which device {device_index} does not support."
+        )
+
+
+class Capabilities:
+    """
+    Typed view of a device's `GetConfig` value.
+
+    Attributes:
+        config (int): Raw configuration value.
+        features (Feature): Decoded feature flags.
+    """
+
+    __slots__ = ("config", "features")
+
+    def __init__(self, config: int) -> None:
+        self.config = config
+        self.features = Feature(config & 0xFF)
+
+    def __contains__(self, feature: Feature) -> bool:
+        return (self.features & feature) == feature
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Capabilities) and other.config == self.config
+
+    def __hash__(self) -> int:
+        return hash(self.config)
+
+    def __repr__(self) -> str:
+        return f"Capabilities(0x{self.config:X}: {', '.join(self.names()) or 'none'})"
+
+    @property
+    def edof(self) -> bool:
+        return Feature.EDOF in self
+
+    @property
+    def amr(self) -> bool:
+        return Feature.AMR in self
+
+    @property
+    def eflc(self) -> bool:
+        return Feature.EFLC in self
+
+    @property
+    def apl(self) -> bool:
+        return Feature.APL in self
+
+    @property
+    def flc(self) -> bool:
+        return Feature.FLC in self
+
+    @property
+    def axi(self) -> bool:
+        return Feature.AXI in self
+
+    @property
+    def led_segments(self) -> int:
+        """
+        Number of independently controllable LED segments.
+
+        Returns:
+            int: 2 or 3, or 0 if the device has no segmented LEDs.
+        """
+        segments = self.config & 0xC
+        if segments == Feature.LED_2_SEGMENTS:
+            return 2
+        if segments == Feature.LED_3_SEGMENTS:
+            return 3
+        return 0
+
+    def names(self) -> List[str]:
+        """
+        Get the readable names of the supported features.
+
+        Returns:
+            List[str]: Feature names in `GetConfig` bit order, highest first.
+        """
+        names = []
+        for feature, name in FEATURE_NAMES.items():
+            if feature in (Feature.LED_2_SEGMENTS, Feature.LED_3_SEGMENTS):
+                # Both LED bits set is not a valid combination; trust led_segments
+                if self.led_segments == (2 if feature == Feature.LED_2_SEGMENTS else 3):
+                    names.append(name)
+            elif feature in self:
+                names.append(name)
+        return names
+
+    def supports(self, method: str) -> bool:
+        """
+        Check whether a DNX64 method can be used on this device.
+
+        Parameters:
+            method (str): DNX64 method name, e.g. "GetAMR".
+
+        Returns:
+            bool: True if the method needs no feature or the feature is present.
+        """
+        feature = REQUIRED_FEATURES.get(method)
+        return feature is None or feature in self
@@ -0,0 +1,460 @@
+"""
+Command-line interface: `python -m DNX64 <command>`.
+
+Commands:
+    list      List connected video devices.
+    info      Show the identity, capabilities and exposure state of a device.
+    set       Change settings, e.g. `set exposure=1000 led_state=1`, or apply a profile.
+    snapshot  Save a still image, or the device's video profile with --profile.
+    calibrate Capture a master dark or flat frame, see DNX64.calibration.
+    record    Record video for a number of seconds.
+    stream    Serve the device to many viewers, see DNX64.restream.
+    bench     Run the benchmark suite, see DNX64.bench.
+    export    Convert images in parallel, keeping their metadata, see DNX64.export.
+
+Only the standard library and the DNX64 package are imported at start-up. NumPy
+and OpenCV are imported by the commands that grab frames, and the DLL is loaded
+only by commands that talk to the microscope.
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+DEFAULT_DLL_PATH = "C:\\Program Files\\DNX64\\DNX64.dll"
+DEFAULT_WIFI_URL = "http://10.10.10.254:8080/?action=stream"
+# Settings accepted by `set`, mapped to their DNX64 setter
+SETTERS: Dict[str, str] = {
+    "exposure": "SetExposureValue",
+    "auto_exposure": "SetAutoExposure",
+    "ae_target": "SetAETarget",
+    "led_state": "SetLEDState",
+    "flc_switch": "SetFLCSwitch",
+    "flc_level": "SetFLCLevel",
+    "apl_level": "SetAimpointLevel",
+    "axi_level": "SetAXILevel",
+    "lens_position": "SetLensPos",
+}
+
+
+class Session:
+    """Command context; the microscope is only created on first use."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self._microscope = None
+
+    @property
+    def microscope(self):
+        if self._microscope is None:
+            from . import DNX64
+
+            dll = None
+            if self.args.simulate:
+                from .simulator import SimulatedDLL
+
+                dll = SimulatedDLL()
+            self._microscope = DNX64(self.args.dll, dll=dll)
+            self._microscope.SetVideoDeviceIndex(self.args.device)
+        return self._microscope
+
+
+def open_camera(session: Session):
+    """
+    Open the frame source given by --camera, see `DNX64.sources.open_source()`.
+    Without --camera the camera of --device is matched by name.
+    """
+    from .sources import open_source
+
+    spec = session.args.camera
+    microscope = session.microscope if spec is None else None
+    camera = open_source(spec, microscope, session.args.device)
+    if not camera.isOpened():
+        raise SystemExit(f"Error opening camera {spec}.")
+    return camera
+
+
+def cmd_list(session: Session) -> int:
+    microscope = session.microscope
+    for index in range(microscope.GetVideoDeviceCount()):
+        print(f"{index}: {microscope.GetVideoDeviceName(index)}")
+    return 0
+
+
+def cmd_info(session: Session) -> int:
+    microscope = session.microscope
+    device = session.args.device
+    capabilities = microscope.capabilities(device)
+    info = {
+        "device_index": device,
+        "name": microscope.GetVideoDeviceName(device),
+        "device_id": microscope.GetDeviceId(device),
+        "config": f"0x{capabilities.config:X}",
+        "features": capabilities.names(),
+        "auto_exposure": microscope.GetAutoExposure(device),
+        "exposure": microscope.GetExposureValue(device),
+        "ae_target": microscope.GetAETarget(device),
+    }
+    if capabilities.amr:
+        info["amr"] = round(microscope.GetAMR(device), 1)
+        info["fov_mm"] = round(microscope.FOVx(device, info["amr"]) / 1000.0, 2)
+    if session.args.json:
+        print(json.dumps(info))
+    else:
+        for key, value in info.items():
+            print(f"{key:>14}: {value}")
+    return 0
+
+
+def cmd_set(session: Session) -> int:
+    from .profiles import PROC_AMP_PROPERTIES, VideoProfile, apply_profile
+
+    microscope = session.microscope
+    device = session.args.device
+    profile = VideoProfile()
+    if session.args.profile:
+        profile = VideoProfile.load(session.args.profile)
+    properties = {name: index for index, name in PROC_AMP_PROPERTIES.items()}
+    for assignment in session.args.settings:
+        name, _, value = assignment.partition("=")
+        if not value:
+            raise SystemExit(f"Expected NAME=VALUE, got {assignment!r}.")
+        if name in properties:
+            profile.properties[properties[name]] = int(value)
+        elif name in ("exposure", "auto_exposure", "ae_target", "led_state"):
+            setattr(profile, name, int(value))
+        elif name in SETTERS:
+            getattr(microscope, SETTERS[name])(device, int(value))
+            print(f"{name} = {value}")
+        else:
+            names = sorted(set(SETTERS) | set(properties))
+            raise SystemExit(f"Unknown setting {name!r}; choose from {names}.")
+    if profile.exposure is not None and profile.auto_exposure is None:
+        profile.auto_exposure = 0
+    for name, value in apply_profile(microscope, profile, device):
+        print(f"{name} = {value}")
+    return 0
+
+
+def capture_hdr_frame(session: Session, camera):
+    """Capture and fuse the bracket given by --hdr, see `DNX64.hdr`."""
+    from .hdr import bracket_exposures, capture_bracket, fuse_exposures
+
+    microscope, device = session.microscope, session.args.device
+    if session.args.hdr == "auto":
+        exposures = bracket_exposures(microscope.GetExposureValue(device))
+    else:
+        exposures = [int(value) for value in session.args.hdr.split(",")]
+    bracket = capture_bracket(microscope, camera, exposures, device)
+    if not all(bracket.settled):
+        print("Warning: some exposures did not settle; raise max_drop in DNX64.hdr.")
+    start = time.perf_counter()
+    frame = fuse_exposures(bracket.frames)
+    print(
+        f"Fused exposures {bracket.exposures}: captured in {bracket.seconds:.2f} s "
+        f"({sum(bracket.dropped)} frames dropped), "
+        f"merged in {time.perf_counter() - start:.2f} s"
+    )
+    return frame
+
+
+def cmd_snapshot(session: Session) -> int:
+    if session.args.profile:
+        from .profiles import capture_profile
+
+        profile = capture_profile(session.microscope, session.args.device)
+        profile.save(session.args.profile)
+        print(f"Saved video profile to {session.args.profile}")
+        return 0
+
+    import cv2
+
+    camera = open_camera(session)
+    try:
+        for _ in range(session.args.skip):
+            camera.read()
+        ret, frame = camera.read()
+        if ret and session.args.hdr:
+            frame = capture_hdr_frame(session, camera)
+    finally:
+        camera.release()
+    if not ret:
+        raise SystemExit("Error reading a frame from the camera.")
+    filename = session.args.output or f"image_{time.strftime('%Y%m%d_%H%M%S')}.png"
+    if session.args.metadata:
+        from .export import frame_metadata, prime_metadata, write_image
+
+        prime_metadata(session.microscope, session.args.device)
+        write_image(
+            filename, frame, frame_metadata(session.microscope, session.args.device)
+        )
+    else:
+        cv2.imwrite(filename, frame)
+    print(f"Saved image to {filename}")
+    return 0
+
+
+def cmd_calibrate(session: Session) -> int:
+    from .calibration import (
+        CalibrationStore,
+        average_frames,
+        calibration_key,
+        capture_dark,
+    )
+
+    args = session.args
+    microscope, device = session.microscope, args.device
+    # The LED state has no getter; setting it makes it part of the key
+    if args.led is not None:
+        microscope.SetLEDState(device, args.led)
+    key = calibration_key(microscope, device)
+    camera = open_camera(session)
+    try:
+        if args.kind == "dark":
+            master = capture_dark(microscope, camera, device, args.frames)
+        else:
+            master = average_frames(camera, args.frames)
+    finally:
+        camera.release()
+    path = CalibrationStore(args.dir).save(key, args.kind, master, frames=args.frames)
+    print(f"Saved {args.kind} master for {key} to {path}")
+    return 0
+
+
+def cmd_record(session: Session) -> int:
+    import cv2
+
+    camera = open_camera(session)
+    fps = session.args.fps
+    ret, frame = camera.read()
+    if not ret:
+        camera.release()
+        raise SystemExit("Error reading a frame from the camera.")
+    height, width = frame.shape[:2]
+    filename = session.args.output or f"video_{time.strftime('%Y%m%d_%H%M%S')}.avi"
+    writer = cv2.VideoWriter(
+        filename, cv2.VideoWriter.fourcc(*"XVID"), fps, (width, height)
+    )
+    frames = 0
+    end = time.perf_counter() + session.args.seconds
+    try:
+        while ret and time.perf_counter() < end:
+            writer.write(frame)
+            frames += 1
+            ret, frame = camera.read()
+    finally:
+        writer.release()
+        camera.release()
+    print(f"Recorded {frames} frames to {filename}")
+    return 0
+
+
+def cmd_stream(session: Session) -> int:
+    from .restream import serve
+
+    args = session.args
+    wifi = {f"wifi{i}": url for i, url in enumerate(args.wifi)}
+    cameras = {f"usb{i}": index for i, index in enumerate(args.camera or [])}
+    microscope = None if args.no_control else session.microscope
+    serve(args.host, args.port, wifi, cameras, microscope)
+    return 0
+
+
+def cmd_bench(session: Session) -> int:
+    from .bench import GROUPS, compare, load_results, run_suite, save_results
+
+    args = session.args
+    threshold, thresholds = 0.2, {}
+    for option in args.threshold or []:
+        group, _, value = option.rpartition("=")
+        try:
+            limit = float(value)
+        except ValueError:
+            raise SystemExit(f"Expected PCT or GROUP=PCT, got {option!r}.") from None
+        if group:
+            thresholds[group] = limit
+        else:
+            threshold = limit
+    results = run_suite(args.group or GROUPS, args.number, args.repeat)
+    print(results.format())
+    if args.output:
+        save_results(results, args.output)
+        print(f"Saved results to {args.output}")
+    status = 0
+    info = results.results.get("startup.info")
+    if info is not None and info["value"] > args.budget_ms:
+        print(f"`info` cold start is over the {args.budget_ms:.0f} ms budget.")
+        status = 1
+    if args.baseline:
+        regressions = compare(
+            results, load_results(args.baseline), threshold, thresholds
+        )
+        for regression in regressions:
+            print(
+                f"REGRESSION {regression.name}: {regression.baseline:.2f} -> "
+                f"{regression.current:.2f} ({regression.change * 100:+.1f}%)"
+            )
+        if regressions:
+            status = 1
+        else:
+            print(f"No regressions over {threshold * 100:.0f}% against baseline.")
+    return status
+
+
+def cmd_export(session: Session) -> int:
+    from .export import export_batch
+
+    args = session.args
+    extension = "." + args.format.lower().lstrip(".")
+    report = export_batch(
+        args.sources,
+        args.output,
+        extension,
+        args.quality,
+        sidecar=args.sidecar,
+        workers=args.workers,
+    )
+    print(report.format())
+    return 1 if report.failed else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m DNX64", description="Control Dino-Lite microscopes."
+    )
+    parser.add_argument(
+        "--dll",
+        default=os.environ.get("DNX64_PATH", DEFAULT_DLL_PATH),
+        help="path to DNX64.dll (default: $DNX64_PATH or %(default)s)",
+    )
+    parser.add_argument(
+        "--simulate", action="store_true", help="use a simulated microscope"
+    )
+    parser.add_argument(
+        "--device", type=int, default=0, help="device index (90 for WF-10 / WF-20)"
+    )
+    commands = parser.add_subparsers(dest="command", metavar="command")
+
+    commands.add_parser("list", help="list connected video devices")
+
+    info = commands.add_parser("info", help="show device information")
+    info.add_argument("--json", action="store_true", help="print as JSON")
+
+    setter = commands.add_parser("set", help="change settings")
+    setter.add_argument("settings", nargs="*", metavar="NAME=VALUE")
+    setter.add_argument("--profile", help="apply a saved video profile first")
+
+    snapshot = commands.add_parser("snapshot", help="save an image or profile")
+    snapshot.add_argument("-o", "--output", help="image file name")
+    snapshot.add_argument(
+        "--camera",
+        help="camera index, MJPEG URL, file or 'synthetic' (default: match --device)",
+    )
+    snapshot.add_argument(
+        "--skip", type=int, default=5, help="frames to discard while exposure settles"
+    )
+    snapshot.add_argument("--profile", help="save the video profile to this file")
+    snapshot.add_argument(
+        "--hdr",
+        metavar="EXPOSURES",
+        help="fuse an exposure bracket, e.g. 250,1000,4000, or 'auto' for 5 values",
+    )
+    snapshot.add_argument(
+        "--metadata",
+        action="store_true",
+        help="embed magnification, scale, exposure and lighting in the image",
+    )
+
+    calibrate = commands.add_parser(
+        "calibrate", help="capture a master dark or flat frame"
+    )
+    calibrate.add_argument(
+        "kind",
+        choices=("dark", "flat"),
+        help="dark: cover the lens; flat: white target",
+    )
+    calibrate.add_argument("--frames", type=int, default=16, help="frames averaged")
+    calibrate.add_argument("--dir", default="calibration", help="calibration folder")
+    calibrate.add_argument("--led", type=int, help="set this LED state first")
+    calibrate.add_argument(
+        "--camera",
+        help="camera index, MJPEG URL, file or 'synthetic' (default: match --device)",
+    )
+
+    record = commands.add_parser("record", help="record video")
+    record.add_argument("seconds", type=float)
+    record.add_argument("-o", "--output", help="video file name")
+    record.add_argument(
+        "--camera",
+        help="camera index, MJPEG URL, file or 'synthetic' (default: match --device)",
+    )
+    record.add_argument("--fps", type=float, default=30.0)
+
+    stream = commands.add_parser("stream", help="serve streams to many viewers")
+    stream.add_argument("--host", default="127.0.0.1")
+    stream.add_argument("--port", type=int, default=8000)
+    stream.add_argument(
+        "--wifi", action="append", default=[], metavar="URL", help="streamer URL"
+    )
+    stream.add_argument(
+        "--camera", action="append", type=int, help="OpenCV camera index"
+    )
+    stream.add_argument(
+        "--no-control", action="store_true", help="do not expose /api controls"
+    )
+
+    bench = commands.add_parser("bench", help="run the benchmark suite")
+    bench.add_argument(
+        "--group", action="append", help="benchmark group to run (default: all)"
+    )
+    bench.add_argument("--number", type=int, default=2000, help="calls per loop")
+    bench.add_argument("--repeat", type=int, default=5, help="loops per benchmark")
+    bench.add_argument("-o", "--output", help="save results as JSON")
+    bench.add_argument("--baseline", help="compare against saved results")
+    bench.add_argument(
+        "--threshold",
+        action="append",
+        metavar="[GROUP=]PCT",
+        help="allowed relative slowdown (default: 0.2), or GROUP=PCT for one "
+        "group or benchmark, e.g. frames=0.3; repeatable",
+    )
+    bench.add_argument(
+        "--budget-ms", type=float, default=150.0, help="`info` cold start budget"
+    )
+
+    export = commands.add_parser("export", help="convert images with metadata")
+    export.add_argument("sources", nargs="+", help="image files or folders")
+    export.add_argument("-o", "--output", required=True, help="output folder")
+    export.add_argument("--format", default="jpg", help="jpg, png, webp, tif, ...")
+    export.add_argument("--quality", type=int, default=90, help="0 to 100")
+    export.add_argument(
+        "--sidecar", action="store_true", help="also write JSON sidecar files"
+    )
+    export.add_argument("--workers", type=int, help="threads (default: one per core)")
+    return parser
+
+
+COMMANDS = {
+    "list": cmd_list,
+    "info": cmd_info,
+    "set": cmd_set,
+    "snapshot": cmd_snapshot,
+    "calibrate": cmd_calibrate,
+    "record": cmd_record,
+    "stream": cmd_stream,
+    "bench": cmd_bench,
+    "export": cmd_export,
+}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    if args.command == "stream" and not (args.wifi or args.camera):
+        args.wifi = [DEFAULT_WIFI_URL]
+    return COMMANDS[args.command](Session(args))
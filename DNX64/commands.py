@@ -0,0 +1,170 @@
+"""
+Rate-limited, coalescing command path to the microscope.
+
+The DLL needs time to process each setter (see COMMAND_TIME in the examples),
+so control loops that set a value every frame only build a backlog of stale
+commands. A `CommandQueue` sends commands from one worker thread, at most one
+per `min_interval`, and keeps a single pending command per method and device:
+submitting SetExposureValue again before the previous one was sent replaces its
+value instead of queueing a second call. An `on_sent` callback tells the caller
+when its value actually reached the DLL.
+
+    commands = CommandQueue(microscope, min_interval=0.05)
+    for value in range(100, 2000, 10):
+        commands.submit("SetExposureValue", 0, value)  # only a few are sent
+    commands.flush()
+    commands.close()
+"""
+
+import collections
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from . import NON_DEVICE_METHODS
+
+
+class CommandQueue:
+    """
+    Send setter calls on a worker thread, coalesced and rate limited.
+
+    Attributes:
+        min_interval (float): Seconds between two commands sent to the DLL.
+        submitted (int): Commands submitted.
+        sent (int): Commands sent to the DLL.
+        coalesced (int): Commands replaced by a newer one before being sent.
+        errors (int): Commands that raised.
+    """
+
+    def __init__(self, microscope, min_interval: float = 0.05) -> None:
+        """
+        Initialize the queue and start its worker thread.
+
+        Parameters:
+            microscope (DNX64): Microscope the commands are sent to.
+            min_interval (float): Seconds between two commands.
+        """
+        self.microscope = microscope
+        self.min_interval = min_interval
+        self.submitted = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.errors = 0
+        # (method, device) or (method,) -> (method, args, on_sent callbacks)
+        self._pending: "collections.OrderedDict[Tuple, Tuple[str, tuple, List]]" = (
+            collections.OrderedDict()
+        )
+        self._condition = threading.Condition()
+        self._busy = False
+        self._closed = False
+        self._last_sent = 0.0
+        self._thread = threading.Thread(
+            target=self._run, name="dnx64-commands", daemon=True
+        )
+        self._thread.start()
+
+    def __enter__(self) -> "CommandQueue":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def submit(
+        self, method: str, *args: Any, on_sent: Optional[Callable[[], None]] = None
+    ) -> None:
+        """
+        Queue a call, replacing a pending call of the same method and device.
+
+        Parameters:
+            method (str): DNX64 method name, e.g. "SetExposureValue".
+            *args: Arguments of the method, device index first where it has one.
+            on_sent (Callable[[], None]): Called on the worker thread once the
+                call returned, or raised; also once a newer call replacing this
+                one did. Keep it short, it holds up the queue.
+        """
+        key = (method,) if method in NON_DEVICE_METHODS else (method, args[0])
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Command queue is closed.")
+            self.submitted += 1
+            callbacks = []
+            if key in self._pending:
+                self.coalesced += 1
+                callbacks = self._pending[key][2]
+            if on_sent is not None:
+                callbacks.append(on_sent)
+            # Replacing keeps the original position, so busy keys are not starved
+            self._pending[key] = (method, args, callbacks)
+            self._condition.notify_all()
+
+    def pending(self) -> int:
+        """Get the number of commands waiting to be sent."""
+        with self._condition:
+            return len(self._pending)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every submitted command was sent.
+
+        Returns:
+            bool: False if the timeout expired first.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._busy, timeout
+            )
+
+    def close(self, flush: bool = True) -> None:
+        """
+        Stop the worker thread.
+
+        Parameters:
+            flush (bool): Send pending commands first; otherwise drop them.
+        """
+        with self._condition:
+            self._closed = True
+            if not flush:
+                self._pending.clear()
+            self._condition.notify_all()
+        self._thread.join()
+
+    def stats(self) -> Dict[str, int]:
+        """Get the command counters."""
+        return {
+            "submitted": self.submitted,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+        }
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    if not self._pending:
+                        if self._closed:
+                            return
+                        self._condition.wait()
+                        continue
+                    delay = self._last_sent + self.min_interval - time.perf_counter()
+                    if delay <= 0:
+                        break
+                    # Commands submitted while waiting coalesce into the pending ones
+                    self._condition.wait(delay)
+                _, (method, args, callbacks) = self._pending.popitem(last=False)
+                self._busy = True
+            try:
+                getattr(self.microscope, method)(*args)
+            except Exception as e:
+                self.errors += 1
+                print(f"Command {method}{args} failed: {e}")
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"Callback of {method} failed: {e}")
+            with self._condition:
+                self.sent += 1
+                self._last_sent = time.perf_counter()
+                self._busy = False
+                self._condition.notify_all()
@@ -0,0 +1,379 @@
+"""
+MicroTouch event hub.
+
+`DNX64.SetEventCallback` runs its callback on the DLL's own thread and only accepts
+one function. `EventHub` registers a tiny native callback that timestamps the press
+and queues it, then a dispatcher thread turns raw presses into gestures (debounced
+press, double press, long press) and hands them to any number of subscribers. Each
+subscriber runs on its own worker thread, or on an asyncio event loop, so a slow
+handler never delays the driver or the other subscribers.
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Gestures a subscriber can ask for
+RAW = "raw"  # every debounced press, delivered immediately
+PRESS = "press"  # single press, delivered once the double press window closes
+DOUBLE_PRESS = "double_press"
+LONG_PRESS = "long_press"
+GESTURES = (RAW, PRESS, DOUBLE_PRESS, LONG_PRESS)
+
+
+class MicroTouchEvent:
+    """
+    A MicroTouch gesture as seen by subscribers.
+
+    Attributes:
+        gesture (str): One of `RAW`, `PRESS`, `DOUBLE_PRESS` or `LONG_PRESS`.
+        timestamp (float): `time.perf_counter()` of the first press in the gesture.
+        presses (int): Number of debounced presses that made up the gesture.
+        duration (float): Seconds between the first and last press of the gesture.
+        emitted (float): `time.perf_counter()` when the hub published the event.
+    """
+
+    __slots__ = ("gesture", "timestamp", "presses", "duration", "emitted")
+
+    def __init__(
+        self, gesture: str, timestamp: float, presses: int, duration: float
+    ) -> None:
+        self.gesture = gesture
+        self.timestamp = timestamp
+        self.presses = presses
+        self.duration = duration
+        self.emitted = time.perf_counter()
+
+    def __repr__(self) -> str:
+        return (
+            f"MicroTouchEvent(gesture={self.gesture!r}, presses={self.presses}, "
+            f"duration={self.duration:.3f})"
+        )
+
+
+class LatencyStats:
+    """
+    Running delivery and handler latency for one subscriber.
+
+    Delivery latency is the time from the hub publishing an event to the handler
+    starting; handler time is how long the handler itself ran.
+    """
+
+    __slots__ = (
+        "count",
+        "errors",
+        "dropped",
+        "delivery_total",
+        "delivery_max",
+        "handler_total",
+        "handler_max",
+    )
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.dropped = 0
+        self.delivery_total = 0.0
+        self.delivery_max = 0.0
+        self.handler_total = 0.0
+        self.handler_max = 0.0
+
+    def add(self, delivery: float, handler: float) -> None:
+        self.count += 1
+        self.delivery_total += delivery
+        self.handler_total += handler
+        if delivery > self.delivery_max:
+            self.delivery_max = delivery
+        if handler > self.handler_max:
+            self.handler_max = handler
+
+    def as_dict(self) -> Dict[str, float]:
+        """
+        Summarise the statistics in milliseconds.
+
+        Returns:
+            Dict[str, float]: Counts plus mean/max delivery and handler latency.
+        """
+        count = self.count or 1
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "mean_delivery_ms": self.delivery_total / count * 1000.0,
+            "max_delivery_ms": self.delivery_max * 1000.0,
+            "mean_handler_ms": self.handler_total / count * 1000.0,
+            "max_handler_ms": self.handler_max * 1000.0,
+        }
+
+
+class Subscription:
+    """
+    A handler registered on an `EventHub`.
+
+    Events are buffered in a bounded per-subscriber queue; when the handler falls
+    behind, the oldest pending events are dropped and counted in `stats.dropped`.
+    Use `EventHub.subscribe()` rather than creating this directly.
+    """
+
+    def __init__(
+        self,
+        handler: Callable,
+        gestures: Iterable[str],
+        loop: Optional[asyncio.AbstractEventLoop],
+        max_pending: int,
+        name: str,
+    ) -> None:
+        self.handler = handler
+        self.gestures = frozenset(gestures)
+        self.loop = loop
+        self.name = name
+        self.stats = LatencyStats()
+        self._pending: "queue.Queue[Optional[MicroTouchEvent]]" = queue.Queue(
+            max_pending
+        )
+        self._thread: Optional[threading.Thread] = None
+        if loop is None:
+            self._thread = threading.Thread(
+                target=self._run, name=f"MicroTouch-{name}", daemon=True
+            )
+            self._thread.start()
+
+    def deliver(self, event: MicroTouchEvent) -> None:
+        """Queue an event for this subscriber without blocking the dispatcher."""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._dispatch_async, event)
+            return
+        while True:
+            try:
+                self._pending.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self._pending.get_nowait()
+                    self.stats.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def close(self) -> None:
+        """Stop the worker thread once pending events have been handled."""
+        if self._thread is not None:
+            self._pending.put(None)
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def _call(self, event: MicroTouchEvent) -> None:
+        start = time.perf_counter()
+        try:
+            self.handler(event)
+        except Exception as e:
+            self.stats.errors += 1
+            print(f"MicroTouch subscriber {self.name} raised: {e}")
+        self.stats.add(start - event.emitted, time.perf_counter() - start)
+
+    def _run(self) -> None:
+        while True:
+            event = self._pending.get()
+            if event is None:
+                return
+            self._call(event)
+
+    def _dispatch_async(self, event: MicroTouchEvent) -> None:
+        if not asyncio.iscoroutinefunction(self.handler):
+            self._call(event)
+            return
+
+        async def runner() -> None:
+            start = time.perf_counter()
+            try:
+                await self.handler(event)
+            except Exception as e:
+                self.stats.errors += 1
+                print(f"MicroTouch subscriber {self.name} raised: {e}")
+            self.stats.add(start - event.emitted, time.perf_counter() - start)
+
+        self.loop.create_task(runner())
+
+
+class EventHub:
+    """
+    Queue MicroTouch presses from the DLL and fan them out to subscribers.
+
+    A burst of presses, each no more than `double_press_window` apart, is
+    classified once it ends: if it lasted at least `long_press_time` it is a
+    `LONG_PRESS` (the driver repeats the event while the button is held), two or
+    more presses make a `DOUBLE_PRESS`, otherwise it is a `PRESS`.
+
+    Example:
+        hub = EventHub()
+        hub.subscribe(save_snapshot)
+        hub.subscribe(toggle_recording, gestures=[DOUBLE_PRESS])
+        hub.attach(microscope)
+    """
+
+    def __init__(
+        self,
+        debounce: float = 0.05,
+        double_press_window: float = 0.3,
+        long_press_time: float = 0.8,
+    ) -> None:
+        """
+        Initialize the event hub.
+
+        Parameters:
+            debounce (float): Presses closer than this many seconds are merged.
+            double_press_window (float): Maximum gap, in seconds, between presses
+                of the same gesture.
+            long_press_time (float): Minimum burst length, in seconds, for a
+                long press.
+        """
+        self.debounce = debounce
+        self.double_press_window = double_press_window
+        self.long_press_time = long_press_time
+        self.debounced = 0
+        self._raw: "queue.SimpleQueue[Optional[float]]" = queue.SimpleQueue()
+        self._subscribers: List[Subscription] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "EventHub":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def attach(self, microscope) -> None:
+        """
+        Register the hub as the MicroTouch callback of a microscope and start it.
+
+        Parameters:
+            microscope (DNX64): Microscope whose MicroTouch events to dispatch.
+        """
+        microscope.SetEventCallback(self.post)
+        self.start()
+
+    def post(self) -> None:
+        """
+        Native callback: timestamp the press and queue it.
+
+        Safe to call from any thread; does no other work so the driver's event
+        thread is released immediately.
+        """
+        self._raw.put(time.perf_counter())
+
+    def subscribe(
+        self,
+        handler: Callable,
+        gestures: Iterable[str] = (PRESS,),
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        max_pending: int = 16,
+    ) -> Subscription:
+        """
+        Register a handler for MicroTouch gestures.
+
+        Parameters:
+            handler (Callable): Called with a `MicroTouchEvent`. May be a coroutine
+                function when `loop` is given.
+            gestures (Iterable[str]): Gestures to receive, see `GESTURES`.
+            loop (asyncio.AbstractEventLoop): Run the handler on this event loop
+                instead of a dedicated worker thread.
+            max_pending (int): Events buffered before the oldest are dropped.
+
+        Returns:
+            Subscription: Handle for `unsubscribe()` and latency statistics.
+        """
+        unknown = set(gestures) - set(GESTURES)
+        if unknown:
+            raise ValueError(f"Unknown MicroTouch gestures: {sorted(unknown)}")
+        name = getattr(handler, "__name__", repr(handler))
+        subscription = Subscription(handler, gestures, loop, max_pending, name)
+        with self._lock:
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Remove a handler and stop its worker thread."""
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+        subscription.close()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Get per-subscriber latency statistics.
+
+        Returns:
+            Dict[str, Dict[str, float]]: `LatencyStats.as_dict()` by handler name.
+        """
+        with self._lock:
+            return {s.name: s.stats.as_dict() for s in self._subscribers}
+
+    def start(self) -> None:
+        """Start the dispatcher thread if it is not running."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="MicroTouch-dispatcher", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the dispatcher and all subscriber workers."""
+        if self._thread is not None:
+            self._raw.put(None)
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for subscription in subscribers:
+            subscription.close()
+
+    def _publish(self, event: MicroTouchEvent) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if event.gesture in subscription.gestures:
+                subscription.deliver(event)
+
+    def _finish_burst(self, first: float, last: float, presses: int) -> None:
+        duration = last - first
+        if duration >= self.long_press_time:
+            gesture = LONG_PRESS
+        elif presses > 1:
+            gesture = DOUBLE_PRESS
+        else:
+            gesture = PRESS
+        self._publish(MicroTouchEvent(gesture, first, presses, duration))
+
+    def _run(self) -> None:
+        first = last = 0.0
+        presses = 0
+        while True:
+            timeout = None
+            if presses:
+                timeout = max(
+                    0.0, last + self.double_press_window - time.perf_counter()
+                )
+            try:
+                stamp = self._raw.get(timeout=timeout)
+            except queue.Empty:
+                self._finish_burst(first, last, presses)
+                presses = 0
+                continue
+            if stamp is None:
+                if presses:
+                    self._finish_burst(first, last, presses)
+                return
+            if presses and stamp - last < self.debounce:
+                self.debounced += 1
+                last = stamp
+                continue
+            self._publish(MicroTouchEvent(RAW, stamp, 1, 0.0))
+            if presses and stamp - last <= self.double_press_window:
+                presses += 1
+            else:
+                if presses:
+                    self._finish_burst(first, last, presses)
+                first, presses = stamp, 1
+            last = stamp
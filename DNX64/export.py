@@ -0,0 +1,509 @@
+"""
+Image export with per-frame metadata.
+
+`frame_metadata()` builds a record of the magnification, scale, exposure and
+lighting a frame was taken with from the microscope's cached state only, so
+tagging every frame costs no DLL calls; `prime_metadata()` reads the values once
+for a session that has not queried them yet. JPEG and PNG files carry the record
+as an XMP packet (an APP1 segment or an iTXt chunk, written without extra
+dependencies); other formats, or `sidecar=True`, get a JSON file next to the
+image.
+
+`export_batch()` converts or recompresses many images on a thread pool; OpenCV
+releases the GIL while decoding and encoding, so the work spreads over all
+cores. Each finished image is appended to a progress file in the output folder,
+and outputs are written under a temporary name and renamed, so an interrupted
+batch resumes where it stopped without redoing or trusting partial files.
+
+    prime_metadata(microscope, 0)
+    write_image("board.jpg", frame, frame_metadata(microscope, 0, frame.shape[1]))
+    report = export_batch(["captures"], "export", extension=".jpg", quality=90)
+    print(report.format())
+"""
+
+import concurrent.futures
+import json
+import os
+import re
+import struct
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from xml.etree import ElementTree
+from xml.sax.saxutils import quoteattr
+
+import cv2
+import numpy as np
+
+from .capabilities import UnsupportedFeatureError
+from .sources import IMAGE_EXTENSIONS
+
+PROGRESS_FILE = "export_progress.jsonl"
+SIDECAR_EXTENSION = ".json"
+XMP_NAMESPACE = "https://github.com/dino-lite/DNX64-Python-API/ns/1.0/"
+# Metadata values kept as text when read back, even if they look like numbers
+TEXT_FIELDS = frozenset({"device_id", "time", "source"})
+# Cached state keys copied into the record, by record field
+STATE_FIELDS: Dict[str, str] = {
+    "device_id": "device_id",
+    "amr": "amr",
+    "exposure": "exposure",
+    "auto_exposure": "auto_exposure",
+    "ae_target": "ae_target",
+    "led_state": "led_state",
+    "flc_switch": "flc_switch",
+    "flc_level": "flc_level",
+}
+
+_XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+_XMP_KEYWORD = b"XML:com.adobe.xmp"
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def prime_metadata(microscope, device_index: int) -> None:
+    """
+    Read the values `frame_metadata()` uses into the cached state, once.
+    Settings changed later through the same microscope object stay current; the
+    AMR is only refreshed by the next GetAMR call.
+
+    Parameters:
+        microscope (DNX64): Microscope of the device.
+        device_index (int): Index of the device.
+    """
+    for method in ("GetDeviceId", "GetExposureValue", "GetAutoExposure", "GetAETarget"):
+        getattr(microscope, method)(device_index)
+    try:
+        microscope.FOVx(device_index, microscope.GetAMR(device_index))
+    except UnsupportedFeatureError:
+        pass
+
+
+def frame_metadata(
+    microscope, device_index: int, frame_width: Optional[int] = None, **extra: Any
+) -> Dict[str, Any]:
+    """
+    Build the metadata record of a frame from the cached state, without DLL calls.
+
+    Parameters:
+        microscope (DNX64): Microscope of the device.
+        device_index (int): Index of the device.
+        frame_width (int): Width of the frame in pixels, for the scale; when None
+            it is filled in by `write_image()`.
+        **extra: Further fields, e.g. roi=(0, 0, 640, 480).
+
+    Returns:
+        Dict[str, Any]: Record such as {"time": ..., "amr": 49.8, "fov_um": ...,
+        "um_per_pixel": ..., "exposure": 1000, "led_state": 1, ...}; settings never
+        queried or set are left out. While auto exposure is on the exposure is
+        left out, as the cached value is not what the frame was taken with.
+        "fov_um" and "um_per_pixel" are None when `FOVx` was not called for the
+        cached AMR, e.g. after a GetAMR read a new magnification; call
+        `prime_metadata()` again to fill them in.
+    """
+    state = microscope.cached_state(device_index)
+    record: Dict[str, Any] = {"time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    for field, key in STATE_FIELDS.items():
+        if state.get(key) is not None:
+            record[field] = state[key]
+    if state.get("auto_exposure"):
+        record.pop("exposure", None)
+    amr = state.get("amr")
+    if amr is not None:
+        fov = state.get("fov", {}).get(amr)
+        record["fov_um"] = fov
+        if frame_width:
+            record["um_per_pixel"] = fov / frame_width if fov is not None else None
+    eflc = {key[5:]: value for key, value in state.items() if key.startswith("eflc_")}
+    if eflc:
+        record["eflc"] = eflc
+    record.update(extra)
+    return record
+
+
+def _xmp_packet(metadata: Dict[str, Any]) -> bytes:
+    attributes = "".join(
+        f"\n    dnx:{key}={quoteattr(value if isinstance(value, str) else json.dumps(value))}"
+        for key, value in metadata.items()
+        if re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", key)
+    )
+    return (
+        '<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>\n'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/">\n'
+        ' <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">\n'
+        f'  <rdf:Description rdf:about="" xmlns:dnx="{XMP_NAMESPACE}"{attributes}/>\n'
+        " </rdf:RDF>\n"
+        "</x:xmpmeta>\n"
+        '<?xpacket end="w"?>'
+    ).encode("utf-8")
+
+
+def embed_xmp(data: bytes, metadata: Dict[str, Any]) -> bytes:
+    """
+    Add a metadata record to an encoded JPEG or PNG image as XMP.
+
+    Parameters:
+        data (bytes): Encoded image.
+        metadata (Dict[str, Any]): Record to embed.
+
+    Returns:
+        bytes: Image with the XMP packet.
+    """
+    packet = _xmp_packet(metadata)
+    if data[:2] == b"\xff\xd8":
+        payload = _XMP_HEADER + packet
+        if len(payload) > 65533:
+            raise ValueError("Metadata too large for a JPEG APP1 segment.")
+        position = 2
+        # Keep a JFIF APP0 segment first, as readers expect
+        if data[2:4] == b"\xff\xe0":
+            position = 4 + struct.unpack(">H", data[4:6])[0]
+        segment = b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+        return data[:position] + segment + data[position:]
+    if data[:8] == _PNG_SIGNATURE:
+        body = _XMP_KEYWORD + b"\x00\x00\x00\x00\x00" + packet
+        chunk = (
+            struct.pack(">I", len(body))
+            + b"iTXt"
+            + body
+            + struct.pack(">I", zlib.crc32(b"iTXt" + body) & 0xFFFFFFFF)
+        )
+        # IEND is always the last 12 bytes
+        return data[:-12] + chunk + data[-12:]
+    raise ValueError("XMP can only be embedded in JPEG or PNG data.")
+
+
+def _parse_xmp(data: bytes) -> Optional[Dict[str, Any]]:
+    start = data.find(b"<x:xmpmeta")
+    end = data.find(b"</x:xmpmeta>", start)
+    if start < 0 or end < 0:
+        return None
+    root = ElementTree.fromstring(data[start : end + len(b"</x:xmpmeta>")])
+    prefix = "{" + XMP_NAMESPACE + "}"
+    record: Dict[str, Any] = {}
+    for description in root.iter(
+        "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}Description"
+    ):
+        for name, value in description.attrib.items():
+            if not name.startswith(prefix):
+                continue
+            key = name[len(prefix) :]
+            if key in TEXT_FIELDS:
+                record[key] = value
+                continue
+            try:
+                record[key] = json.loads(value)
+            except ValueError:
+                record[key] = value
+    return record or None
+
+
+def _image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """Get the width and height of encoded JPEG or PNG data from its header."""
+    if data[:8] == _PNG_SIGNATURE:
+        return struct.unpack(">II", data[16:24])
+    if data[:2] != b"\xff\xd8":
+        return None
+    position = 2
+    while position + 9 <= len(data):
+        marker = data[position + 1]
+        length = struct.unpack(">H", data[position + 2 : position + 4])[0]
+        # Start-of-frame markers, except DHT, JPG and DAC
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[position + 5 : position + 9])
+            return width, height
+        position += 2 + length
+    return None
+
+
+def sidecar_path(path: str) -> str:
+    """Get the JSON sidecar path of an image, e.g. image.png.json."""
+    return path + SIDECAR_EXTENSION
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def _complete(metadata: Dict[str, Any], width: int) -> Dict[str, Any]:
+    if "fov_um" in metadata and "um_per_pixel" not in metadata and width:
+        metadata = dict(metadata, um_per_pixel=metadata["fov_um"] / width)
+    return metadata
+
+
+def _encode_params(extension: str, quality: int) -> List[int]:
+    if extension in (".jpg", ".jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, quality]
+    if extension == ".webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    if extension == ".png":
+        # Quality 0..100 maps to compression 9..0
+        return [cv2.IMWRITE_PNG_COMPRESSION, max(0, min(9, 9 - quality // 11))]
+    return []
+
+
+def write_image(
+    path: str,
+    image: np.ndarray,
+    metadata: Optional[Dict[str, Any]] = None,
+    quality: int = 95,
+    sidecar: bool = False,
+) -> int:
+    """
+    Encode an image and save it with its metadata.
+
+    Parameters:
+        path (str): Output file; the extension selects the format.
+        image (numpy.ndarray): Image to save.
+        metadata (Dict[str, Any]): Record from `frame_metadata()`, or None.
+        quality (int): JPEG/WebP quality, or PNG effort, 0 to 100.
+        sidecar (bool): Also write the record to a JSON sidecar file.
+
+    Returns:
+        int: Bytes written to the image file.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    ret, encoded = cv2.imencode(extension, image, _encode_params(extension, quality))
+    if not ret:
+        raise IOError(f"Error encoding {path}.")
+    data = encoded.tobytes()
+    if metadata is not None:
+        metadata = _complete(metadata, image.shape[1])
+        if extension in (".jpg", ".jpeg", ".png"):
+            data = embed_xmp(data, metadata)
+        else:
+            sidecar = True
+        if sidecar:
+            write_sidecar(path, metadata)
+    _write_atomic(path, data)
+    return len(data)
+
+
+def write_sidecar(path: str, metadata: Dict[str, Any]) -> str:
+    """Write a metadata record next to an image; returns the sidecar path."""
+    sidecar = sidecar_path(path)
+    _write_atomic(sidecar, json.dumps(metadata, indent=2).encode("utf-8"))
+    return sidecar
+
+
+def attach_metadata(path: str, metadata: Dict[str, Any], sidecar: bool = False) -> None:
+    """
+    Add metadata to an image already on disk, e.g. from `GetWiFiImage`.
+    JPEG and PNG files are rewritten with XMP, other formats get a sidecar.
+
+    Parameters:
+        path (str): Image file.
+        metadata (Dict[str, Any]): Record from `frame_metadata()`.
+        sidecar (bool): Also write a JSON sidecar file.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    size = _image_size(data)
+    if size is not None:
+        metadata = _complete(metadata, size[0])
+        _write_atomic(path, embed_xmp(data, metadata))
+    if size is None or sidecar:
+        write_sidecar(path, metadata)
+
+
+def read_metadata(path: str) -> Optional[Dict[str, Any]]:
+    """
+    Read the metadata record of an image from its sidecar or embedded XMP.
+
+    Returns:
+        Optional[Dict[str, Any]]: The record, or None if the image has none.
+    """
+    sidecar = sidecar_path(path)
+    if os.path.exists(sidecar):
+        with open(sidecar, encoding="utf-8") as f:
+            return json.load(f)
+    with open(path, "rb") as f:
+        return _parse_xmp(f.read())
+
+
+def expand_sources(paths: Iterable[str]) -> List[str]:
+    """List the images given by file and folder paths, folders sorted by name."""
+    images: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            images.extend(
+                os.path.join(path, name)
+                for name in sorted(os.listdir(path))
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        else:
+            images.append(path)
+    return images
+
+
+def export_image(
+    source: str,
+    output: str,
+    quality: int = 90,
+    metadata: Optional[Dict[str, Any]] = None,
+    sidecar: bool = False,
+) -> Tuple[int, int]:
+    """
+    Convert one image, carrying over its metadata record.
+
+    Parameters:
+        source (str): Input image.
+        output (str): Output image; the extension selects the format.
+        quality (int): See `write_image()`.
+        metadata (Dict[str, Any]): Fields added to the source's own record.
+        sidecar (bool): Also write a JSON sidecar file.
+
+    Returns:
+        Tuple[int, int]: Bytes read and bytes written.
+    """
+    # np.fromfile + imdecode also handles non-ASCII paths on Windows
+    data = np.fromfile(source, np.uint8)
+    image = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise IOError(f"Error decoding {source}.")
+    record = read_metadata(source) or {}
+    record.update(metadata or {})
+    record.setdefault("source", os.path.basename(source))
+    return data.size, write_image(output, image, record, quality, sidecar)
+
+
+class ExportReport:
+    """
+    Outcome of `export_batch()`.
+
+    Attributes:
+        done (int): Images exported by this run.
+        skipped (int): Images already exported by an earlier run.
+        failed (List[Tuple[str, str]]): Source and error of each failed image.
+        bytes_in (int): Bytes read by this run.
+        bytes_out (int): Bytes written by this run.
+        seconds (float): Wall time of this run.
+    """
+
+    def __init__(self) -> None:
+        self.done = 0
+        self.skipped = 0
+        self.failed: List[Tuple[str, str]] = []
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def format(self) -> str:
+        rate = self.done / self.seconds if self.seconds else 0.0
+        ratio = self.bytes_out / self.bytes_in if self.bytes_in else 0.0
+        lines = [
+            f"Exported {self.done} images in {self.seconds:.2f} s ({rate:.1f}/s), "
+            f"{self.skipped} already done, {len(self.failed)} failed; "
+            f"output {ratio * 100:.0f}% of input size"
+        ]
+        lines.extend(f"  {source}: {error}" for source, error in self.failed)
+        return "\n".join(lines)
+
+
+def _load_progress(path: str) -> Dict[Tuple, Dict[str, Any]]:
+    """Read the progress file, keyed by source, output extension and quality."""
+    progress: Dict[Tuple, Dict[str, Any]] = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by an interruption
+                    continue
+                key = (entry["source"], entry.get("extension"), entry.get("quality"))
+                progress[key] = entry
+    return progress
+
+
+def export_batch(
+    sources: Iterable[str],
+    directory: str,
+    extension: str = ".jpg",
+    quality: int = 90,
+    metadata: Optional[Dict[str, Any]] = None,
+    sidecar: bool = False,
+    workers: Optional[int] = None,
+) -> ExportReport:
+    """
+    Convert images in parallel, resuming an earlier interrupted run.
+
+    A source counts as done when the progress file lists it with its current
+    size and modification time, exported to the same format and quality, and
+    its output exists; changed sources and new settings are exported again. Sources that would export to the same name, e.g. a.png and
+    a.jpg, are reported as failed after the first, as are unreadable ones.
+
+    Parameters:
+        sources (Iterable[str]): Image files and folders of images.
+        directory (str): Output folder, also holding the progress file.
+        extension (str): Output format, e.g. ".jpg", ".png" or ".webp".
+        quality (int): See `write_image()`.
+        metadata (Dict[str, Any]): Fields added to every image's record.
+        sidecar (bool): Also write JSON sidecar files.
+        workers (int): Threads used, default one per core.
+
+    Returns:
+        ExportReport: Counts, failures and timing of the run.
+    """
+    report = ExportReport()
+    start = time.perf_counter()
+    os.makedirs(directory, exist_ok=True)
+    progress_path = os.path.join(directory, PROGRESS_FILE)
+    progress = _load_progress(progress_path)
+    jobs: List[Tuple[str, str, os.stat_result]] = []
+    outputs: Dict[str, str] = {}
+    for source in expand_sources(sources):
+        source = os.path.abspath(source)
+        name = os.path.splitext(os.path.basename(source))[0] + extension
+        if outputs.setdefault(name, source) != source:
+            # The first source keeps the name; exporting this one would overwrite it
+            report.failed.append((source, f"{outputs[name]} already exports to {name}"))
+            continue
+        output = os.path.join(directory, name)
+        try:
+            stat = os.stat(source)
+        except OSError as e:
+            report.failed.append((source, str(e)))
+            continue
+        entry = progress.get((source, extension, quality))
+        if (
+            entry is not None
+            and entry["size"] == stat.st_size
+            and entry["mtime"] == stat.st_mtime
+            and os.path.exists(output)
+        ):
+            report.skipped += 1
+            continue
+        jobs.append((source, output, stat))
+    executor = concurrent.futures.ThreadPoolExecutor(workers or os.cpu_count())
+    with executor, open(progress_path, "a", encoding="utf-8") as log:
+        futures = {}
+        for source, output, stat in jobs:
+            future = executor.submit(
+                export_image, source, output, quality, metadata, sidecar
+            )
+            futures[future] = (source, output, stat)
+        for future in concurrent.futures.as_completed(futures):
+            source, output, stat = futures[future]
+            try:
+                bytes_in, bytes_out = future.result()
+            except Exception as e:
+                report.failed.append((source, str(e)))
+                continue
+            report.done += 1
+            report.bytes_in += bytes_in
+            report.bytes_out += bytes_out
+            entry = {
+                "source": source,
+                "output": os.path.basename(output),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "extension": extension,
+                "quality": quality,
+            }
+            log.write(json.dumps(entry) + "\n")
+            log.flush()
+    report.seconds = time.perf_counter() - start
+    return report
@@ -0,0 +1,268 @@
+"""
+Exposure-bracketed HDR capture.
+
+`capture_bracket()` turns auto exposure off, steps through a list of exposure
+values and, after each step, drops frames until the image brightness has moved
+away from its level before the step, in the direction of the change, and then
+stopped changing. Frames still exposed with the old value, however many the
+camera delivers, and frames exposed during the transition are not kept. The previous auto
+exposure state and exposure value are restored afterwards, even on errors.
+
+`fuse_exposures()` merges the bracket with single-scale exposure fusion: each
+pixel is a weighted mean of the brackets, favouring well-exposed values. The
+weights are computed and smoothed on a downscaled copy and upsampled band by
+band, so a 5-bracket 2592x1944 merge stays well under a second on a CPU and never
+holds more than one band of float data.
+
+    bracket = capture_bracket(microscope, camera, [250, 500, 1000, 2000, 4000], 0)
+    cv2.imwrite("hdr.png", fuse_exposures(bracket.frames))
+"""
+
+import time
+from typing import List, Optional, Sequence
+
+import cv2
+import numpy as np
+
+# Mean brightness at which a frame cannot get darker or brighter any more
+DARK_LEVEL = 5.0
+CLIP_LEVEL = 250.0
+
+
+def bracket_exposures(center: int, stops: float = 2.0, count: int = 5) -> List[int]:
+    """
+    Get exposure values spread evenly in stops around a center value.
+
+    Parameters:
+        center (int): Middle exposure value, e.g. the current one.
+        stops (float): Stops from the center to either end, 2.0 gives 1/4x to 4x.
+        count (int): Number of exposures.
+
+    Returns:
+        List[int]: Exposure values, darkest first.
+    """
+    if count == 1:
+        return [int(center)]
+    steps = np.linspace(-stops, stops, count)
+    return sorted({max(1, int(round(center * 2.0**step))) for step in steps})
+
+
+def _brightness(frame: np.ndarray) -> float:
+    return float(frame[::16, ::16].mean())
+
+
+def _read(camera) -> np.ndarray:
+    ret, frame = camera.read()
+    if not ret:
+        raise IOError("Error reading a frame from the camera.")
+    return frame
+
+
+class Bracket:
+    """
+    Frames of one bracketed capture.
+
+    Attributes:
+        exposures (List[int]): Exposure value of each frame.
+        frames (List[numpy.ndarray]): Settled frame for each exposure.
+        dropped (List[int]): Transition frames dropped before each frame.
+        settled (List[bool]): False where `max_drop` was reached first, so the
+            frame may still show the previous exposure.
+        seconds (float): Wall time of the capture.
+    """
+
+    def __init__(self) -> None:
+        self.exposures: List[int] = []
+        self.frames: List[np.ndarray] = []
+        self.dropped: List[int] = []
+        self.settled: List[bool] = []
+        self.seconds = 0.0
+
+
+def capture_bracket(
+    microscope,
+    camera,
+    exposures: Sequence[int],
+    device_index: int,
+    tolerance: float = 0.02,
+    min_drop: int = 1,
+    max_drop: int = 15,
+) -> Bracket:
+    """
+    Capture one settled frame per exposure value.
+
+    The mean brightness is recorded before each SetExposureValue call. Frames are
+    then dropped until the brightness has moved by more than `tolerance`
+    (relative) from that level, brighter for a longer exposure and darker for a
+    shorter one, and two consecutive frames after the move differ by less than
+    `tolerance`. Cameras apply a new exposure several frames late, so frames
+    still showing the old level never count as settled. From a clipped or black
+    level no move is possible and only steadiness is required. At least
+    `min_drop` and at most `max_drop` frames are dropped per step; the default
+    allows for the DLL's command latency of about 0.25 s at 30 fps and more.
+
+    Parameters:
+        microscope (DNX64): Microscope controlling the camera.
+        camera: Frame source with `read()`, e.g. from `DNX64.sources`.
+        exposures (Sequence[int]): Exposure values; captured in ascending order
+            so each step is small.
+        device_index (int): Index of the device.
+        tolerance (float): Relative brightness change accepted as settled.
+        min_drop (int): Frames always dropped after a change.
+        max_drop (int): Most frames dropped after a change; the frame reached
+            then is kept and marked as not settled.
+
+    Returns:
+        Bracket: The settled frames, darkest first.
+    """
+    bracket = Bracket()
+    start = time.perf_counter()
+    auto_exposure = microscope.GetAutoExposure(device_index)
+    exposure = microscope.GetExposureValue(device_index)
+    try:
+        microscope.SetAutoExposure(device_index, 0)
+        level = _brightness(_read(camera))
+        current = exposure
+        for value in sorted(exposures):
+            before = level
+            microscope.SetExposureValue(device_index, value)
+            direction = (value > current) - (value < current)
+            if (direction > 0 and before >= CLIP_LEVEL) or (
+                direction < 0 and before <= DARK_LEVEL
+            ):
+                direction = 0
+            moved = direction == 0
+            previous: Optional[float] = None
+            dropped = 0
+            while True:
+                frame = _read(camera)
+                level = _brightness(frame)
+                settled = False
+                if not moved:
+                    change = (level - before) * direction
+                    moved = change > tolerance * max(before, 1.0)
+                elif previous is not None:
+                    settled = abs(level - previous) <= tolerance * max(previous, 1.0)
+                if dropped >= min_drop and (settled or dropped >= max_drop):
+                    break
+                previous = level
+                dropped += 1
+            current = value
+            bracket.exposures.append(value)
+            bracket.frames.append(frame)
+            bracket.dropped.append(dropped)
+            bracket.settled.append(settled)
+    finally:
+        # Restoring the value first also lets auto exposure restart where it was
+        microscope.SetExposureValue(device_index, exposure)
+        microscope.SetAutoExposure(device_index, auto_exposure)
+    bracket.seconds = time.perf_counter() - start
+    return bracket
+
+
+def exposure_weights(
+    frames: Sequence[np.ndarray], scale: int = 4, sigma: float = 0.2
+) -> List[np.ndarray]:
+    """
+    Compute normalised well-exposedness weights on downscaled frames.
+
+    Parameters:
+        frames (Sequence[numpy.ndarray]): Brackets of equal size, BGR or gray uint8.
+        scale (int): Downscale factor of the weight maps.
+        sigma (float): Width of the Gaussian around mid-grey, in 0..1 units.
+
+    Returns:
+        List[numpy.ndarray]: float32 weight map per frame at 1/`scale` size,
+        summing to 1 at every pixel.
+    """
+    height, width = frames[0].shape[:2]
+    # Rounded up, so `scale` times the map covers every row of the frame
+    small_size = (max(1, -(-width // scale)), max(1, -(-height // scale)))
+    weights = []
+    for frame in frames:
+        small = cv2.resize(frame, small_size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        luma = small.astype(np.float32) * (1.0 / 255.0) - 0.5
+        weight = np.exp(luma * luma * (-0.5 / (sigma * sigma)))
+        # Smooth so weights change over a few pixels, avoiding seams at edges
+        weights.append(cv2.GaussianBlur(weight, (0, 0), 2.0) + 1e-6)
+    total = np.sum(weights, axis=0)
+    return [weight / total for weight in weights]
+
+
+def fuse_exposures(
+    frames: Sequence[np.ndarray],
+    scale: int = 4,
+    sigma: float = 0.2,
+    band: int = 256,
+) -> np.ndarray:
+    """
+    Merge a bracket into one well-exposed image.
+
+    Parameters:
+        frames (Sequence[numpy.ndarray]): Brackets of equal size, BGR or gray uint8.
+        scale (int): Downscale factor of the weight maps.
+        sigma (float): Width of the well-exposedness Gaussian, in 0..1 units.
+        band (int): Rows merged at a time; rounded to a multiple of `scale`.
+
+    Returns:
+        numpy.ndarray: Fused uint8 image of the input shape.
+    """
+    if len(frames) == 1:
+        return frames[0].copy()
+    height, width = frames[0].shape[:2]
+    weights = exposure_weights(frames, scale, sigma)
+    small_height = weights[0].shape[0]
+    band = max(scale, band - band % scale)
+    output = np.empty_like(frames[0])
+    channels = frames[0].shape[2:]
+    accumulator = np.empty((band, width) + channels, np.float32)
+    product = np.empty_like(accumulator)
+    for top in range(0, height, band):
+        bottom = min(top + band, height)
+        rows = bottom - top
+        # One low-res row of margin makes the band upsample exactly like the full map
+        first = max(top // scale - 1, 0)
+        last = min(-(-bottom // scale) + 1, small_height)
+        offset = top - first * scale
+        acc = accumulator[:rows]
+        acc.fill(0.0)
+        for frame, weight in zip(frames, weights):
+            full = cv2.resize(
+                weight[first:last],
+                (width, (last - first) * scale),
+                interpolation=cv2.INTER_LINEAR,
+            )[offset : offset + rows]
+            if channels:
+                full = full[..., None]
+            np.multiply(frame[top:bottom], full, out=product[:rows])
+            acc += product[:rows]
+        acc += 0.5
+        np.clip(acc, 0, 255, out=acc)
+        output[top:bottom] = acc
+    return output
+
+
+def capture_hdr(
+    microscope,
+    camera,
+    exposures: Sequence[int],
+    device_index: int,
+    **kwargs,
+) -> np.ndarray:
+    """
+    Capture a bracket and fuse it.
+
+    Parameters:
+        microscope (DNX64): Microscope controlling the camera.
+        camera: Frame source with `read()`.
+        exposures (Sequence[int]): Exposure values, see `bracket_exposures()`.
+        device_index (int): Index of the device.
+        **kwargs: Passed to `capture_bracket()`.
+
+    Returns:
+        numpy.ndarray: Fused uint8 image.
+    """
+    bracket = capture_bracket(microscope, camera, exposures, device_index, **kwargs)
+    return fuse_exposures(bracket.frames)
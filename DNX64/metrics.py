@@ -0,0 +1,261 @@
+"""
+Opt-in latency instrumentation for DNX64.dll calls.
+
+`DNX64.enable_metrics()` wraps every DLL function bound in `setup()` so each call
+is timed with `time.perf_counter_ns()` and counted into a fixed-bucket histogram
+per method and device index. Series and their buckets are allocated the first time
+a method/device pair is seen, so a steady stream of calls allocates nothing.
+"""
+
+import bisect
+import contextlib
+import json
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+# Histogram upper bounds in nanoseconds, from 1 us to 2.5 s; anything slower
+# lands in the final +Inf bucket.
+BUCKET_BOUNDS_NS = (
+    1_000,
+    2_500,
+    5_000,
+    10_000,
+    25_000,
+    50_000,
+    100_000,
+    250_000,
+    500_000,
+    1_000_000,
+    2_500_000,
+    5_000_000,
+    10_000_000,
+    25_000_000,
+    50_000_000,
+    100_000_000,
+    250_000_000,
+    500_000_000,
+    1_000_000_000,
+    2_500_000_000,
+)
+
+NO_DEVICE = -1
+
+
+class MethodSeries:
+    """Call count, error count and latency histogram for one method on one device."""
+
+    __slots__ = ("method", "device", "count", "errors", "total_ns", "max_ns", "buckets")
+
+    def __init__(self, method: str, device: int) -> None:
+        self.method = method
+        self.device = device
+        self.count = 0
+        self.errors = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * (len(BUCKET_BOUNDS_NS) + 1)
+
+    def as_dict(self) -> dict:
+        """
+        Summarise the series with latencies in seconds.
+
+        Returns:
+            dict: Counts, total/mean/max latency and cumulative bucket counts.
+        """
+        cumulative, running = {}, 0
+        for bound, count in zip(BUCKET_BOUNDS_NS, self.buckets):
+            running += count
+            cumulative[f"{bound / 1e9:g}"] = running
+        cumulative["+Inf"] = running + self.buckets[-1]
+        return {
+            "method": self.method,
+            "device": None if self.device == NO_DEVICE else self.device,
+            "count": self.count,
+            "errors": self.errors,
+            "total_seconds": self.total_ns / 1e9,
+            "mean_seconds": self.total_ns / (self.count or 1) / 1e9,
+            "max_seconds": self.max_ns / 1e9,
+            "buckets": cumulative,
+        }
+
+
+class CallMetrics:
+    """
+    Registry of per-method, per-device DLL call statistics.
+
+    Example:
+        metrics = microscope.enable_metrics()
+        microscope.GetAMR(0)
+        print(metrics.to_prometheus())
+
+        with metrics.profile() as block:
+            run_inspection(microscope)
+        print(block.to_json(indent=2))
+    """
+
+    def __init__(self) -> None:
+        self._series: Dict[str, Dict[int, MethodSeries]] = {}
+        self._profiles: List["CallMetrics"] = []
+        self._lock = threading.Lock()
+
+    def observe(self, method: str, device: int, elapsed_ns: int, error: bool) -> None:
+        """
+        Record one call.
+
+        Parameters:
+            method (str): DLL function name.
+            device (int): Device index, or NO_DEVICE for functions without one.
+            elapsed_ns (int): Call duration in nanoseconds.
+            error (bool): True if the call raised.
+        """
+        with self._lock:
+            by_device = self._series.get(method)
+            if by_device is None:
+                by_device = self._series[method] = {}
+            series = by_device.get(device)
+            if series is None:
+                series = by_device[device] = MethodSeries(method, device)
+            series.count += 1
+            series.total_ns += elapsed_ns
+            if elapsed_ns > series.max_ns:
+                series.max_ns = elapsed_ns
+            series.buckets[bisect.bisect_left(BUCKET_BOUNDS_NS, elapsed_ns)] += 1
+            if error:
+                series.errors += 1
+            profiles = self._profiles
+        for profile in profiles:
+            profile.observe(method, device, elapsed_ns, error)
+
+    def wrap(self, method: str, func: Callable, device_arg: bool) -> Callable:
+        """
+        Wrap a DLL function so every call is recorded.
+
+        Parameters:
+            method (str): DLL function name used as the metric label.
+            func (Callable): The ctypes function to time.
+            device_arg (bool): True if the first argument is the device index.
+
+        Returns:
+            Callable: Wrapper with the original function in `__wrapped__`.
+        """
+        observe = self.observe
+        clock = time.perf_counter_ns
+
+        def timed(*args):
+            device = args[0] if device_arg and args else NO_DEVICE
+            start = clock()
+            try:
+                result = func(*args)
+            except BaseException:
+                observe(method, device, clock() - start, True)
+                raise
+            observe(method, device, clock() - start, False)
+            return result
+
+        timed.__name__ = method
+        timed.__wrapped__ = func
+        return timed
+
+    def series(self) -> List[MethodSeries]:
+        """
+        Get all recorded series, sorted by method and device.
+
+        Returns:
+            List[MethodSeries]: Live series objects.
+        """
+        with self._lock:
+            found = [
+                s for by_device in self._series.values() for s in by_device.values()
+            ]
+        return sorted(found, key=lambda s: (s.method, s.device))
+
+    def reset(self) -> None:
+        """Discard all recorded calls."""
+        with self._lock:
+            self._series.clear()
+
+    @contextlib.contextmanager
+    def profile(self) -> Iterator["CallMetrics"]:
+        """
+        Collect the calls made inside a `with` block into a separate registry.
+
+        Yields:
+            CallMetrics: Registry receiving only the calls made in the block.
+        """
+        block = CallMetrics()
+        with self._lock:
+            self._profiles = self._profiles + [block]
+        try:
+            yield block
+        finally:
+            with self._lock:
+                self._profiles = [p for p in self._profiles if p is not block]
+
+    def as_dict(self) -> dict:
+        """
+        Get all series as plain data.
+
+        Returns:
+            dict: {"bucket_bounds_seconds": [...], "series": [...]}
+        """
+        return {
+            "bucket_bounds_seconds": [bound / 1e9 for bound in BUCKET_BOUNDS_NS],
+            "series": [s.as_dict() for s in self.series()],
+        }
+
+    def to_json(self, indent: Optional[int] = None) -> str:
+        """
+        Export all series as JSON.
+
+        Parameters:
+            indent (int): Indentation passed to `json.dumps`.
+
+        Returns:
+            str: JSON document.
+        """
+        return json.dumps(self.as_dict(), indent=indent)
+
+    def to_prometheus(self, prefix: str = "dnx64") -> str:
+        """
+        Export all series in the Prometheus text exposition format.
+
+        Parameters:
+            prefix (str): Metric name prefix.
+
+        Returns:
+            str: Metrics text ending with a newline.
+        """
+        duration, calls, errors = (
+            f"{prefix}_call_duration_seconds",
+            f"{prefix}_calls_total",
+            f"{prefix}_call_errors_total",
+        )
+        histogram = [
+            f"# HELP {duration} Time spent in DNX64.dll calls.",
+            f"# TYPE {duration} histogram",
+        ]
+        call_lines = [
+            f"# HELP {calls} DNX64.dll calls made.",
+            f"# TYPE {calls} counter",
+        ]
+        error_lines = [
+            f"# HELP {errors} DNX64.dll calls that raised.",
+            f"# TYPE {errors} counter",
+        ]
+        for series in self.series():
+            labels = f'method="{series.method}"'
+            if series.device != NO_DEVICE:
+                labels += f',device="{series.device}"'
+            running = 0
+            for bound, count in zip(BUCKET_BOUNDS_NS, series.buckets):
+                running += count
+                histogram.append(
+                    f'{duration}_bucket{{{labels},le="{bound / 1e9:g}"}} {running}'
+                )
+            histogram.append(f'{duration}_bucket{{{labels},le="+Inf"}} {series.count}')
+            histogram.append(f"{duration}_sum{{{labels}}} {series.total_ns / 1e9:.9f}")
+            histogram.append(f"{duration}_count{{{labels}}} {series.count}")
+            call_lines.append(f"{calls}{{{labels}}} {series.count}")
+            error_lines.append(f"{errors}{{{labels}}} {series.errors}")
+        return "\n".join(histogram + call_lines + error_lines) + "\n"
@@ -0,0 +1,74 @@
+"""
+Minimal reader for multipart MJPEG HTTP streams, such as the WF-10 / WF-20
+Dino-Lite Streamer's `http://10.10.10.254:8080/?action=stream`.
+
+Frames are yielded as the JPEG bytes sent by the streamer, without decoding.
+"""
+
+import urllib.request
+from typing import BinaryIO, Iterator
+
+SOI = b"\xff\xd8"
+EOI = b"\xff\xd9"
+
+
+def read_parts(stream: BinaryIO) -> Iterator[bytes]:
+    """
+    Split a multipart/x-mixed-replace body into JPEG frames.
+
+    Parts with a Content-Length header are read exactly; otherwise the part is
+    scanned up to the JPEG end-of-image marker.
+
+    Parameters:
+        stream (BinaryIO): Response body positioned at the first boundary.
+
+    Returns:
+        Iterator[bytes]: JPEG images, one per part.
+    """
+    while True:
+        line = stream.readline()
+        if not line:
+            return
+        if not line.startswith(b"--"):
+            continue
+        length = None
+        while True:
+            header = stream.readline()
+            if not header:
+                return
+            header = header.strip()
+            if not header:
+                break
+            name, _, value = header.partition(b":")
+            if name.strip().lower() == b"content-length":
+                length = int(value.strip())
+        if length is not None:
+            data = stream.read(length)
+            if len(data) < length:
+                return
+        else:
+            data = bytearray()
+            while not data.endswith(EOI):
+                chunk = stream.readline()
+                if not chunk:
+                    return
+                data += chunk
+            data = bytes(data)
+        start = data.find(SOI)
+        if start >= 0:
+            yield data[start:]
+
+
+def iter_mjpeg(url: str, timeout: float = 5.0) -> Iterator[bytes]:
+    """
+    Connect to an MJPEG stream and yield its JPEG frames until it closes.
+
+    Parameters:
+        url (str): Stream URL.
+        timeout (float): Socket timeout in seconds.
+
+    Returns:
+        Iterator[bytes]: JPEG images in arrival order.
+    """
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        yield from read_parts(response)
@@ -0,0 +1,696 @@
+"""
+Incremental mosaic stitching for XY-stage scans.
+
+Each frame added to a `Mosaic` is registered with FFT phase correlation on a
+downsampled grayscale copy: first against the previous frame, with the last
+step as the predicted offset, then against earlier tiles it overlaps, so rows
+of a serpentine scan line up too. A match is only accepted if registering again
+at the offset it found confirms it; when the predicted offset is stale, e.g. at
+the turn of a row, a whole-frame search takes over. The microscope's field of
+view (`FOVx` at the `GetAMR` magnification) gives the micrometres per pixel,
+which bounds how far a frame may plausibly have moved and converts stage
+positions into pixels.
+
+Registered frames are feather-blended into a `TileCanvas`: fixed-size tiles in
+.npy files on disk, of which only a bounded number are memory-mapped at a time,
+so memory stays flat however large the mosaic grows. A second, in-memory canvas
+at a fraction of the resolution provides the live overview. `save()` writes PNG
+files strip by strip from the tiles, so saving stays flat too, and a closed
+mosaic can be reopened with `Mosaic.load()` to save it later.
+
+    mosaic = Mosaic.from_microscope(microscope, 0, "scan", frame_width=1280)
+    for frame in frames:
+        mosaic.add(frame)
+        cv2.imshow("overview", mosaic.overview())
+    mosaic.save_overview("scan_overview.png")
+    mosaic.close()
+    Mosaic.load("scan").save("board.png")  # full resolution, any time later
+"""
+
+import collections
+import json
+import math
+import os
+import re
+import struct
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+INDEX_FILE = "mosaic.json"
+TILE_FILE = re.compile(r"tile_(-?\d+)_(-?\d+)_image\.npy$")
+# Default largest move between frames, as a share of the field of view
+MAX_STEP_FOV = 0.75
+# Largest disagreement, in downsampled pixels, of a match with its confirmation
+CONFIRM_TOLERANCE = 2.0
+# Matches at the predicted offset weaker than this are checked by a full search
+STRONG_RESPONSE = 0.5
+
+
+def microns_per_pixel(
+    microscope,
+    device_index: int,
+    frame_width: int,
+    magnification: Optional[float] = None,
+) -> Optional[float]:
+    """
+    Get the image scale at the current magnification.
+
+    Parameters:
+        microscope (DNX64): Microscope of the device.
+        device_index (int): Index of the device.
+        frame_width (int): Width of the frames in pixels.
+        magnification (float): Magnification set on the lens, used on models
+            without AMR; the AMR reading takes precedence.
+
+    Returns:
+        Optional[float]: Micrometres per pixel, or None if the magnification is
+        unknown or the device reports no field of view for it.
+    """
+    if microscope.capabilities(device_index).amr:
+        magnification = microscope.GetAMR(device_index)
+    if not magnification:
+        return None
+    fov = microscope.FOVx(device_index, magnification)
+    if not math.isfinite(fov) or fov <= 0:
+        return None
+    return fov / frame_width
+
+
+class TileCanvas:
+    """
+    Unbounded image assembled from fixed-size tiles with per-pixel blend weights.
+
+    Each tile holds a uint8 image and a uint8 weight; blending a new image keeps
+    the weighted mean, with the weight saturating at 255. With a `directory` the
+    tiles are .npy files and at most `cache_tiles` of them are mapped at once;
+    without one they live in memory.
+
+    Attributes:
+        tile_size (int): Tile width and height in pixels.
+        channels (int): Image channels, 3 for BGR.
+    """
+
+    def __init__(
+        self,
+        tile_size: int = 512,
+        channels: int = 3,
+        directory: Optional[str] = None,
+        cache_tiles: int = 64,
+    ) -> None:
+        self.tile_size = tile_size
+        self.channels = channels
+        self.directory = directory
+        self.cache_tiles = cache_tiles
+        self.tiles = set()
+        self._cache: "collections.OrderedDict[Tuple[int, int], tuple]" = (
+            collections.OrderedDict()
+        )
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, tile: Tuple[int, int], kind: str) -> str:
+        return os.path.join(self.directory, f"tile_{tile[0]}_{tile[1]}_{kind}.npy")
+
+    def _tile(self, tile: Tuple[int, int], create: bool = True):
+        arrays = self._cache.get(tile)
+        if arrays is not None:
+            self._cache.move_to_end(tile)
+            return arrays
+        if tile not in self.tiles and not create:
+            return None
+        size = self.tile_size
+        image_shape = (size, size, self.channels) if self.channels > 1 else (size, size)
+        if self.directory is None:
+            arrays = (np.zeros(image_shape, np.uint8), np.zeros((size, size), np.uint8))
+        elif tile in self.tiles:
+            arrays = (
+                np.load(self._path(tile, "image"), mmap_mode="r+"),
+                np.load(self._path(tile, "weight"), mmap_mode="r+"),
+            )
+        else:
+            arrays = (
+                np.lib.format.open_memmap(
+                    self._path(tile, "image"), "w+", np.uint8, image_shape
+                ),
+                np.lib.format.open_memmap(
+                    self._path(tile, "weight"), "w+", np.uint8, (size, size)
+                ),
+            )
+        self.tiles.add(tile)
+        self._cache[tile] = arrays
+        if self.directory is not None and len(self._cache) > self.cache_tiles:
+            _, evicted = self._cache.popitem(last=False)
+            for array in evicted:
+                array.flush()
+        return arrays
+
+    def _regions(self, x: int, y: int, width: int, height: int):
+        """Yield (tile, tile slices, image slices) covering a rectangle."""
+        size = self.tile_size
+        for ty in range(y // size, (y + height - 1) // size + 1):
+            for tx in range(x // size, (x + width - 1) // size + 1):
+                x0, y0 = max(x, tx * size), max(y, ty * size)
+                x1 = min(x + width, (tx + 1) * size)
+                y1 = min(y + height, (ty + 1) * size)
+                yield (
+                    (tx, ty),
+                    (
+                        slice(y0 - ty * size, y1 - ty * size),
+                        slice(x0 - tx * size, x1 - tx * size),
+                    ),
+                    (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x)),
+                )
+
+    def blend(self, image: np.ndarray, weight: np.ndarray, x: int, y: int) -> None:
+        """
+        Blend an image into the canvas.
+
+        Parameters:
+            image (numpy.ndarray): uint8 image.
+            weight (numpy.ndarray): uint8 weight per pixel, 0 leaves the canvas as is.
+            x (int): Canvas column of the image's left edge.
+            y (int): Canvas row of the image's top edge.
+        """
+        height, width = image.shape[:2]
+        for tile, tile_slices, image_slices in self._regions(x, y, width, height):
+            tile_image, tile_weight = self._tile(tile)
+            new_w = weight[image_slices].astype(np.float32)
+            old_w = tile_weight[tile_slices].astype(np.float32)
+            total = old_w + new_w
+            divisor = np.maximum(total, 1.0)
+            if image.ndim == 3:
+                new_w, old_w, divisor = (
+                    new_w[..., None],
+                    old_w[..., None],
+                    divisor[..., None],
+                )
+            mixed = tile_image[tile_slices] * old_w + image[image_slices] * new_w
+            tile_image[tile_slices] = mixed / divisor + 0.5
+            tile_weight[tile_slices] = np.minimum(total, 255.0)
+
+    def read(self, x: int, y: int, width: int, height: int) -> np.ndarray:
+        """
+        Read a rectangle of the canvas; empty areas are black.
+
+        Returns:
+            numpy.ndarray: uint8 image of the rectangle.
+        """
+        shape = (height, width, self.channels) if self.channels > 1 else (height, width)
+        output = np.zeros(shape, np.uint8)
+        for tile, tile_slices, image_slices in self._regions(x, y, width, height):
+            arrays = self._tile(tile, create=False)
+            if arrays is not None:
+                output[image_slices] = arrays[0][tile_slices]
+        return output
+
+    def bounds(self) -> Tuple[int, int, int, int]:
+        """Get the x, y, width and height of the area covered by tiles."""
+        if not self.tiles:
+            return 0, 0, 0, 0
+        size = self.tile_size
+        xs = [tile[0] for tile in self.tiles]
+        ys = [tile[1] for tile in self.tiles]
+        x0, y0 = min(xs) * size, min(ys) * size
+        return x0, y0, (max(xs) + 1) * size - x0, (max(ys) + 1) * size - y0
+
+    def flush(self) -> None:
+        """Write mapped tiles to disk."""
+        if self.directory is not None:
+            for arrays in self._cache.values():
+                for array in arrays:
+                    array.flush()
+
+    def close(self) -> None:
+        """Flush and unmap every tile."""
+        self.flush()
+        self._cache.clear()
+
+
+class MosaicTile:
+    """Placement of one registered frame; `small` is dropped once it is not recent."""
+
+    __slots__ = ("index", "x", "y", "width", "height", "response", "small")
+
+    def __init__(self, index, x, y, width, height, response, small) -> None:
+        self.index = index
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.response = response
+        self.small = small
+
+    def as_dict(self) -> dict:
+        return {
+            "index": self.index,
+            "x": self.x,
+            "y": self.y,
+            "width": self.width,
+            "height": self.height,
+            "response": self.response,
+        }
+
+
+class Mosaic:
+    """
+    Register and blend frames of a scan into a disk-backed canvas.
+
+    Attributes:
+        tiles (List[MosaicTile]): Placement of every accepted frame.
+        rejected (int): Frames that could not be registered.
+        microns_per_pixel (float): Image scale, or None if unknown.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        microns_per_pixel: Optional[float] = None,
+        max_step_um: Optional[float] = None,
+        downsample: int = 4,
+        feather: int = 64,
+        min_response: float = 0.1,
+        neighbours: int = 32,
+        overview_scale: int = 16,
+        tile_size: int = 512,
+        cache_tiles: int = 64,
+    ) -> None:
+        """
+        Initialize an empty mosaic.
+
+        Parameters:
+            directory (str): Folder for the canvas tiles and the index.
+            microns_per_pixel (float): Image scale, see `microns_per_pixel()`.
+            max_step_um (float): Largest stage move between frames, in micrometres;
+                registrations implying more are rejected. None allows MAX_STEP_FOV
+                of the field of view, set from the scale and the first frame.
+            downsample (int): Registration runs on frames shrunk by this factor.
+            feather (int): Width in pixels of the blend ramp at frame edges.
+            min_response (float): Weakest phase-correlation peak accepted.
+            neighbours (int): Recent frames kept for registration, besides the
+                previous one; older ones are forgotten to bound memory.
+            overview_scale (int): Overview resolution divider.
+            tile_size (int): Canvas tile size in pixels.
+            cache_tiles (int): Canvas tiles mapped at once.
+        """
+        self.directory = directory
+        self.microns_per_pixel = microns_per_pixel
+        self.max_step_um = max_step_um
+        self.downsample = downsample
+        self.feather = feather
+        self.min_response = min_response
+        self.neighbours = neighbours
+        self.overview_scale = overview_scale
+        self.tiles: List[MosaicTile] = []
+        self.rejected = 0
+        self.canvas = TileCanvas(
+            tile_size, 3, os.path.join(directory, "tiles"), cache_tiles
+        )
+        self.overview_canvas = TileCanvas(max(16, tile_size // overview_scale), 3)
+        self._recent: "collections.deque[MosaicTile]" = collections.deque(
+            maxlen=neighbours
+        )
+        self._weights: Dict[Tuple[int, int, int], np.ndarray] = {}
+        self._windows: Dict[Tuple[int, int], np.ndarray] = {}
+        self._step = (0.0, 0.0)
+        self._stage_origin: Optional[Tuple[float, float]] = None
+
+    @classmethod
+    def from_microscope(
+        cls, microscope, device_index: int, directory: str, frame_width: int, **kwargs
+    ) -> "Mosaic":
+        """
+        Create a mosaic using the device's current magnification as the scale.
+        `magnification` is passed on to `microns_per_pixel()` for models without
+        AMR; if the scale stays unknown the mosaic is built without it.
+        """
+        magnification = kwargs.pop("magnification", None)
+        scale = microns_per_pixel(microscope, device_index, frame_width, magnification)
+        return cls(directory, microns_per_pixel=scale, **kwargs)
+
+    def _max_step(self, width: int) -> float:
+        """Largest plausible move between frames, in downsampled pixels."""
+        if self.microns_per_pixel:
+            if self.max_step_um is None:
+                self.max_step_um = MAX_STEP_FOV * width * self.microns_per_pixel
+            pixels = self.max_step_um / self.microns_per_pixel
+        else:
+            pixels = MAX_STEP_FOV * width
+        return pixels / self.downsample
+
+    def _small(self, frame: np.ndarray) -> np.ndarray:
+        height, width = frame.shape[:2]
+        size = (width // self.downsample, height // self.downsample)
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small.astype(np.float32)
+
+    def _window(self, width: int, height: int) -> np.ndarray:
+        window = self._windows.get((width, height))
+        if window is None:
+            window = self._windows[(width, height)] = cv2.createHanningWindow(
+                (width, height), cv2.CV_32F
+            )
+        return window
+
+    def _register(
+        self, reference: MosaicTile, small: np.ndarray, predicted: Tuple[float, float]
+    ) -> Optional[Tuple[float, float, float]]:
+        """
+        Find the offset of `small` from `reference` near a predicted offset.
+
+        Returns:
+            Optional[Tuple[float, float, float]]: x and y offset in downsampled
+            pixels and the correlation response, or None without enough overlap.
+        """
+        height, width = small.shape
+        ox, oy = int(round(predicted[0])), int(round(predicted[1]))
+        x0, x1 = max(0, ox), min(width, width + ox)
+        y0, y1 = max(0, oy), min(height, height + oy)
+        if x1 - x0 < 32 or y1 - y0 < 32:
+            return None
+        a = reference.small[y0:y1, x0:x1]
+        b = small[y0 - oy : y1 - oy, x0 - ox : x1 - ox]
+        # Without the mean, the window shared by both sides correlates with itself
+        # and unrelated regions match at zero shift. Subtracting also makes
+        # copies, which some OpenCV versions need: they window inputs in place.
+        (sx, sy), response = cv2.phaseCorrelate(
+            a - a.mean(), b - b.mean(), self._window(x1 - x0, y1 - y0)
+        )
+        return ox - sx, oy - sy, response
+
+    def _confirm(
+        self,
+        reference: MosaicTile,
+        small: np.ndarray,
+        found: Optional[Tuple[float, float, float]],
+        limit: float,
+    ) -> Optional[Tuple[float, float, float]]:
+        """
+        Accept a match only if it is within `limit` and registering again on the
+        overlap it implies lands on the same offset. A match found from a wrong
+        prediction correlates mismatched regions, and its peak moves when
+        checked this way.
+        """
+        if (
+            found is None
+            or found[2] < self.min_response
+            or math.hypot(found[0], found[1]) > limit
+        ):
+            return None
+        again = self._register(reference, small, found[:2])
+        if (
+            again is None
+            or again[2] < self.min_response
+            or math.hypot(again[0] - found[0], again[1] - found[1]) > CONFIRM_TOLERANCE
+        ):
+            return None
+        return again
+
+    def _search(
+        self, reference: MosaicTile, small: np.ndarray, limit: float
+    ) -> Optional[Tuple[float, float, float]]:
+        """
+        Register without a usable prediction, e.g. at the turn of a scan row.
+
+        Whole-frame phase correlation only finds the offset modulo the frame
+        size, so each aliased offset within `limit` is registered again on its
+        own overlap and the strongest confirmed response wins.
+        """
+        height, width = small.shape
+        found = self._register(reference, small, (0.0, 0.0))
+        if found is None:
+            return None
+        best = None
+        for dy in (-height, 0, height):
+            for dx in (-width, 0, width):
+                if math.hypot(found[0] + dx, found[1] + dy) > limit:
+                    continue
+                candidate = self._confirm(
+                    reference,
+                    small,
+                    self._register(reference, small, (found[0] + dx, found[1] + dy)),
+                    limit,
+                )
+                if candidate is not None and (best is None or candidate[2] > best[2]):
+                    best = candidate
+        return best
+
+    def add(
+        self, frame: np.ndarray, stage_um: Optional[Tuple[float, float]] = None
+    ) -> Optional[Tuple[int, int]]:
+        """
+        Register a frame and blend it into the mosaic.
+
+        Parameters:
+            frame (numpy.ndarray): BGR frame, the same size for every call.
+            stage_um (Tuple[float, float]): Stage x and y in micrometres, if the
+                stage reports them; used as the predicted position.
+
+        Returns:
+            Optional[Tuple[int, int]]: Canvas position of the frame's top-left
+            corner, or None if it could not be registered and was skipped.
+        """
+        height, width = frame.shape[:2]
+        small = self._small(frame)
+        scale = self.downsample
+        if not self.tiles:
+            x, y, response = 0.0, 0.0, 1.0
+            if stage_um is not None:
+                self._stage_origin = stage_um
+        else:
+            previous = self.tiles[-1]
+            if stage_um is not None and self._stage_origin and self.microns_per_pixel:
+                target = (
+                    (stage_um[0] - self._stage_origin[0])
+                    / self.microns_per_pixel
+                    / scale,
+                    (stage_um[1] - self._stage_origin[1])
+                    / self.microns_per_pixel
+                    / scale,
+                )
+                predicted = (
+                    target[0] - previous.x / scale,
+                    target[1] - previous.y / scale,
+                )
+            else:
+                predicted = self._step
+            limit = self._max_step(width)
+            found = self._confirm(
+                previous, small, self._register(previous, small, predicted), limit
+            )
+            if found is None or found[2] < STRONG_RESPONSE:
+                # Possibly stale: let the whole-frame search overrule it
+                searched = self._search(previous, small, limit)
+                if searched is not None and (found is None or searched[2] > found[2]):
+                    found = searched
+            if found is None:
+                self.rejected += 1
+                return None
+            x = previous.x / scale + found[0]
+            y = previous.y / scale + found[1]
+            response = found[2]
+            self._step = (found[0], found[1])
+            x, y = self._refine(small, x, y, previous)
+        tile = MosaicTile(
+            len(self.tiles),
+            int(round(x * scale)),
+            int(round(y * scale)),
+            width,
+            height,
+            float(response),
+            small,
+        )
+        self._blend(frame, tile)
+        self.tiles.append(tile)
+        if len(self._recent) == self._recent.maxlen:
+            self._recent[0].small = None
+        self._recent.append(tile)
+        return tile.x, tile.y
+
+    def _refine(
+        self, small: np.ndarray, x: float, y: float, previous: MosaicTile
+    ) -> Tuple[float, float]:
+        """Average the position with registrations against overlapping older frames."""
+        height, width = small.shape
+        scale = self.downsample
+        estimates = [(x, y, 1.0)]
+        for tile in self._recent:
+            if tile is previous:
+                continue
+            predicted = (x - tile.x / scale, y - tile.y / scale)
+            if abs(predicted[0]) > width * 0.7 or abs(predicted[1]) > height * 0.7:
+                continue
+            found = self._register(tile, small, predicted)
+            if found is None or found[2] < self.min_response:
+                continue
+            # Only small corrections: larger ones are mismatches, not drift
+            if math.hypot(found[0] - predicted[0], found[1] - predicted[1]) > 8:
+                continue
+            estimates.append(
+                (tile.x / scale + found[0], tile.y / scale + found[1], found[2])
+            )
+        total = sum(e[2] for e in estimates)
+        return (
+            sum(e[0] * e[2] for e in estimates) / total,
+            sum(e[1] * e[2] for e in estimates) / total,
+        )
+
+    def _feather(self, width: int, height: int, scale: int = 1) -> np.ndarray:
+        key = (width, height, scale)
+        weight = self._weights.get(key)
+        if weight is None:
+            ramp = max(1, self.feather // scale)
+            xs = np.minimum(np.arange(width), np.arange(width)[::-1]) + 1
+            ys = np.minimum(np.arange(height), np.arange(height)[::-1]) + 1
+            edge = np.minimum(ys[:, None], xs[None, :]).astype(np.float32)
+            weight = np.clip(edge * (255.0 / ramp), 1, 255).astype(np.uint8)
+            self._weights[key] = weight
+        return weight
+
+    def _blend(self, frame: np.ndarray, tile: MosaicTile) -> None:
+        height, width = frame.shape[:2]
+        self.canvas.blend(frame, self._feather(width, height), tile.x, tile.y)
+        scale = self.overview_scale
+        size = (max(1, width // scale), max(1, height // scale))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        self.overview_canvas.blend(
+            small,
+            self._feather(size[0], size[1], scale),
+            int(round(tile.x / scale)),
+            int(round(tile.y / scale)),
+        )
+
+    def overview(self, max_width: int = 1024) -> np.ndarray:
+        """
+        Get a low-resolution image of the whole mosaic.
+
+        Parameters:
+            max_width (int): Width limit of the returned image.
+
+        Returns:
+            numpy.ndarray: BGR overview; empty (0x0) before the first frame.
+        """
+        x, y, width, height = self.overview_canvas.bounds()
+        image = self.overview_canvas.read(x, y, width, height)
+        if width > max_width:
+            size = (max_width, max(1, height * max_width // width))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        return image
+
+    def extent(self) -> Tuple[int, int, int, int]:
+        """Get the x, y, width and height of the area covered by frames."""
+        if not self.tiles:
+            return 0, 0, 0, 0
+        x0 = min(t.x for t in self.tiles)
+        y0 = min(t.y for t in self.tiles)
+        x1 = max(t.x + t.width for t in self.tiles)
+        y1 = max(t.y + t.height for t in self.tiles)
+        return x0, y0, x1 - x0, y1 - y0
+
+    def render(self) -> np.ndarray:
+        """Read the full-resolution mosaic into one image; needs width*height*3 bytes."""
+        return self.canvas.read(*self.extent())
+
+    def save(self, path: str) -> bool:
+        """
+        Write the full-resolution mosaic to an image file.
+
+        PNG files are written strip by strip, holding one row of canvas tiles in
+        memory at a time. Other formats go through `render()` and need the whole
+        image in memory.
+        """
+        if os.path.splitext(path)[1].lower() != ".png":
+            return cv2.imwrite(path, self.render())
+        x, y, width, height = self.extent()
+        step = self.canvas.tile_size
+        strips = (
+            self.canvas.read(x, top, width, min(step, y + height - top))
+            for top in range(y, y + height, step)
+        )
+        _write_png(path, width, height, strips)
+        return True
+
+    def save_overview(self, path: str) -> bool:
+        """Write the overview at its full 1/`overview_scale` resolution."""
+        x, y, width, height = self.overview_canvas.bounds()
+        return cv2.imwrite(path, self.overview_canvas.read(x, y, width, height))
+
+    def close(self) -> None:
+        """Flush the canvas and write the frame placements to `mosaic.json`."""
+        self.canvas.close()
+        index = {
+            "microns_per_pixel": self.microns_per_pixel,
+            "tile_size": self.canvas.tile_size,
+            "overview_scale": self.overview_scale,
+            "rejected": self.rejected,
+            "frames": [tile.as_dict() for tile in self.tiles],
+        }
+        with open(os.path.join(self.directory, INDEX_FILE), "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=2)
+
+    @classmethod
+    def load(cls, directory: str, cache_tiles: int = 64) -> "Mosaic":
+        """
+        Reopen a closed mosaic from its tiles and `mosaic.json`, e.g. to `save()`
+        it at full resolution. Frames cannot be added to it; the overview is
+        empty.
+        """
+        with open(os.path.join(directory, INDEX_FILE), encoding="utf-8") as f:
+            index = json.load(f)
+        mosaic = cls(
+            directory,
+            microns_per_pixel=index["microns_per_pixel"],
+            overview_scale=index.get("overview_scale", 16),
+            tile_size=index["tile_size"],
+            cache_tiles=cache_tiles,
+        )
+        mosaic.rejected = index["rejected"]
+        mosaic.tiles = [
+            MosaicTile(
+                frame["index"],
+                frame["x"],
+                frame["y"],
+                frame["width"],
+                frame["height"],
+                frame["response"],
+                None,
+            )
+            for frame in index["frames"]
+        ]
+        for name in os.listdir(mosaic.canvas.directory):
+            match = TILE_FILE.match(name)
+            if match:
+                mosaic.canvas.tiles.add((int(match.group(1)), int(match.group(2))))
+        return mosaic
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    chunk = kind + data
+    return struct.pack(">I", len(data)) + chunk + struct.pack(">I", zlib.crc32(chunk))
+
+
+def _write_png(path: str, width: int, height: int, strips) -> None:
+    """Write BGR uint8 strips, top to bottom, as one RGB PNG without joining them."""
+    compressor = zlib.compressobj(6)
+    previous = np.zeros((1, width * 3), np.uint8)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(
+            _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        )
+        for strip in strips:
+            rows = np.ascontiguousarray(strip[..., ::-1]).reshape(len(strip), -1)
+            # PNG "Up" filter: each row minus the one above, modulo 256
+            filtered = np.empty((len(rows), width * 3 + 1), np.uint8)
+            filtered[:, 0] = 2
+            np.subtract(rows, np.vstack((previous, rows[:-1])), out=filtered[:, 1:])
+            previous = rows[-1:]
+            data = compressor.compress(filtered.tobytes())
+            if data:
+                f.write(_png_chunk(b"IDAT", data))
+        f.write(_png_chunk(b"IDAT", compressor.flush()))
+        f.write(_png_chunk(b"IEND", b""))
@@ -0,0 +1,248 @@
+"""
+Video-property profiles: snapshot, diff and restore in as few DLL calls as possible.
+
+`capture_profile()` reads every video property plus exposure and auto exposure
+state into a `VideoProfile`, which serialises to JSON. `apply_profile()` compares
+the profile with the microscope's cached state, clamps and rounds each value to
+the cached min/max/step of its property, and only writes what actually changed.
+See full parameter table at https://github.com/dino-lite/DNX64-Python-API/wiki/Appendix:-Parameter-Table#video-property-index-of-getsetvideoprocamp
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+# Video property index of GetVideoProcAmp/SetVideoProcAmp
+PROC_AMP_PROPERTIES: Dict[int, str] = {
+    0: "brightness",
+    1: "contrast",
+    2: "hue",
+    3: "saturation",
+    4: "sharpness",
+    5: "gamma",
+    6: "color_enable",
+    7: "white_balance",
+    8: "backlight_compensation",
+    9: "gain",
+}
+
+AE_TARGET_RANGE = (16, 20)
+# Exposure values accepted by SetExposureValue; see the parameter table of your model
+EXPOSURE_RANGE = (1, 30000)
+
+
+def clamp_to_range(value: int, value_range: Tuple[int, int, int, int]) -> int:
+    """
+    Clamp a value to a property's limits and round it to the property's stepping.
+
+    Parameters:
+        value (int): Requested value.
+        value_range (Tuple[int, int, int, int]): min, max, step and default.
+
+    Returns:
+        int: Nearest value the device accepts.
+    """
+    min_val, max_val, step, _ = value_range
+    value = min(max(int(value), min_val), max_val)
+    if step > 1:
+        value = min_val + int(round((value - min_val) / step)) * step
+        if value > max_val:
+            value -= step
+    return value
+
+
+class VideoProfile:
+    """
+    Snapshot of a device's video properties, exposure and LED state.
+
+    Attributes:
+        properties (Dict[int, int]): Video property values by property index.
+        auto_exposure (int): 0 = OFF, 1 = ON, or None if not part of the profile.
+        exposure (int): Exposure value, applied only when auto exposure is OFF.
+        ae_target (int): Auto exposure target (16 to 20).
+        led_state (int): LED state, see SetLEDState.
+        name (str): Free-form label, e.g. the inspection recipe.
+    """
+
+    def __init__(
+        self,
+        properties: Optional[Dict[int, int]] = None,
+        auto_exposure: Optional[int] = None,
+        exposure: Optional[int] = None,
+        ae_target: Optional[int] = None,
+        led_state: Optional[int] = None,
+        name: str = "",
+    ) -> None:
+        self.properties = dict(properties or {})
+        self.auto_exposure = auto_exposure
+        self.exposure = exposure
+        self.ae_target = ae_target
+        self.led_state = led_state
+        self.name = name
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, VideoProfile) and self.settings() == other.settings()
+
+    def __repr__(self) -> str:
+        return f"VideoProfile({self.name!r}, {self.settings()})"
+
+    def settings(self) -> Dict[str, Any]:
+        """
+        Get every setting of the profile under a readable name.
+
+        Returns:
+            Dict[str, Any]: e.g. {"brightness": 0, ..., "exposure": 1000}.
+        """
+        settings: Dict[str, Any] = {
+            PROC_AMP_PROPERTIES.get(index, f"property_{index}"): value
+            for index, value in sorted(self.properties.items())
+        }
+        for key in ("auto_exposure", "exposure", "ae_target", "led_state"):
+            value = getattr(self, key)
+            if value is not None:
+                settings[key] = value
+        return settings
+
+    def diff(self, other: "VideoProfile") -> Dict[str, Tuple[Any, Any]]:
+        """
+        Compare two profiles.
+
+        Parameters:
+            other (VideoProfile): Profile to compare against.
+
+        Returns:
+            Dict[str, Tuple[Any, Any]]: (this value, other value) for each setting
+            that differs; None marks a setting missing from one profile.
+        """
+        mine, theirs = self.settings(), other.settings()
+        return {
+            key: (mine.get(key), theirs.get(key))
+            for key in list(mine) + [k for k in theirs if k not in mine]
+            if mine.get(key) != theirs.get(key)
+        }
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "properties": {
+                str(index): value for index, value in self.properties.items()
+            },
+            "auto_exposure": self.auto_exposure,
+            "exposure": self.exposure,
+            "ae_target": self.ae_target,
+            "led_state": self.led_state,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "VideoProfile":
+        return cls(
+            properties={int(k): v for k, v in data.get("properties", {}).items()},
+            auto_exposure=data.get("auto_exposure"),
+            exposure=data.get("exposure"),
+            ae_target=data.get("ae_target"),
+            led_state=data.get("led_state"),
+            name=data.get("name", ""),
+        )
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), indent=2)
+
+    @classmethod
+    def from_json(cls, text: str) -> "VideoProfile":
+        return cls.from_dict(json.loads(text))
+
+    def save(self, path: str) -> None:
+        """Write the profile to a JSON file."""
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_json())
+
+    @classmethod
+    def load(cls, path: str) -> "VideoProfile":
+        """Read a profile written by `save()`."""
+        with open(path, encoding="utf-8") as f:
+            return cls.from_json(f.read())
+
+
+def capture_profile(microscope, device_index: int, name: str = "") -> VideoProfile:
+    """
+    Read the current video properties and exposure state into a profile.
+    The LED state has no getter, so it is taken from the microscope's cached state.
+
+    Parameters:
+        microscope (DNX64): Microscope to read from.
+        device_index (int): Index of the device.
+        name (str): Label stored with the profile.
+
+    Returns:
+        VideoProfile: Snapshot of the device.
+    """
+    properties = {}
+    for index in PROC_AMP_PROPERTIES:
+        min_val, max_val, _, _ = microscope.proc_amp_range(index)
+        if min_val == max_val == 0:  # property not supported by this device
+            continue
+        properties[index] = microscope.GetVideoProcAmp(index)
+    return VideoProfile(
+        properties=properties,
+        auto_exposure=microscope.GetAutoExposure(device_index),
+        exposure=microscope.GetExposureValue(device_index),
+        ae_target=microscope.GetAETarget(device_index),
+        led_state=microscope.cached_state(device_index).get("led_state"),
+        name=name,
+    )
+
+
+def apply_profile(
+    microscope, profile: VideoProfile, device_index: int
+) -> List[Tuple[str, int]]:
+    """
+    Restore a profile, writing only the settings that differ from the cached state.
+    Values are clamped and rounded to each property's cached min/max/step, exposure
+    and AE target to their fixed ranges; settings whose current value is not cached
+    are written unconditionally. The cached exposure is only trusted if auto
+    exposure was known to be off, as it drifts while auto exposure runs. Video properties apply to the current video device
+    (see `DNX64.video_device_index`), the other settings to `device_index`.
+
+    Parameters:
+        microscope (DNX64): Microscope to configure.
+        profile (VideoProfile): Profile to restore.
+        device_index (int): Index of the device.
+
+    Returns:
+        List[Tuple[str, int]]: (setting, value) pairs that were written.
+    """
+    state = microscope.cached_state(device_index)
+    current = microscope.cached_state(microscope.video_device_index).get("proc_amp", {})
+    writes: List[Tuple[str, int]] = []
+
+    for index, value in sorted(profile.properties.items()):
+        value_range = microscope.proc_amp_range(index)
+        if value_range[0] == value_range[1] == 0:
+            continue
+        value = clamp_to_range(value, value_range)
+        if current.get(index) != value:
+            microscope.SetVideoProcAmp(index, value)
+            writes.append((PROC_AMP_PROPERTIES.get(index, f"property_{index}"), value))
+
+    if profile.auto_exposure is not None:
+        if state.get("auto_exposure") != profile.auto_exposure:
+            microscope.SetAutoExposure(device_index, profile.auto_exposure)
+            writes.append(("auto_exposure", profile.auto_exposure))
+        if profile.auto_exposure == 0 and profile.exposure is not None:
+            exposure = min(
+                max(int(profile.exposure), EXPOSURE_RANGE[0]), EXPOSURE_RANGE[1]
+            )
+            if state.get("auto_exposure") != 0 or state.get("exposure") != exposure:
+                microscope.SetExposureValue(device_index, exposure)
+                writes.append(("exposure", exposure))
+
+    if profile.ae_target is not None:
+        ae_target = min(max(profile.ae_target, AE_TARGET_RANGE[0]), AE_TARGET_RANGE[1])
+        if state.get("ae_target") != ae_target:
+            microscope.SetAETarget(device_index, ae_target)
+            writes.append(("ae_target", ae_target))
+
+    if profile.led_state is not None and state.get("led_state") != profile.led_state:
+        microscope.SetLEDState(device_index, profile.led_state)
+        writes.append(("led_state", profile.led_state))
+
+    return writes
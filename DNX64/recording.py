@@ -0,0 +1,442 @@
+"""
+Record and replay DNX64 sessions.
+
+`Recorder` wraps the public methods of a `DNX64` instance and appends every call
+(method, arguments, return value or error, start and end time) to a compact binary
+log. `replay()` drives the same sequence against another `DNX64`, backed by the
+real DLL or a `SimulatedDLL`, either at the recorded pacing or as fast as possible,
+and returns a `ReplayReport` comparing the recorded and replayed latencies.
+
+Log format: the magic `DNXREC1\\n`, then records starting with a one-byte type.
+A method definition record (`M`) maps a uint16 id to a method name the first
+time the method is seen; a call record (`C`) holds the method id, an error flag,
+start and end times in nanoseconds since the session started, the argument tuple
+and the return value (or the error message).
+"""
+
+import functools
+import inspect
+import struct
+import threading
+import time
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+from . import API_METHODS
+
+MAGIC = b"DNXREC1\n"
+# Marks a method that was not set on the instance before attach()
+_UNSET = object()
+
+# Methods whose calls are recorded: every DLL method taking plain values, i.e.
+# everything except SetEventCallback.
+RECORDED_METHODS = API_METHODS
+
+_METHOD = struct.Struct("<cH")
+_CALL = struct.Struct("<cHBqq")
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+_LEN = struct.Struct("<I")
+
+
+def _encode(value, out: List[bytes]) -> None:
+    """Append the tagged binary encoding of a plain Python value to `out`."""
+    if value is None:
+        out.append(b"N")
+    elif value is True:
+        out.append(b"T")
+    elif value is False:
+        out.append(b"F")
+    elif isinstance(value, int):
+        out.append(b"i" + _INT.pack(value))
+    elif isinstance(value, float):
+        out.append(b"f" + _FLOAT.pack(value))
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        out.append(b"s" + _LEN.pack(len(data)) + data)
+    elif isinstance(value, bytes):
+        out.append(b"b" + _LEN.pack(len(value)) + value)
+    elif isinstance(value, (tuple, list)):
+        out.append((b"t" if isinstance(value, tuple) else b"l") + _LEN.pack(len(value)))
+        for item in value:
+            _encode(item, out)
+    else:
+        _encode(repr(value), out)
+
+
+def _decode(data: bytes, pos: int):
+    """Decode one tagged value at `pos`, returning it and the next position."""
+    tag = data[pos : pos + 1]
+    pos += 1
+    if tag == b"N":
+        return None, pos
+    if tag == b"T":
+        return True, pos
+    if tag == b"F":
+        return False, pos
+    if tag == b"i":
+        return _INT.unpack_from(data, pos)[0], pos + _INT.size
+    if tag == b"f":
+        return _FLOAT.unpack_from(data, pos)[0], pos + _FLOAT.size
+    if tag in (b"s", b"b", b"t", b"l"):
+        (length,) = _LEN.unpack_from(data, pos)
+        pos += _LEN.size
+        if tag == b"s":
+            return data[pos : pos + length].decode("utf-8"), pos + length
+        if tag == b"b":
+            return data[pos : pos + length], pos + length
+        items = []
+        for _ in range(length):
+            item, pos = _decode(data, pos)
+            items.append(item)
+        return (tuple(items) if tag == b"t" else items), pos
+    raise ValueError(f"Corrupt DNX64 session log: unknown tag {tag!r} at {pos - 1}")
+
+
+class CallRecord:
+    """
+    One recorded DNX64 call.
+
+    Attributes:
+        method (str): DNX64 method name.
+        args (tuple): Positional arguments.
+        result: Return value, or the error message if `error` is True.
+        error (bool): True if the call raised.
+        start_ns (int): Start time in nanoseconds since the session started.
+        end_ns (int): End time in nanoseconds since the session started.
+    """
+
+    __slots__ = ("method", "args", "result", "error", "start_ns", "end_ns")
+
+    def __init__(self, method, args, result, error, start_ns, end_ns) -> None:
+        self.method = method
+        self.args = args
+        self.result = result
+        self.error = error
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+
+    @property
+    def duration_ns(self) -> int:
+        return self.end_ns - self.start_ns
+
+    def __repr__(self) -> str:
+        return (
+            f"CallRecord({self.method}{self.args!r} -> {self.result!r}, "
+            f"{self.duration_ns / 1e6:.3f} ms)"
+        )
+
+
+class Recorder:
+    """
+    Log every call made through a `DNX64` instance.
+
+    Example:
+        with Recorder("session.dnxrec") as recorder:
+            recorder.attach(microscope)
+            run_inspection(microscope)
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Open a session log for writing.
+
+        Parameters:
+            path (str): File to write; an existing file is overwritten.
+        """
+        self.path = path
+        self._file: BinaryIO = open(path, "wb")
+        self._file.write(MAGIC)
+        self._method_ids: Dict[str, int] = {}
+        self._origin = time.perf_counter_ns()
+        self._lock = threading.Lock()
+        self._attached = []
+
+    def __enter__(self) -> "Recorder":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def attach(self, microscope) -> None:
+        """
+        Start recording the calls made through a microscope.
+
+        Parameters:
+            microscope (DNX64): Instance whose public methods to wrap.
+        """
+        installed = {}
+        for method in RECORDED_METHODS:
+            func = getattr(microscope, method, None)
+            if func is not None:
+                wrapper = self._wrap(method, func)
+                installed[method] = (microscope.__dict__.get(method, _UNSET), wrapper)
+                setattr(microscope, method, wrapper)
+        self._attached.append((microscope, installed))
+
+    def detach(self) -> None:
+        """
+        Stop recording and restore the methods this recorder replaced.
+        A method wrapped again since, e.g. by a second recorder, is left to that
+        wrapper so it keeps working.
+        """
+        for microscope, installed in self._attached:
+            for method, (previous, wrapper) in installed.items():
+                if microscope.__dict__.get(method) is not wrapper:
+                    continue
+                if previous is _UNSET:
+                    del microscope.__dict__[method]
+                else:
+                    setattr(microscope, method, previous)
+        self._attached = []
+
+    def close(self) -> None:
+        """Detach from all microscopes and close the log."""
+        self.detach()
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def record(
+        self, method: str, args: tuple, result, error: bool, start_ns: int, end_ns: int
+    ) -> None:
+        """
+        Append one call to the log. Times are `time.perf_counter_ns()` values.
+        """
+        out: List[bytes] = []
+        with self._lock:
+            if self._file.closed:
+                return
+            method_id = self._method_ids.get(method)
+            if method_id is None:
+                method_id = self._method_ids[method] = len(self._method_ids)
+                name = method.encode("utf-8")
+                out.append(_METHOD.pack(b"M", method_id) + bytes([len(name)]) + name)
+            out.append(
+                _CALL.pack(
+                    b"C",
+                    method_id,
+                    error,
+                    start_ns - self._origin,
+                    end_ns - self._origin,
+                )
+            )
+            _encode(args, out)
+            _encode(result, out)
+            self._file.write(b"".join(out))
+
+    def _wrap(self, method: str, func):
+        record = self.record
+        clock = time.perf_counter_ns
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def recorded(*args, **kwargs):
+            if kwargs:
+                # Logged positionally, as if called that way, so replay matches
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                args = bound.args
+            start = clock()
+            try:
+                result = func(*args)
+            except Exception as e:
+                record(method, args, str(e), True, start, clock())
+                raise
+            record(method, args, result, False, start, clock())
+            return result
+
+        return recorded
+
+
+def read_log(path: str) -> Iterator[CallRecord]:
+    """
+    Read a session log written by `Recorder`.
+
+    Parameters:
+        path (str): Log file.
+
+    Returns:
+        Iterator[CallRecord]: Calls in the order they were recorded.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a DNX64 session log.")
+    methods: Dict[int, str] = {}
+    pos = len(MAGIC)
+    while pos < len(data):
+        kind = data[pos : pos + 1]
+        if kind == b"M":
+            _, method_id = _METHOD.unpack_from(data, pos)
+            pos += _METHOD.size
+            length = data[pos]
+            methods[method_id] = data[pos + 1 : pos + 1 + length].decode("utf-8")
+            pos += 1 + length
+        elif kind == b"C":
+            _, method_id, error, start_ns, end_ns = _CALL.unpack_from(data, pos)
+            pos += _CALL.size
+            args, pos = _decode(data, pos)
+            result, pos = _decode(data, pos)
+            yield CallRecord(
+                methods[method_id], tuple(args), result, bool(error), start_ns, end_ns
+            )
+        else:
+            raise ValueError(f"Corrupt DNX64 session log: record {kind!r} at {pos}")
+
+
+def _percentile(sorted_values: List[int], fraction: float) -> int:
+    if not sorted_values:
+        return 0
+    return sorted_values[
+        min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    ]
+
+
+class MethodComparison:
+    """Recorded versus replayed latency of one method."""
+
+    def __init__(self, method: str) -> None:
+        self.method = method
+        self.recorded_ns: List[int] = []
+        self.replayed_ns: List[int] = []
+        self.mismatches = 0
+        self.errors = 0
+
+    def summary(self, values: List[int]) -> Dict[str, float]:
+        values = sorted(values)
+        return {
+            "mean_ms": sum(values) / (len(values) or 1) / 1e6,
+            "p50_ms": _percentile(values, 0.5) / 1e6,
+            "p95_ms": _percentile(values, 0.95) / 1e6,
+            "max_ms": (values[-1] if values else 0) / 1e6,
+        }
+
+    @property
+    def change(self) -> float:
+        """Relative change of the median latency, e.g. 0.25 for 25% slower."""
+        recorded = _percentile(sorted(self.recorded_ns), 0.5)
+        replayed = _percentile(sorted(self.replayed_ns), 0.5)
+        if recorded == 0:
+            return 0.0
+        return replayed / recorded - 1.0
+
+    def as_dict(self) -> dict:
+        return {
+            "method": self.method,
+            "calls": len(self.recorded_ns),
+            "recorded": self.summary(self.recorded_ns),
+            "replayed": self.summary(self.replayed_ns),
+            "change": self.change,
+            "mismatches": self.mismatches,
+            "errors": self.errors,
+        }
+
+
+class ReplayReport:
+    """
+    Latency diff between a recorded session and its replay.
+
+    Attributes:
+        methods (Dict[str, MethodComparison]): Comparison per method.
+        recorded_ns (int): Wall time of the recorded session.
+        replayed_ns (int): Wall time of the replay.
+    """
+
+    def __init__(self) -> None:
+        self.methods: Dict[str, MethodComparison] = {}
+        self.recorded_ns = 0
+        self.replayed_ns = 0
+
+    def regressions(self, threshold: float = 0.2) -> List[MethodComparison]:
+        """
+        Get the methods whose median latency grew by more than `threshold`.
+
+        Parameters:
+            threshold (float): Allowed relative slowdown, e.g. 0.2 for 20%.
+
+        Returns:
+            List[MethodComparison]: Regressed methods, worst first.
+        """
+        slower = [m for m in self.methods.values() if m.change > threshold]
+        return sorted(slower, key=lambda m: m.change, reverse=True)
+
+    def as_dict(self) -> dict:
+        return {
+            "recorded_seconds": self.recorded_ns / 1e9,
+            "replayed_seconds": self.replayed_ns / 1e9,
+            "methods": [m.as_dict() for m in self.methods.values()],
+        }
+
+    def format(self) -> str:
+        """
+        Render the report as a text table.
+
+        Returns:
+            str: One line per method with recorded and replayed p50/p95.
+        """
+        lines = [
+            f"{'method':<28}{'calls':>6}{'rec p50':>10}{'rep p50':>10}"
+            f"{'rec p95':>10}{'rep p95':>10}{'change':>9}{'diff':>6}",
+        ]
+        for m in sorted(self.methods.values(), key=lambda m: m.method):
+            recorded, replayed = m.summary(m.recorded_ns), m.summary(m.replayed_ns)
+            lines.append(
+                f"{m.method:<28}{len(m.recorded_ns):>6}"
+                f"{recorded['p50_ms']:>10.3f}{replayed['p50_ms']:>10.3f}"
+                f"{recorded['p95_ms']:>10.3f}{replayed['p95_ms']:>10.3f}"
+                f"{m.change * 100:>8.1f}%{m.mismatches + m.errors:>6}"
+            )
+        lines.append(
+            f"session: recorded {self.recorded_ns / 1e9:.3f} s, "
+            f"replayed {self.replayed_ns / 1e9:.3f} s (latencies in ms)"
+        )
+        return "\n".join(lines)
+
+
+def replay(records, microscope, paced: bool = True, speed: float = 1.0) -> ReplayReport:
+    """
+    Drive a recorded call sequence against a microscope.
+
+    Parameters:
+        records (Iterable[CallRecord] or str): Calls, or the path of a session log.
+        microscope (DNX64): Target, backed by the real DLL or a SimulatedDLL.
+        paced (bool): Keep the recorded gaps between calls; False replays as fast
+            as possible.
+        speed (float): Pacing multiplier, e.g. 2.0 to replay twice as fast.
+
+    Returns:
+        ReplayReport: Recorded versus replayed latency per method.
+    """
+    if isinstance(records, str):
+        records = read_log(records)
+    report = ReplayReport()
+    clock = time.perf_counter_ns
+    origin: Optional[int] = None
+    first_ns = last_ns = 0
+    for record in records:
+        if origin is None:
+            origin, first_ns = clock(), record.start_ns
+        if paced:
+            delay = (record.start_ns - first_ns) / speed - (clock() - origin)
+            if delay > 0:
+                time.sleep(delay / 1e9)
+        comparison = report.methods.get(record.method)
+        if comparison is None:
+            comparison = report.methods[record.method] = MethodComparison(record.method)
+        start = clock()
+        try:
+            result = getattr(microscope, record.method)(*record.args)
+            error = False
+        except Exception as e:
+            result, error = str(e), True
+        comparison.replayed_ns.append(clock() - start)
+        comparison.recorded_ns.append(record.duration_ns)
+        if error and not record.error:
+            comparison.errors += 1
+        elif result != record.result:
+            comparison.mismatches += 1
+        last_ns = record.end_ns
+    if origin is not None:
+        report.recorded_ns = last_ns - first_ns
+        report.replayed_ns = clock() - origin
+    return report
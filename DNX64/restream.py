@@ -0,0 +1,544 @@
+"""
+Local fan-out server for Dino-Lite video streams and controls.
+
+Each source (a WF-10 / WF-20 streamer URL or a USB camera) is pulled exactly once
+into a shared latest-frame buffer, and any number of viewers are served from it:
+
+    GET  /                     index page showing every stream
+    GET  /stream/<name>        multipart MJPEG, usable directly in an <img> tag
+    GET  /snapshot/<name>      latest JPEG
+    GET  /ws/<name>            WebSocket, one binary message per JPEG
+    GET  /stats                per-source and per-client frame counters (JSON)
+    GET  /api                  list of control methods (JSON)
+    GET  /api/<Method>?args=.. call a read-only method, e.g. /api/GetAMR?args=0
+    POST /api/<Method>         call any method with a JSON body {"args": [0, 1]},
+                               e.g. SetLEDState; setters are never run on GET
+
+Streamer frames are forwarded as received, without re-encoding; USB frames are
+JPEG-encoded once per frame no matter how many clients watch. Every client sends
+from the shared buffer at its own pace: a slow client simply skips to the latest
+frame, so it never holds back the source or other clients.
+"""
+
+import base64
+import hashlib
+import json
+import math
+import struct
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from . import API_METHODS
+from .mjpeg import iter_mjpeg
+
+BOUNDARY = "dnx64frame"
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# Methods not exposed over HTTP: GetWiFiImage writes a file on the server
+CONTROL_METHODS = tuple(m for m in API_METHODS if m != "GetWiFiImage")
+# Methods that only read state and may be called with GET. Anything else needs a
+# POST with a JSON body, which a page on another site cannot send without a CORS
+# preflight, so merely opening a link or <img> cannot change the microscope.
+READ_METHODS = tuple(m for m in CONTROL_METHODS if m.startswith("Get") or m == "FOVx")
+# Seconds without a new frame after which clients get a keep-alive write
+KEEPALIVE_TIME = 5.0
+
+
+class FrameBuffer:
+    """
+    Latest JPEG of one source, shared by all of its clients.
+
+    Attributes:
+        seq (int): Number of frames published so far.
+        frame (bytes): Latest JPEG, or None before the first frame.
+        timestamp (float): `time.perf_counter()` when `frame` was published.
+    """
+
+    def __init__(self) -> None:
+        self.seq = 0
+        self.frame: Optional[bytes] = None
+        self.timestamp = 0.0
+        self._cond = threading.Condition()
+
+    def publish(self, frame: bytes) -> None:
+        """Replace the latest frame and wake every waiting client."""
+        with self._cond:
+            self.seq += 1
+            self.frame = frame
+            self.timestamp = time.perf_counter()
+            self._cond.notify_all()
+
+    def wait(self, after_seq: int, timeout: float = 5.0) -> Tuple[int, Optional[bytes]]:
+        """
+        Block until a frame newer than `after_seq` is available.
+
+        Parameters:
+            after_seq (int): Sequence number of the last frame the client sent.
+            timeout (float): Seconds to wait before giving up.
+
+        Returns:
+            Tuple[int, Optional[bytes]]: Latest sequence number and frame; the frame
+            is None on timeout.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.seq > after_seq, timeout):
+                return self.seq, None
+            return self.seq, self.frame
+
+
+class StreamSource:
+    """
+    Background thread pulling one device's frames into a `FrameBuffer`.
+    Subclasses implement `frames()`; the thread reconnects when it ends or fails.
+    """
+
+    retry_delay = 1.0
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.buffer = FrameBuffer()
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def frames(self):
+        raise NotImplementedError
+
+    @property
+    def running(self) -> bool:
+        """True while the pulling thread is alive and not asked to stop."""
+        thread = self._thread
+        return thread is not None and thread.is_alive() and not self._stop.is_set()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name=f"restream-{self.name}", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                for jpeg in self.frames():
+                    self.buffer.publish(jpeg)
+                    if self._stop.is_set():
+                        return
+            except Exception as e:
+                self.errors += 1
+                print(f"restream {self.name}: {e}")
+            self._stop.wait(self.retry_delay)
+
+
+class MjpegSource(StreamSource):
+    """Pull a WF-10 / WF-20 streamer, forwarding its JPEGs untouched."""
+
+    def __init__(self, name: str, url: str) -> None:
+        super().__init__(name)
+        self.url = url
+
+    def frames(self):
+        return iter_mjpeg(self.url)
+
+
+class CameraSource(StreamSource):
+    """
+    Pull a USB camera through OpenCV and JPEG-encode each frame once.
+
+    With `passthrough=True` the camera is asked for its raw MJPEG buffers
+    (CAP_PROP_CONVERT_RGB off, supported by e.g. V4L2), which are then forwarded
+    without decoding or re-encoding.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        cam_index: int,
+        width: int = 1280,
+        height: int = 960,
+        fps: int = 30,
+        quality: int = 85,
+        passthrough: bool = False,
+    ) -> None:
+        super().__init__(name)
+        self.cam_index = cam_index
+        self.width, self.height, self.fps = width, height, fps
+        self.quality = quality
+        self.passthrough = passthrough
+
+    def open(self):
+        from .sources import UsbFrameSource
+
+        return UsbFrameSource(
+            self.cam_index,
+            self.width,
+            self.height,
+            self.fps,
+            convert_rgb=not self.passthrough,
+        )
+
+    def frames(self):
+        import cv2
+
+        camera = self.open()
+        if not camera.isOpened():
+            raise IOError(f"cannot open camera {self.cam_index}")
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        try:
+            while not self._stop.is_set():
+                ret, frame = camera.read()
+                if not ret:
+                    return
+                if self.passthrough and (frame.ndim == 1 or frame.shape[0] == 1):
+                    data = frame.tobytes()
+                    if data[:2] == b"\xff\xd8":
+                        yield data
+                        continue
+                    frame = cv2.imdecode(frame, cv2.IMREAD_COLOR)
+                ok, jpeg = cv2.imencode(".jpg", frame, params)
+                if ok:
+                    yield jpeg.tobytes()
+        finally:
+            camera.release()
+
+
+class ClientStats:
+    """Frames sent to and skipped for one connected viewer."""
+
+    def __init__(self, source: str, kind: str, address: str) -> None:
+        self.source = source
+        self.kind = kind
+        self.address = address
+        self.sent = 0
+        self.dropped = 0
+        self.connected = time.time()
+
+    def as_dict(self) -> dict:
+        return {
+            "source": self.source,
+            "kind": self.kind,
+            "address": self.address,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "seconds": round(time.time() - self.connected, 1),
+        }
+
+
+class RestreamServer(ThreadingHTTPServer):
+    """
+    HTTP server fanning out every added source to many clients.
+
+    Example:
+        server = RestreamServer(("0.0.0.0", 8000), microscope=micro_scope)
+        server.add_source(MjpegSource("wifi", "http://10.10.10.254:8080/?action=stream"))
+        server.add_source(CameraSource("usb", cam_index=0))
+        server.serve_forever()
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], microscope=None) -> None:
+        """
+        Initialize the server.
+
+        Parameters:
+            address (Tuple[str, int]): Host and port to listen on.
+            microscope (DNX64): Microscope exposed under /api, or None to disable.
+        """
+        super().__init__(address, RestreamHandler)
+        self.microscope = microscope
+        self.sources: Dict[str, StreamSource] = {}
+        self.clients: List[ClientStats] = []
+        self.control_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+
+    def add_source(self, source: StreamSource) -> None:
+        """Register a source and start pulling it."""
+        self.sources[source.name] = source
+        source.start()
+
+    def server_close(self) -> None:
+        for source in self.sources.values():
+            source.stop()
+        super().server_close()
+
+    def call(self, method: str, args: list):
+        """
+        Call a DNX64 control method, one call at a time.
+
+        Parameters:
+            method (str): Name from CONTROL_METHODS.
+            args (list): Positional arguments.
+
+        Returns:
+            The method's return value.
+        """
+        if self.microscope is None:
+            raise LookupError("no microscope attached")
+        if method not in CONTROL_METHODS:
+            raise LookupError(f"unknown method {method}")
+        with self.control_lock:
+            return getattr(self.microscope, method)(*args)
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            clients = [c.as_dict() for c in self.clients]
+        return {
+            "sources": {
+                name: {"frames": s.buffer.seq, "errors": s.errors}
+                for name, s in self.sources.items()
+            },
+            "clients": clients,
+        }
+
+
+def _jsonable(value):
+    """Make a DLL result JSON-safe: bytes become text, inf and nan become None."""
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _jsonable(item) for key, item in value.items()}
+    return value
+
+
+def _parse_arg(text: str):
+    """Convert a query-string argument to int, float or bool where possible."""
+    if text.lower() in ("true", "false"):
+        return text.lower() == "true"
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+
+class RestreamHandler(BaseHTTPRequestHandler):
+    server: RestreamServer
+    protocol_version = "HTTP/1.1"
+    # Socket timeout, so a client that stops reading is eventually dropped
+    timeout = 30
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        if not parts:
+            return self._index()
+        if parts[0] == "stats":
+            return self._json(200, self.server.stats())
+        if parts[0] == "api":
+            if len(parts) == 1:
+                return self._json(200, {"methods": list(CONTROL_METHODS)})
+            if parts[1] in CONTROL_METHODS and parts[1] not in READ_METHODS:
+                return self._json(
+                    405, {"error": f"{parts[1]} changes settings; use POST"}
+                )
+            query = urllib.parse.parse_qs(url.query).get("args", [""])[0]
+            args = [_parse_arg(a) for a in query.split(",") if a != ""]
+            return self._control(parts[1], args)
+        if len(parts) == 2 and parts[1] in self.server.sources:
+            source = self.server.sources[parts[1]]
+            if parts[0] == "stream":
+                return self._stream(source)
+            if parts[0] == "snapshot":
+                return self._snapshot(source)
+            if parts[0] == "ws":
+                return self._websocket(source)
+        self._json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        parts = [p for p in urllib.parse.urlsplit(self.path).path.split("/") if p]
+        if len(parts) != 2 or parts[0] != "api":
+            return self._json(404, {"error": "not found"})
+        if self.headers.get_content_type() != "application/json":
+            return self._json(415, {"error": "expected an application/json body"})
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._json(400, {"error": "invalid JSON body"})
+        self._control(parts[1], list(body.get("args", [])))
+
+    def _control(self, method: str, args: list) -> None:
+        try:
+            result = self.server.call(method, args)
+            body = json.dumps(
+                {"method": method, "args": args, "result": _jsonable(result)},
+                allow_nan=False,
+                default=repr,
+            ).encode("utf-8")
+        except LookupError as e:
+            return self._json(404, {"error": str(e)})
+        except Exception as e:
+            return self._json(500, {"error": str(e)})
+        self._send_json(200, body)
+
+    def _json(self, status: int, data) -> None:
+        self._send_json(status, json.dumps(data).encode("utf-8"))
+
+    def _send_json(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _index(self) -> None:
+        images = "".join(
+            f'<figure><img src="/stream/{name}" style="max-width:100%">'
+            f"<figcaption>{name}</figcaption></figure>"
+            for name in self.server.sources
+        )
+        body = (
+            "<!doctype html><html><head><title>DNX64 restream</title></head>"
+            f"<body>{images}</body></html>"
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _snapshot(self, source: StreamSource) -> None:
+        seq, frame = source.buffer.wait(0)
+        if frame is None:
+            return self._json(503, {"error": "no frame yet"})
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(frame)))
+        self.end_headers()
+        self.wfile.write(frame)
+
+    def _serve_frames(self, source: StreamSource, kind: str, send, keepalive) -> None:
+        """
+        Send frames as they arrive. Without frames for KEEPALIVE_TIME, a keep-alive
+        write finds clients that went away, and the loop ends once the source
+        has stopped.
+        """
+        client = ClientStats(source.name, kind, self.client_address[0])
+        with self.server.stats_lock:
+            self.server.clients.append(client)
+        last = max(0, source.buffer.seq - 1)
+        try:
+            while True:
+                seq, frame = source.buffer.wait(last, KEEPALIVE_TIME)
+                if frame is None:
+                    if not source.running:
+                        return
+                    keepalive()
+                    continue
+                if seq > last + 1:
+                    client.dropped += seq - last - 1
+                last = seq
+                send(frame)
+                client.sent += 1
+        except (ConnectionError, TimeoutError, OSError):
+            pass
+        finally:
+            with self.server.stats_lock:
+                self.server.clients.remove(client)
+            self.close_connection = True
+
+    def _stream(self, source: StreamSource) -> None:
+        self.send_response(200)
+        self.send_header(
+            "Content-Type", f"multipart/x-mixed-replace; boundary={BOUNDARY}"
+        )
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def send(frame: bytes) -> None:
+            self.wfile.write(
+                f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                f"Content-Length: {len(frame)}\r\n\r\n".encode("ascii")
+                + frame
+                + b"\r\n"
+            )
+
+        def keepalive() -> None:
+            # Repeating the latest frame is harmless to viewers
+            if source.buffer.frame is not None:
+                send(source.buffer.frame)
+            else:
+                self.wfile.write(b"\r\n")
+            self.wfile.flush()
+
+        self._serve_frames(source, "mjpeg", send, keepalive)
+
+    def _websocket(self, source: StreamSource) -> None:
+        key = self.headers.get("Sec-WebSocket-Key")
+        if key is None or self.headers.get("Upgrade", "").lower() != "websocket":
+            return self._json(400, {"error": "expected a WebSocket upgrade"})
+        accept = base64.b64encode(
+            hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()
+        ).decode("ascii")
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+
+        def send(frame: bytes) -> None:
+            length = len(frame)
+            if length < 126:
+                header = struct.pack("!BB", 0x82, length)
+            elif length < 1 << 16:
+                header = struct.pack("!BBH", 0x82, 126, length)
+            else:
+                header = struct.pack("!BBQ", 0x82, 127, length)
+            self.wfile.write(header + frame)
+
+        def keepalive() -> None:
+            self.wfile.write(b"\x89\x00")  # empty ping
+
+        self._serve_frames(source, "websocket", send, keepalive)
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    wifi_urls: Optional[Dict[str, str]] = None,
+    cameras: Optional[Dict[str, int]] = None,
+    microscope=None,
+) -> None:
+    """
+    Run a restreaming server until interrupted.
+
+    Parameters:
+        host (str): Interface to listen on.
+        port (int): Port to listen on.
+        wifi_urls (Dict[str, str]): Streamer MJPEG URLs by source name.
+        cameras (Dict[str, int]): OpenCV camera indices by source name.
+        microscope (DNX64): Microscope exposed under /api.
+    """
+    server = RestreamServer((host, port), microscope=microscope)
+    for name, url in (wifi_urls or {}).items():
+        server.add_source(MjpegSource(name, url))
+    for name, cam_index in (cameras or {}).items():
+        server.add_source(CameraSource(name, cam_index))
+    print(
+        f"Serving {', '.join(server.sources) or 'no sources'} on http://{host}:{port}/"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
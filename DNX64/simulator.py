@@ -0,0 +1,265 @@
+"""
+In-process stand-in for DNX64.dll.
+
+`SimulatedDLL` exposes the same functions as the real library, honours ctypes
+out-parameters and keeps per-device state, so `DNX64` can be driven without a
+microscope attached, e.g. to replay recorded sessions or run benchmarks:
+
+    microscope = DNX64("", dll=SimulatedDLL(config=0xD3, latency=0.002))
+"""
+
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+# (min, max, step, default) per video property index, as a typical Dino-Lite reports
+DEFAULT_PROC_AMP_RANGES: Dict[int, Tuple[int, int, int, int]] = {
+    0: (-64, 64, 1, 0),  # Brightness
+    1: (0, 95, 1, 0),  # Contrast
+    2: (-2000, 2000, 1, 0),  # Hue
+    3: (0, 100, 1, 64),  # Saturation
+    4: (0, 7, 1, 6),  # Sharpness
+    5: (100, 300, 1, 100),  # Gamma
+    6: (0, 1, 1, 1),  # ColorEnable
+    7: (2800, 6500, 10, 4600),  # WhiteBalance
+    8: (0, 2, 1, 1),  # BacklightCompensation
+    9: (0, 100, 1, 0),  # Gain
+}
+
+WIFI_RESOLUTIONS = ((640, 480), (1280, 960), (1280, 1024), (1600, 1200), (2592, 1944))
+
+
+def _value(arg):
+    """Unwrap a ctypes scalar, pointer or byref() argument to its Python value."""
+    arg = getattr(arg, "_obj", arg)
+    if hasattr(arg, "contents"):
+        arg = arg.contents
+    return getattr(arg, "value", arg)
+
+
+def _store(arg, value) -> None:
+    """Write an out-parameter passed as a ctypes scalar, pointer or byref()."""
+    arg = getattr(arg, "_obj", arg)
+    if hasattr(arg, "contents"):
+        arg = arg.contents
+    arg.value = value
+
+
+class SimulatedFunction:
+    """A callable that accepts the `argtypes`/`restype` assignments of `setup()`."""
+
+    def __init__(self, name: str, impl: Callable, latency: float) -> None:
+        self.__name__ = name
+        self.impl = impl
+        self.latency = latency
+        self.argtypes = None
+        self.restype = None
+
+    def __call__(self, *args):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.impl(*args)
+
+
+class SimulatedDevice:
+    """State of one simulated microscope."""
+
+    def __init__(self, index: int, config: int, amr: float) -> None:
+        self.index = index
+        self.config = config
+        self.amr = amr
+        self.device_id = f"SIM{index:05d}"
+        self.name = f"Dino-Lite Simulated {index}"
+        self.auto_exposure = 1
+        self.ae_target = 18
+        self.exposure = 2000
+        self.led_state = 1
+        self.flc_switch = 15
+        self.flc_level = 6
+        self.eflc = {1: 31, 2: 31, 3: 31, 4: 31}
+        self.apl_level = 0
+        self.axi_level = 0
+        self.lens_pos = 0
+        self.lens_fine_pos = 0
+
+
+class SimulatedDLL:
+    """
+    Simulated DNX64.dll.
+
+    Attributes:
+        devices (List[SimulatedDevice]): Per-device state, readable by tests.
+        latency (float): Seconds every call sleeps, to mimic USB round trips.
+    """
+
+    def __init__(
+        self,
+        config: int = 0xD3,
+        device_count: int = 1,
+        amr: float = 50.0,
+        latency: float = 0.0,
+        latencies: Optional[Dict[str, float]] = None,
+    ) -> None:
+        """
+        Initialize the simulated library.
+
+        Parameters:
+            config (int): GetConfig value reported by every device.
+            device_count (int): Number of devices reported.
+            amr (float): Magnification reported by GetAMR.
+            latency (float): Default per-call delay in seconds.
+            latencies (Dict[str, float]): Per-function delays overriding `latency`.
+        """
+        self.devices = [SimulatedDevice(i, config, amr) for i in range(device_count)]
+        self.latency = latency
+        self.video_device_index = 0
+        self.proc_amp_ranges = dict(DEFAULT_PROC_AMP_RANGES)
+        self.proc_amp = {i: r[3] for i, r in self.proc_amp_ranges.items()}
+        self.wifi_resolution = WIFI_RESOLUTIONS[1]
+        self.microtouch = False
+        self.callback = None
+        latencies = latencies or {}
+        for name in dir(self):
+            if name.startswith("_impl_"):
+                method_name = name[len("_impl_") :]
+                setattr(
+                    self,
+                    method_name,
+                    SimulatedFunction(
+                        method_name,
+                        getattr(self, name),
+                        latencies.get(method_name, latency),
+                    ),
+                )
+
+    def press(self) -> None:
+        """Simulate a MicroTouch button press."""
+        if self.microtouch and self.callback is not None:
+            self.callback()
+
+    def _device(self, index) -> SimulatedDevice:
+        index = _value(index)
+        if index == 90:  # WF-10 / WF-20 streamer
+            index = 0
+        return self.devices[index]
+
+    def _impl_Init(self) -> bool:
+        return True
+
+    def _impl_EnableMicroTouch(self, flag) -> bool:
+        self.microtouch = bool(_value(flag))
+        return True
+
+    def _impl_FOVx(self, index, mag) -> float:
+        mag = _value(mag)
+        if mag <= 0:
+            return float("inf")
+        return 390000.0 / mag
+
+    def _impl_GetAETarget(self, index) -> int:
+        return self._device(index).ae_target
+
+    def _impl_GetAMR(self, index) -> float:
+        return self._device(index).amr
+
+    def _impl_GetAutoExposure(self, index) -> int:
+        return self._device(index).auto_exposure
+
+    def _impl_GetConfig(self, index) -> int:
+        return self._device(index).config
+
+    def _impl_GetDeviceId(self, index) -> str:
+        return self._device(index).device_id
+
+    def _impl_GetDeviceIDA(self, index) -> bytes:
+        return self._device(index).device_id.encode()
+
+    def _impl_GetExposureValue(self, index) -> int:
+        return self._device(index).exposure
+
+    def _impl_GetLensFinePosLimits(self, index, upper, lower) -> int:
+        _store(upper, 1023)
+        _store(lower, 0)
+        return 0
+
+    def _impl_GetLensPosLimits(self, index, upper, lower) -> int:
+        _store(upper, 950)
+        _store(lower, 0)
+        return 0
+
+    def _impl_GetVideoDeviceCount(self) -> int:
+        return len(self.devices)
+
+    def _impl_GetVideoDeviceIndex(self) -> int:
+        return self.video_device_index
+
+    def _impl_GetVideoDeviceName(self, index) -> str:
+        return self._device(index).name
+
+    def _impl_GetVideoProcAmp(self, prop) -> int:
+        return self.proc_amp.get(_value(prop), 0)
+
+    def _impl_GetVideoProcAmpValueRange(self, prop, min_val, max_val, step, default):
+        values = self.proc_amp_ranges.get(_value(prop), (0, 0, 0, 0))
+        for arg, value in zip((min_val, max_val, step, default), values):
+            _store(arg, value)
+        return 0
+
+    def _impl_GetWiFiImage(self, filename) -> bool:
+        with open(bytes(filename).decode("utf-8"), "wb") as f:
+            f.write(b"\xff\xd8\xff\xd9")
+        return True
+
+    def _impl_GetWiFiVideoCaps(self, count, widths, heights) -> bool:
+        _store(count, len(WIFI_RESOLUTIONS))
+        for i, (width, height) in enumerate(WIFI_RESOLUTIONS):
+            widths[i], heights[i] = width, height
+        return True
+
+    def _impl_SetAETarget(self, index, value) -> None:
+        self._device(index).ae_target = _value(value)
+
+    def _impl_SetAutoExposure(self, index, value) -> None:
+        self._device(index).auto_exposure = _value(value)
+
+    def _impl_SetAimpointLevel(self, index, value) -> None:
+        self._device(index).apl_level = _value(value)
+
+    def _impl_SetAXILevel(self, index, value) -> None:
+        self._device(index).axi_level = _value(value)
+
+    def _impl_SetExposureValue(self, index, value) -> None:
+        self._device(index).exposure = _value(value)
+
+    def _impl_SetEFLC(self, index, quadrant, value) -> None:
+        self._device(index).eflc[_value(quadrant)] = _value(value)
+
+    def _impl_SetFLCSwitch(self, index, value) -> None:
+        self._device(index).flc_switch = _value(value)
+
+    def _impl_SetFLCLevel(self, index, value) -> None:
+        self._device(index).flc_level = _value(value)
+
+    def _impl_SetLEDState(self, index, value) -> None:
+        self._device(index).led_state = _value(value)
+
+    def _impl_SetLensInitPos(self, index) -> None:
+        self._device(index).lens_pos = 0
+
+    def _impl_SetLensFinePos(self, index, value) -> None:
+        self._device(index).lens_fine_pos = _value(value)
+
+    def _impl_SetLensPos(self, index, value) -> None:
+        self._device(index).lens_pos = _value(value)
+
+    def _impl_SetVideoDeviceIndex(self, index) -> None:
+        self.video_device_index = _value(index)
+
+    def _impl_SetVideoProcAmp(self, prop, value) -> None:
+        self.proc_amp[_value(prop)] = _value(value)
+
+    def _impl_SetWiFiVideoRes(self, width, height) -> bool:
+        self.wifi_resolution = (_value(width), _value(height))
+        return True
+
+    def _impl_SetEventCallback(self, callback) -> None:
+        self.callback = callback
@@ -0,0 +1,474 @@
+"""
+Frame sources with a common, `cv2.VideoCapture`-like interface.
+
+Every source offers `isOpened()`, `read() -> (ret, frame)` and `release()`, so the
+streamer loops work unchanged with any of them:
+
+    UsbFrameSource        USB camera through V4L2 (Linux), DirectShow (Windows) or
+                          AVFoundation (macOS), with a one-frame driver queue
+    MjpegFrameSource      WF-10 / WF-20 streamer, decoding only the newest frame
+    FileFrameSource       video file, single image or directory of images
+    SyntheticFrameSource  generated test pattern, for benchmarks and tests
+
+`find_camera_index()` maps a DNX64 device index to the matching OpenCV camera
+index by name, so CAM_INDEX no longer has to be set by hand.
+"""
+
+import glob
+import os
+import sys
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from .mjpeg import iter_mjpeg
+
+# Resolutions tried, in order, when the requested one is not accepted
+FALLBACK_RESOLUTIONS = ((1280, 960), (1280, 1024), (1280, 720), (640, 480))
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+
+def default_backend() -> int:
+    """Get the OpenCV capture backend with the lowest latency on this platform."""
+    if sys.platform == "win32":
+        return cv2.CAP_DSHOW
+    if sys.platform.startswith("linux"):
+        return cv2.CAP_V4L2
+    if sys.platform == "darwin":
+        return cv2.CAP_AVFOUNDATION
+    return cv2.CAP_ANY
+
+
+def list_cameras() -> List[Tuple[int, str]]:
+    """
+    List the cameras OpenCV can open, with their names.
+
+    Linux reads /sys/class/video4linux. Windows uses DirectShow through the optional
+    `pygrabber` package; without it, and on other platforms, the list is empty.
+
+    Returns:
+        List[Tuple[int, str]]: (OpenCV camera index, device name) pairs.
+    """
+    cameras = []
+    if sys.platform.startswith("linux"):
+        for path in sorted(glob.glob("/sys/class/video4linux/video*")):
+            try:
+                with open(os.path.join(path, "name")) as f:
+                    name = f.read().strip()
+                # Each camera also exposes metadata nodes; only node 0 captures video
+                with open(os.path.join(path, "index")) as f:
+                    if f.read().strip() != "0":
+                        continue
+            except OSError:
+                continue
+            cameras.append((int(os.path.basename(path)[len("video") :]), name))
+    elif sys.platform == "win32":
+        try:
+            from pygrabber.dshow_graph import FilterGraph
+        except ImportError:
+            return []
+        cameras = list(enumerate(FilterGraph().get_input_devices()))
+    return sorted(cameras)
+
+
+def find_camera_index(microscope, device_index: int) -> Optional[int]:
+    """
+    Find the OpenCV camera index of a DNX64 video device.
+
+    Matches the DNX64 device name against `list_cameras()`. When several cameras
+    share the name, the n-th of them is used for the n-th DNX64 device with that name.
+
+    Parameters:
+        microscope (DNX64): Microscope used to look up the device name.
+        device_index (int): DNX64 index of the device.
+
+    Returns:
+        Optional[int]: Camera index, or None if no camera matches.
+    """
+    cameras = list_cameras()
+    if not cameras:
+        return None
+    name = microscope.GetVideoDeviceName(device_index)
+    same_name = [
+        i for i in range(device_index) if microscope.GetVideoDeviceName(i) == name
+    ]
+    matches = [index for index, camera in cameras if camera == name]
+    if not matches:
+        matches = [index for index, camera in cameras if "dino" in camera.lower()]
+        same_name = list(range(device_index))
+    if len(same_name) < len(matches):
+        return matches[len(same_name)]
+    return None
+
+
+class FrameSource:
+    """
+    Base class of all frame sources.
+
+    Attributes:
+        width (int): Frame width delivered by `read()`, 0 if unknown.
+        height (int): Frame height delivered by `read()`, 0 if unknown.
+        fps (float): Nominal frame rate, 0 if unknown.
+        timestamp (float): `time.perf_counter()` when the frame last returned by
+            `read()` reached the source; see `DNX64.timing`.
+    """
+
+    def __init__(self) -> None:
+        self.width = 0
+        self.height = 0
+        self.fps = 0.0
+        self.timestamp = 0.0
+
+    def __enter__(self) -> "FrameSource":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+    def isOpened(self) -> bool:
+        raise NotImplementedError
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        raise NotImplementedError
+
+    def release(self) -> None:
+        pass
+
+
+class UsbFrameSource(FrameSource):
+    """
+    USB camera with a minimal driver buffer and negotiated MJPG format.
+
+    With `latest_only=True` a background thread keeps grabbing so `read()` always
+    returns the newest frame, even when the caller is slower than the camera.
+    """
+
+    def __init__(
+        self,
+        cam_index: int,
+        width: int = 1280,
+        height: int = 960,
+        fps: float = 30,
+        fourcc: str = "MJPG",
+        buffer_size: int = 1,
+        backend: Optional[int] = None,
+        latest_only: bool = False,
+        convert_rgb: bool = True,
+        resolutions: Sequence[Tuple[int, int]] = FALLBACK_RESOLUTIONS,
+    ) -> None:
+        """
+        Open and configure a camera.
+
+        Parameters:
+            cam_index (int): OpenCV camera index, see `find_camera_index()`.
+            width (int): Requested frame width.
+            height (int): Requested frame height.
+            fps (float): Requested frame rate.
+            fourcc (str): Requested pixel format.
+            buffer_size (int): Frames queued by the driver; 1 keeps latency lowest.
+            backend (int): OpenCV backend, `default_backend()` if omitted.
+            latest_only (bool): Grab on a background thread and drop stale frames.
+            convert_rgb (bool): False to receive the camera's raw (e.g. MJPEG) buffers.
+            resolutions (Sequence[Tuple[int, int]]): Fallbacks if the requested
+                resolution is not accepted.
+        """
+        super().__init__()
+        self.cam_index = cam_index
+        self.camera = cv2.VideoCapture(
+            cam_index, default_backend() if backend is None else backend
+        )
+        self._frame: Optional[np.ndarray] = None
+        self._arrived = 0.0
+        self._seq = 0
+        self._read_seq = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        if not self.camera.isOpened():
+            return
+        self.camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter.fourcc(*fourcc))
+        self.camera.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+        self.camera.set(cv2.CAP_PROP_FPS, fps)
+        if not convert_rgb:
+            self.camera.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        for candidate in [(width, height)] + [
+            r for r in resolutions if r != (width, height)
+        ]:
+            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, candidate[0])
+            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, candidate[1])
+            if self._negotiated() == candidate:
+                break
+        else:
+            # Nothing matched exactly: let the driver pick the nearest to the request
+            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.width, self.height = self._negotiated()
+        self.fps = self.camera.get(cv2.CAP_PROP_FPS) or float(fps)
+        if latest_only:
+            self._thread = threading.Thread(
+                target=self._grab, name=f"camera-{cam_index}", daemon=True
+            )
+            self._thread.start()
+
+    def _negotiated(self) -> Tuple[int, int]:
+        return (
+            int(self.camera.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(self.camera.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        )
+
+    def _grab(self) -> None:
+        while self._thread is not None:
+            ret, frame = self.camera.read()
+            with self._cond:
+                if not ret:
+                    self._thread = None
+                else:
+                    self._frame = frame
+                    self._arrived = time.perf_counter()
+                    self._seq += 1
+                self._cond.notify_all()
+
+    def isOpened(self) -> bool:
+        return self.camera.isOpened()
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        if self._thread is None and self._seq == 0:
+            ret, frame = self.camera.read()
+            self.timestamp = time.perf_counter()
+            return ret, frame
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._seq > self._read_seq or self._thread is None, 1.0
+            )
+            if self._seq == self._read_seq:
+                return False, None
+            self._read_seq = self._seq
+            self.timestamp = self._arrived
+            return True, self._frame
+
+    def release(self) -> None:
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=1.0)
+        self.camera.release()
+
+
+class MjpegFrameSource(FrameSource):
+    """
+    WF-10 / WF-20 streamer read on a background thread.
+
+    Only the newest JPEG is kept and it is decoded when `read()` is called, so
+    frames the caller has no time for are dropped before decoding.
+    """
+
+    def __init__(self, url: str, timeout: float = 5.0) -> None:
+        """
+        Connect to a streamer.
+
+        Parameters:
+            url (str): MJPEG stream URL, e.g. "http://10.10.10.254:8080/?action=stream".
+            timeout (float): Seconds to wait for the connection and each frame.
+        """
+        super().__init__()
+        self.url = url
+        self.timeout = timeout
+        self._jpeg: Optional[bytes] = None
+        self._arrived = 0.0
+        self._seq = 0
+        self._read_seq = 0
+        self._running = True
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._pull, name="mjpeg", daemon=True)
+        self._thread.start()
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > 0 or not self._running, timeout)
+
+    def _pull(self) -> None:
+        try:
+            for jpeg in iter_mjpeg(self.url, self.timeout):
+                with self._cond:
+                    self._jpeg = jpeg
+                    self._arrived = time.perf_counter()
+                    self._seq += 1
+                    self._cond.notify_all()
+                if not self._running:
+                    break
+        except OSError as e:
+            print(f"Error reading {self.url}: {e}")
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def isOpened(self) -> bool:
+        return self._running or self._seq > self._read_seq
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._seq > self._read_seq or not self._running, self.timeout
+            )
+            if self._seq == self._read_seq:
+                return False, None
+            self._read_seq, jpeg = self._seq, self._jpeg
+            self.timestamp = self._arrived
+        frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            return False, None
+        self.height, self.width = frame.shape[:2]
+        return True, frame
+
+    def release(self) -> None:
+        self._running = False
+
+
+class FileFrameSource(FrameSource):
+    """Frames from a video file, a single image or a directory of images."""
+
+    def __init__(self, path: str, loop: bool = False) -> None:
+        """
+        Open a file source.
+
+        Parameters:
+            path (str): Video file, image file or directory of images.
+            loop (bool): Start over at the end instead of returning no frame.
+        """
+        super().__init__()
+        self.path = path
+        self.loop = loop
+        self.video = None
+        self.images: List[str] = []
+        self._position = 0
+        if os.path.isdir(path):
+            self.images = sorted(
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        elif path.lower().endswith(IMAGE_EXTENSIONS):
+            self.images = [path]
+        else:
+            self.video = cv2.VideoCapture(path)
+            self.width = int(self.video.get(cv2.CAP_PROP_FRAME_WIDTH))
+            self.height = int(self.video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            self.fps = self.video.get(cv2.CAP_PROP_FPS)
+
+    def isOpened(self) -> bool:
+        if self.video is not None:
+            return self.video.isOpened()
+        return bool(self.images)
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        if self.video is not None:
+            ret, frame = self.video.read()
+            if not ret and self.loop:
+                self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ret, frame = self.video.read()
+            self.timestamp = time.perf_counter()
+            return ret, frame
+        if self._position >= len(self.images):
+            if not self.loop or not self.images:
+                return False, None
+            self._position = 0
+        frame = cv2.imread(self.images[self._position])
+        self._position += 1
+        self.timestamp = time.perf_counter()
+        if frame is None:
+            return False, None
+        self.height, self.width = frame.shape[:2]
+        return True, frame
+
+    def release(self) -> None:
+        if self.video is not None:
+            self.video.release()
+
+
+class SyntheticFrameSource(FrameSource):
+    """
+    Generated frames: a static gradient with a moving bright square.
+
+    With `realtime=True`, `read()` is paced to `fps` like a real camera; otherwise
+    frames are returned as fast as they can be produced.
+    """
+
+    def __init__(
+        self,
+        width: int = 1280,
+        height: int = 960,
+        fps: float = 30,
+        realtime: bool = False,
+        frames: Optional[int] = None,
+    ) -> None:
+        """
+        Create a synthetic source.
+
+        Parameters:
+            width (int): Frame width.
+            height (int): Frame height.
+            fps (float): Frame rate used for pacing and reported in `fps`.
+            realtime (bool): Pace `read()` to `fps`.
+            frames (int): Number of frames before `read()` fails, None for endless.
+        """
+        super().__init__()
+        self.width, self.height, self.fps = width, height, float(fps)
+        self.realtime = realtime
+        self.frames = frames
+        self.count = 0
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        self._base = np.empty((height, width, 3), np.uint8)
+        self._base[..., 0] = x
+        self._base[..., 1] = y
+        self._base[..., 2] = (x + y) / 2
+        self._size = max(8, min(width, height) // 8)
+        self._next = time.perf_counter()
+
+    def isOpened(self) -> bool:
+        return self.frames is None or self.count < self.frames
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        if not self.isOpened():
+            return False, None
+        if self.realtime:
+            delay = self._next - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._next = max(self._next, time.perf_counter() - 1.0 / self.fps)
+            self._next += 1.0 / self.fps
+        frame = self._base.copy()
+        size = self._size
+        x = (self.count * 7) % (self.width - size)
+        y = (self.count * 5) % (self.height - size)
+        frame[y : y + size, x : x + size] = 255
+        self.count += 1
+        self.timestamp = time.perf_counter()
+        return True, frame
+
+
+def open_source(spec, microscope=None, device_index: int = 0, **kwargs) -> FrameSource:
+    """
+    Open a frame source from a short description.
+
+    Parameters:
+        spec: Camera index (int), None to find the camera of `device_index` through
+            `microscope`, an http(s) MJPEG URL, "synthetic", or a file/directory path.
+        microscope (DNX64): Used to match `device_index` when `spec` is None.
+        device_index (int): DNX64 device index to match.
+        **kwargs: Passed to the source class.
+
+    Returns:
+        FrameSource: The opened source; check `isOpened()`.
+    """
+    if spec is None:
+        spec = find_camera_index(microscope, device_index) if microscope else None
+        if spec is None:
+            spec = 0
+            print("No matching camera found by name, using camera index 0.")
+    if isinstance(spec, int) or (isinstance(spec, str) and spec.isdigit()):
+        return UsbFrameSource(int(spec), **kwargs)
+    if spec.startswith(("http://", "https://")):
+        return MjpegFrameSource(spec, **kwargs)
+    if spec == "synthetic":
+        return SyntheticFrameSource(**kwargs)
+    return FileFrameSource(spec, **kwargs)
@@ -0,0 +1,228 @@
+"""
+Per-frame stage timing for the capture, display and record loop.
+
+Each frame gets a `FrameTiming` from `PipelineTimer.begin()`; the loop calls
+`mark(stage)` after every stage and `PipelineTimer.end()` once the frame is done.
+Stage times are the gaps between consecutive marks and are kept in rolling windows,
+so `report()` always describes the last few seconds. A frame costs a handful of
+`time.perf_counter()` calls and list appends, cheap enough to leave on.
+
+    timer = PipelineTimer()
+    while True:
+        timing = timer.begin()
+        ret, frame = camera.read()
+        timing.mark("capture", getattr(camera, "timestamp", None))
+        small = process_frame(frame)
+        timing.mark("process")
+        cv2.imshow("Dino-Lite Camera", timer.overlay(small))
+        cv2.waitKey(1)
+        timing.mark("display")
+        timer.end(timing)
+"""
+
+import collections
+import time
+from typing import Deque, Dict, List, Optional, Tuple
+
+# Stage whose end is the moment a frame becomes visible
+DISPLAY_STAGE = "display"
+
+
+class FrameTiming:
+    """
+    Timestamps of one frame as it passes through the pipeline.
+
+    Attributes:
+        start (float): `time.perf_counter()` when the frame was requested.
+        arrived (float): When the frame reached the frame source, which is earlier
+            than the capture mark for sources that grab on a background thread.
+        marks (List[Tuple[str, float]]): (stage, time the stage finished) pairs.
+    """
+
+    __slots__ = ("start", "arrived", "marks")
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.arrived: Optional[float] = None
+        self.marks: List[Tuple[str, float]] = []
+
+    def mark(self, stage: str, arrived: Optional[float] = None) -> None:
+        """
+        Record the end of a stage.
+
+        Parameters:
+            stage (str): Stage name, e.g. "capture", "process", "display", "record".
+            arrived (float): For the capture stage, the frame source's `timestamp`.
+        """
+        now = time.perf_counter()
+        self.marks.append((stage, now))
+        if arrived is not None:
+            self.arrived = min(arrived, now)
+        elif self.arrived is None:
+            self.arrived = now
+
+
+class PipelineTimer:
+    """
+    Rolling per-stage latency and throughput of a frame loop.
+
+    Attributes:
+        window (int): Number of frames kept per stage.
+        display_hz (float): Monitor refresh rate used by the glass-to-glass estimate.
+    """
+
+    def __init__(self, window: int = 120, display_hz: float = 60.0) -> None:
+        self.window = window
+        self.display_hz = display_hz
+        self.frames = 0
+        self._stages: Dict[str, Deque[float]] = {}
+        self._ends: Deque[float] = collections.deque(maxlen=window)
+        self._arrivals: Deque[float] = collections.deque(maxlen=window)
+        # Age of each frame when it became visible, from arrival at the source
+        self._latency: Deque[float] = collections.deque(maxlen=window)
+        self._overlay_text: List[str] = []
+        self._overlay_time = 0.0
+
+    def begin(self) -> FrameTiming:
+        """Start timing a frame; call just before reading it."""
+        return FrameTiming()
+
+    def end(self, timing: FrameTiming) -> None:
+        """
+        Fold a finished frame into the rolling windows.
+
+        Parameters:
+            timing (FrameTiming): Record returned by `begin()` and marked by the loop.
+        """
+        previous = timing.start
+        for stage, when in timing.marks:
+            samples = self._stages.get(stage)
+            if samples is None:
+                samples = self._stages[stage] = collections.deque(maxlen=self.window)
+            samples.append(when - previous)
+            previous = when
+            if stage == DISPLAY_STAGE and timing.arrived is not None:
+                self._latency.append(when - timing.arrived)
+        self._ends.append(previous)
+        if timing.arrived is not None:
+            self._arrivals.append(timing.arrived)
+        self.frames += 1
+
+    def reset(self) -> None:
+        """Forget all samples."""
+        self.frames = 0
+        self._stages.clear()
+        self._ends.clear()
+        self._arrivals.clear()
+        self._latency.clear()
+
+    def fps(self) -> float:
+        """Frames completed per second over the window."""
+        if len(self._ends) < 2:
+            return 0.0
+        span = self._ends[-1] - self._ends[0]
+        return (len(self._ends) - 1) / span if span > 0 else 0.0
+
+    def frame_interval(self) -> float:
+        """Mean seconds between frames arriving from the source."""
+        if len(self._arrivals) < 2:
+            return 0.0
+        return (self._arrivals[-1] - self._arrivals[0]) / (len(self._arrivals) - 1)
+
+    def glass_to_glass_ms(self) -> float:
+        """
+        Estimate the time from light hitting the sensor to the frame being visible.
+
+        Adds one frame interval for exposure, readout and transfer, which OpenCV
+        cannot observe, to the measured age of the frame at display, plus half a
+        monitor refresh on average before the new image is scanned out.
+
+        Returns:
+            float: Estimated latency in milliseconds, 0 before any frame is displayed.
+        """
+        if not self._latency:
+            return 0.0
+        latency = sum(self._latency) / len(self._latency)
+        return (latency + self.frame_interval() + 0.5 / self.display_hz) * 1000.0
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """
+        Get per-stage statistics over the window.
+
+        Returns:
+            Dict[str, Dict[str, float]]: For each stage in pipeline order, "mean_ms",
+            "p50_ms", "p95_ms", "max_ms" and "max_fps", the rate the stage alone
+            could sustain. The "pipeline" entry holds the measured "fps" and the
+            "glass_to_glass_ms" estimate.
+        """
+        report: Dict[str, Dict[str, float]] = {}
+        for stage, samples in self._stages.items():
+            ordered = sorted(samples)
+            count = len(ordered)
+            mean = sum(ordered) / count
+            report[stage] = {
+                "mean_ms": mean * 1000.0,
+                "p50_ms": ordered[count // 2] * 1000.0,
+                "p95_ms": ordered[min(count - 1, int(count * 0.95))] * 1000.0,
+                "max_ms": ordered[-1] * 1000.0,
+                "max_fps": 1.0 / mean if mean > 0 else 0.0,
+            }
+        report["pipeline"] = {
+            "frames": float(self.frames),
+            "fps": self.fps(),
+            "glass_to_glass_ms": self.glass_to_glass_ms(),
+        }
+        return report
+
+    def format(self) -> str:
+        """Format `report()` as a table."""
+        report = self.report()
+        pipeline = report.pop("pipeline")
+        lines = [
+            f"{'stage':<10} {'mean':>8} {'p50':>8} {'p95':>8} {'max':>8} {'fps':>8}"
+        ]
+        for stage, stats in report.items():
+            lines.append(
+                f"{stage:<10} {stats['mean_ms']:>6.1f}ms {stats['p50_ms']:>6.1f}ms "
+                f"{stats['p95_ms']:>6.1f}ms {stats['max_ms']:>6.1f}ms "
+                f"{stats['max_fps']:>8.0f}"
+            )
+        lines.append(
+            f"{pipeline['fps']:.1f} fps over {len(self._ends)} frames, "
+            f"glass-to-glass ~{pipeline['glass_to_glass_ms']:.0f} ms"
+        )
+        return "\n".join(lines)
+
+    def overlay(self, frame, refresh: float = 0.5):
+        """
+        Draw throughput, glass-to-glass estimate and stage means onto a frame.
+        The text is rebuilt at most every `refresh` seconds.
+
+        Parameters:
+            frame (numpy.ndarray): Image to draw on, in place.
+            refresh (float): Seconds between text updates.
+
+        Returns:
+            numpy.ndarray: The same frame.
+        """
+        import cv2
+
+        now = time.perf_counter()
+        if now - self._overlay_time >= refresh:
+            self._overlay_time = now
+            report = self.report()
+            pipeline = report.pop("pipeline")
+            self._overlay_text = [
+                f"{pipeline['fps']:.1f} fps  "
+                f"glass-to-glass ~{pipeline['glass_to_glass_ms']:.0f} ms",
+                "  ".join(f"{s} {v['mean_ms']:.1f}" for s, v in report.items()),
+            ]
+        for row, text in enumerate(self._overlay_text):
+            y = 24 + row * 24
+            cv2.putText(
+                frame, text, (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 3
+            )
+            cv2.putText(
+                frame, text, (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 1
+            )
+        return frame
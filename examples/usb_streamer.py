@@ -10,13 +10,20 @@ WINDOW_WIDTH, WINDOW_HEIGHT = 1280, 960
 CAMERA_WIDTH, CAMERA_HEIGHT, CAMERA_FPS = 1280, 960, 30
 DNX64_PATH = "C:\\Program Files\\DNX64\\DNX64.dll"
 DEVICE_INDEX = 0
-# Camera index, please change it if you have more than one camera,
-# i.e. webcam, connected to your PC until CAM_INDEX is been set to first Dino-Lite product.
-CAM_INDEX = 0
+# Camera index. None finds the Dino-Lite camera of DEVICE_INDEX by name; if that fails
+# and you have more than one camera, i.e. webcam, set it to the Dino-Lite's index.
+CAM_INDEX = None
 # Buffer time for Dino-Lite to return value
 QUERY_TIME = 0.05
 # Buffer time to allow Dino-Lite to process command
 COMMAND_TIME = 0.25
+# Master dark/flat frames from `python -m DNX64 calibrate`
+CALIBRATION_DIR = "calibration"
+# Every n-th frame is stitched while building a mosaic
+MOSAIC_EVERY = 10
+# Also save the full-resolution mosaic when stopping; it can be large, and
+# Mosaic.load(directory).save(...) writes it later from the tiles
+MOSAIC_FULL_RES = False
 
 
 def clear_line(n=1):
@@ -35,17 +42,16 @@ def threaded(func):
     return wrapper
 
 
-def custom_microtouch_function():
+def custom_microtouch_function(event):
     """Executes when MicroTouch press event got detected"""
 
     timestamp = time.strftime("%Y%m%d_%H%M%S")
     clear_line(1)
-    print(f"{timestamp} MicroTouch press detected!", end="\r")
+    print(f"{timestamp} MicroTouch {event.gesture} detected!", end="\r")
 
 
 def print_amr(microscope):
-    config = microscope.GetConfig(DEVICE_INDEX)
-    if (config & 0x40) == 0x40:
+    if microscope.capabilities(DEVICE_INDEX).amr:
         amr = microscope.GetAMR(DEVICE_INDEX)
         amr = round(amr, 1)
         clear_line(1)
@@ -57,26 +63,12 @@ def print_amr(microscope):
 
 
 def print_config(microscope):
-    config = microscope.GetConfig(DEVICE_INDEX)
+    capabilities = microscope.capabilities(DEVICE_INDEX)
     clear_line(1)
     print("Config value =", end="")
-    print("0x{:X}".format(config), end="")
-    if (config & 0x80) == 0x80:
-        print(", EDOF", end="")
-    if (config & 0x40) == 0x40:
-        print(", AMR", end="")
-    if (config & 0x20) == 0x20:
-        print(", eFLC", end="")
-    if (config & 0x10) == 0x10:
-        print(", Aim Point Laser", end="")
-    if (config & 0xC) == 0x4:
-        print(", 2 segments LED", end="")
-    if (config & 0xC) == 0x8:
-        print(", 3 segments LED", end="")
-    if (config & 0x2) == 0x2:
-        print(", FLC", end="")
-    if (config & 0x1) == 0x1:
-        print(", AXI")
+    print("0x{:X}".format(capabilities.config), end="")
+    for name in capabilities.names():
+        print(f", {name}", end="")
     print("", end="\r")
     time.sleep(QUERY_TIME)
 
@@ -87,10 +79,12 @@ def set_index(microscope):
 
 
 def print_fov_mm(microscope):
-    amr = microscope.GetAMR(DEVICE_INDEX)
-    fov = microscope.FOVx(DEVICE_INDEX, amr)
-    amr = round(amr, 1)
-    fov = round(fov / 1000, 2)
+    fov = math.inf
+    if microscope.capabilities(DEVICE_INDEX).amr:
+        amr = microscope.GetAMR(DEVICE_INDEX)
+        fov = microscope.FOVx(DEVICE_INDEX, amr)
+        amr = round(amr, 1)
+        fov = round(fov / 1000, 2)
     if fov == math.inf:
         fov = round(microscope.FOVx(DEVICE_INDEX, 50.0) / 1000.0, 2)
         clear_line(1)
@@ -124,16 +118,130 @@ def led_off(microscope):
     print("led off", end="\r")
 
 
-def capture_image(frame):
-    """Capture an image and save it in the current working directory."""
+def flash_eflc(microscope, quadrant, level):
+    if microscope.capabilities(DEVICE_INDEX).eflc:
+        microscope.SetEFLC(DEVICE_INDEX, quadrant, 32)
+        time.sleep(0.1)
+        microscope.SetEFLC(DEVICE_INDEX, quadrant, level)
+    else:
+        clear_line(1)
+        print("It does not belong to the eFLC serie.", end="\r")
+
+
+def capture_image(frame, microscope):
+    """
+    Capture an image and save it in the current working directory, with the
+    magnification, exposure and lighting embedded as XMP; see DNX64.export.
+    """
 
+    export = importlib.import_module("DNX64.export")
     timestamp = time.strftime("%Y%m%d_%H%M%S")
     filename = f"image_{timestamp}.png"
-    cv2.imwrite(filename, frame)
+    metadata = export.frame_metadata(microscope, DEVICE_INDEX, frame.shape[1])
+    export.write_image(filename, frame, metadata)
     clear_line(1)
     print(f"Saved image to {filename}", end="\r")
 
 
+def capture_hdr_image(microscope, camera):
+    """Capture an exposure bracket around the current exposure, fuse it and save it."""
+
+    hdr = importlib.import_module("DNX64.hdr")
+    exposures = hdr.bracket_exposures(microscope.GetExposureValue(DEVICE_INDEX))
+    bracket = hdr.capture_bracket(microscope, camera, exposures, DEVICE_INDEX)
+    capture_image(hdr.fuse_exposures(bracket.frames), microscope)
+
+
+def load_corrector(microscope):
+    """Get the flat-field corrector of the current LED/FLC state, or None."""
+
+    calibration = importlib.import_module("DNX64.calibration")
+    key = calibration.calibration_key(microscope, DEVICE_INDEX)
+    corrector = calibration.CalibrationStore(CALIBRATION_DIR).corrector(key)
+    clear_line(1)
+    if corrector is None:
+        print(f"No calibration for {key} in {CALIBRATION_DIR}", end="\r")
+    else:
+        print(f"Flat-field correction on ({key})", end="\r")
+    return corrector
+
+
+def start_trigger():
+    """Start saving clips whenever the view changes, see DNX64.trigger."""
+
+    trigger = importlib.import_module("DNX64.trigger")
+    detector = trigger.ChangeDetector(threshold=0.02, pixel_delta=16)
+    clear_line(1)
+    print("Change-triggered capture on. Press m to stop.", end="\r")
+    return trigger.TriggeredCapture(detector, fps=CAMERA_FPS)
+
+
+def stop_trigger(trigger):
+    """Finish the current clip and stop change-triggered capture."""
+
+    trigger.close()
+    clear_line(1)
+    print(f"Change-triggered capture off, {trigger.triggers} clips saved", end="\r")
+
+
+def frame_size(camera):
+    """Frame size the camera negotiated, or the requested one if it reports none."""
+
+    return camera.width or CAMERA_WIDTH, camera.height or CAMERA_HEIGHT
+
+
+def start_software_ae(microscope, frame_width, frame_height):
+    """Take over the exposure with ROI-metered software auto exposure."""
+
+    autoexposure = importlib.import_module("DNX64.autoexposure")
+    # Meter the central quarter of the frame
+    roi = (frame_width // 4, frame_height // 4, frame_width // 2, frame_height // 2)
+    ae = autoexposure.SoftwareAE(microscope, DEVICE_INDEX, roi=roi)
+    ae.enable()
+    clear_line(1)
+    print("Software auto exposure on. Press a to stop.", end="\r")
+    return ae
+
+
+def stop_software_ae(ae):
+    """Hand the exposure back to the hardware auto exposure state found at start."""
+
+    ae.close()
+    stats = ae.stats()
+    clear_line(1)
+    print(
+        f"Software auto exposure off, {stats['converged']}/{stats['adjustments']} "
+        f"adjustments converged in {stats['mean_frames']:.1f} frames on average",
+        end="\r",
+    )
+
+
+def start_mosaic(microscope, frame_width):
+    """Start stitching the live view into a mosaic, see DNX64.mosaic."""
+
+    mosaic = importlib.import_module("DNX64.mosaic")
+    directory = f"mosaic_{time.strftime('%Y%m%d_%H%M%S')}"
+    clear_line(1)
+    print(f"Mosaic started in {directory}. Move the stage, press g to stop.", end="\r")
+    return mosaic.Mosaic.from_microscope(
+        microscope, DEVICE_INDEX, directory, frame_width=frame_width
+    )
+
+
+def stop_mosaic(mosaic):
+    """Save the mosaic overview, and the full resolution if enabled, and close it."""
+
+    filename = f"{mosaic.directory}_overview.png"
+    mosaic.save_overview(filename)
+    if MOSAIC_FULL_RES:
+        filename = f"{mosaic.directory}.png"
+        mosaic.save(filename)
+    mosaic.close()
+    cv2.destroyWindow("Mosaic")
+    clear_line(1)
+    print(f"Mosaic of {len(mosaic.tiles)} frames saved: {filename}", end="\r")
+
+
 def start_recording(frame_width, frame_height, fps):
     """Start recording video and return the video writer object."""
 
@@ -154,22 +262,24 @@ def stop_recording(video_writer):
     print("Video recording stopped", end="\r")
 
 
-def initialize_camera():
+def initialize_camera(microscope):
     """
     Setup OpenCV camera parameters and return the camera object.
-    Change CAM_INDEX to Dino-Lite camera index, which is based on the order of the camera connected to your PC.
-    Read the full doc of `cv2.VideoCapture()` at
-    https://docs.opencv.org/4.5.2/d8/dfe/classcv_1_1VideoCapture.html#aabce0d83aa0da9af802455e8cf5fd181 &
-    https://docs.opencv.org/3.4/dd/d43/tutorial_py_video_display.html
+    With CAM_INDEX = None the Dino-Lite camera of DEVICE_INDEX is found by name,
+    otherwise CAM_INDEX is used, which is based on the order of the camera connected to your PC.
+    The camera is opened with V4L2 on Linux and DirectShow on Windows, in MJPG format
+    with a one-frame buffer so the preview does not lag; see DNX64.sources.
     """
 
-    camera = cv2.VideoCapture(CAM_INDEX, cv2.CAP_DSHOW)
-    camera.set(cv2.CAP_PROP_FPS, CAMERA_FPS)
-    camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter.fourcc("m", "j", "p", "g"))
-    camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter.fourcc("M", "J", "P", "G"))
-    camera.set(cv2.CAP_PROP_FRAME_WIDTH, CAMERA_WIDTH)
-    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, CAMERA_HEIGHT)
-    return camera
+    sources = importlib.import_module("DNX64.sources")
+    return sources.open_source(
+        CAM_INDEX,
+        microscope,
+        DEVICE_INDEX,
+        width=CAMERA_WIDTH,
+        height=CAMERA_HEIGHT,
+        fps=CAMERA_FPS,
+    )
 
 
 def process_frame(frame):
@@ -185,9 +295,17 @@ def init_microscope(microscope):
     # Enabled MicroTouch Event
     microscope.EnableMicroTouch(True)
     time.sleep(0.1)
-    # Function to execute when MicroTouch event detected
-    microscope.SetEventCallback(custom_microtouch_function)
+    # Function to execute when MicroTouch event detected. The hub only queues
+    # presses on the DLL's callback thread and runs handlers on worker threads.
+    EventHub = getattr(importlib.import_module("DNX64.events"), "EventHub")
+    event_hub = EventHub()
+    event_hub.subscribe(
+        custom_microtouch_function, gestures=["press", "double_press", "long_press"]
+    )
+    event_hub.attach(microscope)
     time.sleep(0.1)
+    # Read device ID, exposure and AMR once; snapshots then use the cached values
+    importlib.import_module("DNX64.export").prime_metadata(microscope, DEVICE_INDEX)
 
     return microscope
 
@@ -203,6 +321,13 @@ def print_keymaps():
         f:Show fov \n \
         r:Record video or Stop Record video \n \
         s:Capture image \n \
+        h:Capture HDR image \n \
+        a:Software auto exposure on or off \n \
+        k:Dark/flat-field correction on or off \n \
+        m:Change-triggered capture on or off \n \
+        g:Start or stop mosaic stitching \n \
+        t:Show or hide frame timing overlay \n \
+        l:Print frame timing report \n \
         6:Set EFLC Quddrant 1 to flash \n \
         7:Set EFLC Quddrant 2 to flash \n \
         8:Set EFLC Quddrant 3 to flash \n \
@@ -212,9 +337,7 @@ def print_keymaps():
     )
 
 
-def config_keymaps(microscope, frame):
-    key = cv2.waitKey(1) & 0xFF
-
+def config_keymaps(microscope, frame, key):
     # Press '0' to set_index()
     if key == ord("0"):
         led_off(microscope)
@@ -241,31 +364,23 @@ def config_keymaps(microscope, frame):
 
     # Press 's' to save a snapshot
     if key == ord("s"):
-        capture_image(frame)
+        capture_image(frame, microscope)
 
     # Press '6' to let EFCL Quadrant 1 to flash
     if key == ord("6"):
-        microscope.SetEFLC(DEVICE_INDEX, 1, 32)
-        time.sleep(0.1)
-        microscope.SetEFLC(DEVICE_INDEX, 1, 31)
+        flash_eflc(microscope, 1, 31)
 
     # Press '7' to let EFCL Quadrant 2 to flash
     if key == ord("7"):
-        microscope.SetEFLC(DEVICE_INDEX, 2, 32)
-        time.sleep(0.1)
-        microscope.SetEFLC(DEVICE_INDEX, 2, 15)
+        flash_eflc(microscope, 2, 15)
 
     # Press '8' to let EFCL Quadrant 3 to flash
     if key == ord("8"):
-        microscope.SetEFLC(DEVICE_INDEX, 3, 32)
-        time.sleep(0.1)
-        microscope.SetEFLC(DEVICE_INDEX, 3, 15)
+        flash_eflc(microscope, 3, 15)
 
     # Press '9' to let EFCL Quadrant 4 to flash
     if key == ord("9"):
-        microscope.SetEFLC(DEVICE_INDEX, 4, 32)
-        time.sleep(0.1)
-        microscope.SetEFLC(DEVICE_INDEX, 4, 31)
+        flash_eflc(microscope, 4, 31)
 
     return key
 
@@ -273,7 +388,7 @@ def config_keymaps(microscope, frame):
 def start_camera(microscope):
     """Starts camera, initializes variables for video preview, and listens for shortcut keys."""
 
-    camera = initialize_camera()
+    camera = initialize_camera(microscope)
 
     if not camera.isOpened():
         print("Error opening the camera device.")
@@ -282,34 +397,112 @@ def start_camera(microscope):
     recording = False
     video_writer = None
     inits = True
+    # Per-stage frame timing, cheap enough to keep on; see DNX64.timing
+    timer = getattr(importlib.import_module("DNX64.timing"), "PipelineTimer")()
+    show_timing = False
+    corrector = None
+    trigger = None
+    mosaic = None
+    frame_count = 0
+    software_ae = None
 
     print_keymaps()
 
     while True:
+        timing = timer.begin()
         ret, frame = camera.read()
         if ret:
+            timing.mark("capture", camera.timestamp)
+            if corrector is not None:
+                frame = corrector.apply(frame)
+                timing.mark("correct")
+            if software_ae is not None:
+                software_ae.update(frame)
+                timing.mark("exposure")
+            if trigger is not None:
+                if trigger.update(frame):
+                    clear_line(1)
+                    print(f"Change detected, saving {trigger.last_clip}", end="\r")
+                timing.mark("trigger")
+            frame_count += 1
+            if mosaic is not None and frame_count % MOSAIC_EVERY == 0:
+                if mosaic.add(frame) is not None:
+                    cv2.imshow("Mosaic", mosaic.overview())
+                timing.mark("mosaic")
             resized_frame = process_frame(frame)
+            timing.mark("process")
+            if show_timing:
+                timer.overlay(resized_frame)
             cv2.imshow("Dino-Lite Camera", resized_frame)
 
-            if recording:
-                video_writer.write(frame)
+        # The window is repainted inside cv2.waitKey()
+        key = cv2.waitKey(1) & 0xFF
+
+        if ret:
+            timing.mark("display")
             # Only initialize once in this while loop
             if inits:
                 microscope = init_microscope(microscope)
                 inits = False
-
-        key = config_keymaps(microscope, frame)
+                timing.mark("init")
+            if recording:
+                video_writer.write(frame)
+                timing.mark("record")
+
+        config_keymaps(microscope, frame, key)
+
+        # Press 'h' to capture an HDR image from an exposure bracket
+        if key == ord("h"):
+            capture_hdr_image(microscope, camera)
+
+        # Press 'a' to turn software auto exposure on or off
+        if key == ord("a"):
+            if software_ae is None:
+                software_ae = start_software_ae(microscope, *frame_size(camera))
+            else:
+                software_ae = stop_software_ae(software_ae)
+
+        # Press 'k' to turn dark/flat-field correction on or off
+        if key == ord("k"):
+            corrector = load_corrector(microscope) if corrector is None else None
+
+        # Press 'm' to start or stop change-triggered capture
+        if key == ord("m"):
+            trigger = start_trigger() if trigger is None else stop_trigger(trigger)
+
+        # Press 'g' to start or stop stitching a mosaic
+        if key == ord("g"):
+            if mosaic is None:
+                mosaic = start_mosaic(microscope, frame_size(camera)[0])
+            else:
+                mosaic = stop_mosaic(mosaic)
+
+        # Press 't' to show or hide the timing overlay
+        if key == ord("t"):
+            show_timing = not show_timing
+
+        # Press 'l' to print the per-stage timing report
+        if key == ord("l"):
+            clear_line(1)
+            print(timer.format())
 
         # Press 'r' to start recording
         if key == ord("r") and not recording:
             recording = True
-            video_writer = start_recording(CAMERA_WIDTH, CAMERA_HEIGHT, CAMERA_FPS)
+            video_writer = start_recording(
+                *frame_size(camera), camera.fps or CAMERA_FPS
+            )
 
         # Press 'r' again to stop recording
         elif key == ord("r") and recording:
             recording = False
             stop_recording(video_writer)
 
+        # Key handlers may block, e.g. HDR capture; time them apart from display
+        if ret:
+            timing.mark("keys")
+            timer.end(timing)
+
         # Press ESC to close
         if key == 27:
             clear_line(1)
@@ -317,6 +510,12 @@ def start_camera(microscope):
 
     if video_writer is not None:
         video_writer.release()
+    if trigger is not None:
+        stop_trigger(trigger)
+    if mosaic is not None:
+        stop_mosaic(mosaic)
+    if software_ae is not None:
+        stop_software_ae(software_ae)
     camera.release()
     cv2.destroyAllWindows()
 
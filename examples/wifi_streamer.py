@@ -46,23 +46,31 @@ def capture_image_wifi(microscope):
     counter[0] += 1
     filename = f"streamer_image_{counter[0]}.jpg"
     microscope.GetWiFiImage(filename)
+    export = importlib.import_module("DNX64.export")
+    export.attach_metadata(filename, export.frame_metadata(microscope, DEVICE_INDEX))
     print(f"Saved image from Wi-Fi Streamer to: {filename}")
 
 
-def capture_image(frame):
-    """Capture an image and save it in the current working directory."""
+def capture_image(frame, microscope):
+    """Capture an image and save it in the current working directory, with metadata."""
 
+    export = importlib.import_module("DNX64.export")
     timestamp = time.strftime("%Y%m%d_%H%M%S")
     filename = f"image_{timestamp}.png"
-    cv2.imwrite(filename, frame)
+    metadata = export.frame_metadata(microscope, DEVICE_INDEX, frame.shape[1])
+    export.write_image(filename, frame, metadata)
     print(f"Saved image to {filename}")
 
 
 def initialize_camera():
-    """Setup OpenCV camera parameters and return the camera object."""
+    """
+    Connect to the streamer and return the camera object.
+    Frames are pulled on a background thread and only the newest one is decoded,
+    so the preview does not lag behind; see DNX64.sources.
+    """
 
-    camera = cv2.VideoCapture(DINO_STREAMER, cv2.CAP_FFMPEG)
-    return camera
+    sources = importlib.import_module("DNX64.sources")
+    return sources.MjpegFrameSource(DINO_STREAMER)
 
 
 def process_frame(frame):
@@ -102,7 +110,7 @@ def start_camera(microscope):
 
         # Press 's' to save a snapshot
         if key == ord("s"):
-            capture_image(frame)
+            capture_image(frame, microscope)
 
         # Press ESC to close
         if key == 27:
@@ -121,6 +129,8 @@ def run_wifi():
     # Initialize microscope
     micro_scope = DNX64(DNX64_PATH)
     micro_scope.SetVideoDeviceIndex(DEVICE_INDEX)
+    # Read device ID, exposure and AMR once; captures then use the cached values
+    importlib.import_module("DNX64.export").prime_metadata(micro_scope, DEVICE_INDEX)
     start_camera(micro_scope)
 
 
@@ -1,6 +1,7 @@
-from examples.usb_streamer import run_usb
-from examples.wifi_streamer import run_wifi
-
 if __name__ == "__main__":
+    # Import the streamer only when it runs, so OpenCV is not loaded otherwise.
+    from examples.usb_streamer import run_usb
+
     run_usb()
+    # from examples.wifi_streamer import run_wifi
     # run_wifi()
@@ -1,7 +1,7 @@
-from win32api import HIWORD, LOWORD, GetFileVersionInfo
-
-
 def get_dll_version(filename):
+    # pywin32 is only needed here, so importing this module works without it.
+    from win32api import HIWORD, LOWORD, GetFileVersionInfo
+
     info = GetFileVersionInfo(filename, "\\")
     ms = info["FileVersionMS"]
     ls = info["FileVersionLS"]